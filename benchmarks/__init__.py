@@ -0,0 +1 @@
+"""Microbenchmarks; run one with ``python3 -m benchmarks.<name>``."""
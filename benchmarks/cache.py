@@ -0,0 +1,52 @@
+"""Measure looking up a pull request's usernames in the shared cache.
+
+The cache is a fake Redis server on localhost, in the same process, so a
+round trip costs far less than one across a network; the round trips are
+counted as well as timed. The usernames are looked up one per call, as a
+cache without multi-get would, and all in one call.
+"""
+import asyncio
+import time
+
+from ni import cache
+from ni.test import util
+
+
+USERNAMES = 50
+
+
+async def measure(number: int) -> None:
+    fake = await util.FakeRedis().start()
+    redis = cache.RedisCache(util.FakeServerHost(), fake.url)
+    keys = [f'cla:user{n}' for n in range(USERNAMES)]
+    await redis.set_many({key: b'signed' for key in keys}, 60)
+
+    async def one_by_one() -> None:
+        for key in keys:
+            await redis.get_many([key])
+
+    async def together() -> None:
+        await redis.get_many(keys)
+
+    print(f'{"lookup":>11} {"ms/PR":>7} {"round trips/PR":>15}')
+    try:
+        for label, lookup in (('one by one', one_by_one), ('multi-get', together)):
+            round_trips = redis.round_trips
+            started = time.perf_counter()
+            for _ in range(number):
+                await lookup()
+            elapsed = time.perf_counter() - started
+            print(f'{label:>11} {elapsed / number * 1000:>7.3f} '
+                  f'{(redis.round_trips - round_trips) / number:>15.0f}')
+    finally:
+        await redis.close()
+        await fake.stop()
+
+
+def main(number: int = 200) -> None:
+    print(f'{USERNAMES} usernames per pull request, {number} pull requests')
+    asyncio.run(measure(number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Measure the tail latency of upstream calls with and without hedging.
+
+Call latencies are drawn from a heavy-tailed distribution: most calls are
+fast, but a few stall for much longer, as GitHub and bugs.python.org do.
+"""
+import asyncio
+import random
+
+from ni import upstream
+from ni.test import traffic
+
+
+FAST = 0.002
+STALLED = 0.05
+STALL_RATE = 0.03
+
+
+async def request() -> None:
+    stalled = random.random() < STALL_RATE
+    await asyncio.sleep(STALLED if stalled else random.uniform(FAST, 2 * FAST))
+
+
+async def measure(number: int, budget: float) -> None:
+    service = upstream.Upstream('example.com', hedge_budget=budget)
+    loop = asyncio.get_running_loop()
+    latencies = []
+    for _ in range(number):
+        started = loop.time()
+        await service.call(request, hedge=True)
+        latencies.append(loop.time() - started)
+    print(f'{budget:>7.0%} {traffic.percentile(latencies, 0.5) * 1000:>7.1f} '
+          f'{traffic.percentile(latencies, 0.99) * 1000:>7.1f} '
+          f'{service.hedges / number:>8.1%}')
+
+
+def main(number: int = 2000) -> None:
+    print(f'{"budget":>7} {"p50 ms":>7} {"p99 ms":>7} {"hedged":>8}')
+    for budget in (0.0, 0.05, 0.1):
+        random.seed(0)
+        asyncio.run(measure(number, budget))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Measure the write amplification and throughput of journaling deliveries.
+
+Deliveries arrive with increasing concurrency; each is appended, then
+completed. Write amplification is the bytes written to the journal (entry,
+done frame and compaction) per byte of serialized delivery.
+"""
+import asyncio
+import tempfile
+import time
+
+from ni import github
+from ni import journal
+from ni.test import util
+from benchmarks import webhook
+
+
+async def deliver(deliveries: journal.Journal, key: str, data: bytes) -> None:
+    async with deliveries.entry(key, data):
+        # Stand-in for processing the delivery.
+        await asyncio.sleep(0)
+
+
+async def measure(number: int) -> None:
+    request = util.FakeRequest()
+    request[github._SCREENED_EVENT] = github.PullRequest.from_payload(
+        webhook.payload('synchronize'), '12345')
+    _, data = github.Host.dump(request)
+    print(f'serialized delivery: {len(data)} bytes')
+    print(f'{"concurrency":>11} {"deliveries/s":>13} {"fsyncs/delivery":>16} '
+          f'{"amplification":>14}')
+    for concurrency in (1, 8, 64):
+        with tempfile.TemporaryDirectory() as directory:
+            deliveries = journal.Journal(directory)
+            deliveries.open()
+            syncs = deliveries.syncs
+            start = time.perf_counter()
+            for batch in range(0, number, concurrency):
+                await asyncio.gather(*(deliver(deliveries, str(n), data)
+                                       for n in range(batch, batch + concurrency)))
+            await deliveries.close()
+            elapsed = time.perf_counter() - start
+            print(f'{concurrency:>11} {number / elapsed:>13.0f} '
+                  f'{(deliveries.syncs - syncs) / number:>16.3f} '
+                  f'{deliveries.bytes_written / (number * len(data)):>14.3f}')
+
+
+def main(number: int = 512) -> None:
+    asyncio.run(measure(number))
+
+
+if __name__ == '__main__':
+    main()
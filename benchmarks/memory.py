@@ -0,0 +1,62 @@
+"""Measure the memory held per queued delivery and per problem result.
+
+A screened delivery waits in its repository's queue until it is processed;
+what is kept for it is compared between the whole webhook event and the
+pull request record. Problem results are held for every pull request of a
+batch, mostly empty.
+"""
+import json
+import tracemalloc
+from typing import Any, Callable, List
+
+from gidgethub import sansio
+
+from ni import abc as ni_abc
+from ni import github
+from benchmarks import webhook
+
+
+def allocated(create: Callable[[int], Any], number: int) -> float:
+    """Return the bytes allocated per object created and kept."""
+    kept: List[Any] = []
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        for index in range(number):
+            kept.append(create(index))
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (after - before) / number
+
+
+def main(number: int = 1000) -> None:
+    body = json.dumps(webhook.payload('synchronize')).encode('utf-8')
+    # Every delivery is decoded from its own body, as it arrives.
+    headers = {'content-type': 'application/json', 'x-github-event': 'pull_request',
+               'x-github-delivery': '12345'}
+
+    def event(index: int) -> sansio.Event:
+        return sansio.Event.from_http(headers, body)
+
+    def pull_request(index: int) -> github.PullRequest:
+        return github.PullRequest.from_payload(sansio.Event.from_http(headers, body).data,
+                                               '12345')
+
+    def problems_dict(index: int) -> Any:
+        # Most batches find nothing wrong.
+        if index % 10:
+            return {}
+        return {ni_abc.Status.not_signed: {f'user{index}'}}
+
+    def problems(index: int) -> ni_abc.Problems:
+        return ni_abc.Problems(problems_dict(index))
+
+    print(f'{"kept":>14} {"bytes":>8}')
+    for label, create in (('event', event), ('pull request', pull_request),
+                          ('dict of sets', problems_dict), ('Problems', problems)):
+        print(f'{label:>14} {allocated(create, number):>8.0f}')
+
+
+if __name__ == '__main__':
+    main()
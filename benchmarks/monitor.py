@@ -0,0 +1,97 @@
+"""Measure the overhead of monitoring the event loop.
+
+Concurrent deliveries each decode and re-encode a large webhook payload, a
+few times over with the loop switching in between. The same work is timed
+without the monitor, with it watching an unstalled loop, and with it
+sampling the loop throughout. The watchdog thread's own CPU time, as a
+share of the time monitored, is reported too, being steadier than the
+comparison on a busy machine.
+"""
+import asyncio
+import json
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from ni import monitor
+from ni.test import util
+from benchmarks import webhook
+
+
+# Few enough that a round of the loop stays well under the lag threshold.
+CONCURRENCY = 16
+
+
+async def respond(body: bytes) -> None:
+    for _ in range(4):
+        json.dumps(json.loads(body))
+        await asyncio.sleep(0)
+
+
+async def deliver(body: bytes, number: int) -> None:
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one() -> None:
+        async with semaphore:
+            await respond(body)
+
+    await asyncio.gather(*(one() for _ in range(number)))
+
+
+async def measure(body: bytes, number: int, directory: Optional[str],
+                  profiling: bool = False) -> Tuple[float, float]:
+    """Return the CPU time taken, and the monitor's own share of the time."""
+    app = web.Application()
+    loop_monitor = None
+    if directory is not None:
+        loop_monitor = monitor.LoopMonitor(
+            util.FakeServerHost(), directory, focus=respond.__code__,
+            # Sample for the whole run, starting with a stall.
+            profile_seconds=3600.0 if profiling else monitor.PROFILE_SECONDS)
+        await loop_monitor.start(app)
+        if profiling:
+            await asyncio.sleep(monitor.HEARTBEAT_INTERVAL)
+            time.sleep(2 * monitor.LAG_THRESHOLD + monitor.HEARTBEAT_INTERVAL)
+            await asyncio.sleep(2 * monitor.HEARTBEAT_INTERVAL)
+            assert loop_monitor.stalls == 1
+    # CPU time counts the watchdog thread too, and is less disturbed by
+    # other processes than the wall clock.
+    started = time.process_time()
+    await deliver(body, number)
+    elapsed = time.process_time() - started
+    if loop_monitor is None:
+        return elapsed, 0.0
+    # Only the forced stall may have been caught.
+    assert loop_monitor.stalls == int(profiling), loop_monitor.stalls
+    overhead = loop_monitor.overhead()
+    await loop_monitor.stop(app)
+    return elapsed, overhead
+
+
+def main(number: int = 500, runs: int = 9) -> None:
+    body = json.dumps(webhook.payload('synchronize')).encode('utf-8')
+    print(f'payload: {len(body)} bytes, {number} deliveries, best of {runs} runs')
+    configurations = {'off': (False, False), 'watching': (True, False),
+                      'sampling': (True, True)}
+    times: Dict[str, List[float]] = {label: [] for label in configurations}
+    overheads: Dict[str, List[float]] = {label: [] for label in configurations}
+    with tempfile.TemporaryDirectory() as directory:
+        # Interleaved, so that a noisy neighbour slows every configuration.
+        for _ in range(runs):
+            for label, (monitored, profiling) in configurations.items():
+                elapsed, overhead = asyncio.run(measure(
+                    body, number, directory if monitored else None, profiling))
+                times[label].append(elapsed)
+                overheads[label].append(overhead)
+    baseline = min(times['off'])
+    print(f'{"":>9} {"CPU time":>9} {"vs off":>7} {"watchdog":>9}')
+    for label, measured in times.items():
+        print(f'{label:>9} {min(measured):>8.3f}s {min(measured) / baseline - 1:>+7.2%} '
+              f'{statistics.median(overheads[label]):>9.3%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Measure the throughput of rejecting uninteresting webhook deliveries.
+
+The legacy path creates a client session and fully processes the request
+before rejecting it, which is what happened before Host.screen() existed.
+"""
+import asyncio
+import time
+from unittest import mock
+
+import aiohttp
+
+from ni import __main__
+from ni import abc as ni_abc
+from ni import github
+from ni.test import util
+from benchmarks import webhook
+
+
+async def legacy(server: ni_abc.ServerHost, request: util.FakeRequest) -> None:
+    async with aiohttp.ClientSession() as client:
+        try:
+            await github.Host.process(server, request, client)
+        except ni_abc.ResponseExit:
+            pass
+
+
+async def measure(number: int) -> None:
+    server = util.FakeServerHost()
+    server.secret = webhook.SECRET
+    data = webhook.payload('labeled')
+    with mock.patch('ni.__main__.ContribHost', github.Host):
+        respond = __main__.handler(aiohttp.ClientSession, server, None)  # type: ignore
+        paths = (('legacy', lambda request: legacy(server, request)),
+                 ('screened', respond))
+        for name, path in paths:
+            requests = [webhook.request(data) for _ in range(number)]
+            start = time.perf_counter()
+            for request in requests:
+                await path(request)
+            elapsed = time.perf_counter() - start
+            print(f'{name:>10}: {number / elapsed:8.0f} rejections/s')
+
+
+def main(number: int = 2000) -> None:
+    asyncio.run(measure(number))
+
+
+if __name__ == '__main__':
+    main()
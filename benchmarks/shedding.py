@@ -0,0 +1,64 @@
+"""Measure queue latency and shedding by priority under overload.
+
+Deliveries arrive half again as fast as they can be processed, a few newly
+opened pull requests among many pushes. They are queued with their
+priorities, and again all at the same priority as before tiers existed.
+"""
+import asyncio
+import random
+from typing import Dict, List
+
+from ni import abc as ni_abc
+from ni import scheduler
+from ni.test import traffic
+
+
+CONCURRENCY = 8
+QUEUE_SIZE = 64
+SERVICE_TIME = 0.005
+OVERLOAD = 1.5
+# Deliveries arrive in batches, every tick.
+TICK = 0.01
+MIX = {ni_abc.Priority.high: 0.1, ni_abc.Priority.normal: 0.6, ni_abc.Priority.low: 0.3}
+
+
+async def measure(number: int, tiered: bool) -> None:
+    fair = scheduler.FairScheduler(concurrency=CONCURRENCY, queue_size=QUEUE_SIZE)
+    loop = asyncio.get_running_loop()
+    waited: Dict[ni_abc.Priority, List[float]] = {priority: [] for priority in MIX}
+    shed: Dict[ni_abc.Priority, int] = {priority: 0 for priority in MIX}
+
+    async def deliver(priority: ni_abc.Priority) -> None:
+        arrived = loop.time()
+        tier = priority if tiered else ni_abc.Priority.normal
+        try:
+            async with fair.slot(f'repo{random.randrange(4)}', tier):
+                waited[priority].append(loop.time() - arrived)
+                await asyncio.sleep(SERVICE_TIME)
+        except scheduler.Shed:
+            shed[priority] += 1
+
+    batch = round(OVERLOAD * CONCURRENCY * TICK / SERVICE_TIME)
+    deliveries = []
+    for priority in random.choices(list(MIX), weights=list(MIX.values()), k=number):
+        deliveries.append(asyncio.ensure_future(deliver(priority)))
+        if len(deliveries) % batch == 0:
+            await asyncio.sleep(TICK)
+    await asyncio.gather(*deliveries)
+    for priority in MIX:
+        arrived = len(waited[priority]) + shed[priority]
+        print(f'{"tiered" if tiered else "flat":>7} {priority.name:>7} '
+              f'{traffic.percentile(waited[priority], 0.5) * 1000:>7.1f} '
+              f'{traffic.percentile(waited[priority], 0.99) * 1000:>7.1f} '
+              f'{shed[priority] / arrived:>6.1%}')
+
+
+def main(number: int = 5000) -> None:
+    print(f'{"":>7} {"tier":>7} {"p50 ms":>7} {"p99 ms":>7} {"shed":>6}')
+    for tiered in (False, True):
+        random.seed(0)
+        asyncio.run(measure(number, tiered))
+
+
+if __name__ == '__main__':
+    main()
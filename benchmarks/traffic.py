@@ -0,0 +1,49 @@
+"""Replay recorded traffic, to compare upstream calls and latency between commits.
+
+Record the fixtures with ``python3 -m ni.test.traffic DIRECTORY``, then run
+``python3 -m benchmarks.traffic DIRECTORY [SCALE]`` on each commit. Upstream
+latencies and the gaps between deliveries are multiplied by the scale
+(0.01 by default, i.e. a day of traffic replays in under fifteen minutes).
+"""
+import asyncio
+import sys
+
+from ni import __main__
+from ni import bpo
+from ni.test import traffic
+from ni.test import util
+
+
+async def measure(directory: str, scale: float) -> None:
+    deliveries, exchanges = traffic.load(directory)
+    server = util.FakeServerHost()
+    session = traffic.ReplaySession(exchanges, scale)
+    respond = __main__.handler(session, server, bpo.Host(server))  # type: ignore
+    report = await traffic.replay(deliveries, respond, scale)
+    print(f'{len(deliveries)} deliveries, {len(exchanges)} recorded exchanges, '
+          f'scale {scale}')
+    print('responses:', ', '.join(f'{status}: {count}'
+                                  for status, count in sorted(report.statuses.items())))
+    summary = report.summary()
+    print('handler latency (s):', ', '.join(f'{name} {summary[name]:.4f}'
+                                            for name in ('p50', 'p90', 'p99')))
+    print('upstream calls:')
+    for target, count in sorted(session.call_counts().items()):
+        print(f'{count:>8} {target}')
+    upstream = [latency for _, _, latency in session.calls]
+    print('upstream latency (s):', ', '.join(
+        f'p{round(fraction * 100)} {traffic.percentile(upstream, fraction):.4f}'
+        for fraction in (0.5, 0.9, 0.99)))
+    if session.unmatched:
+        print(f'{len(session.unmatched)} requests were never recorded, e.g. '
+              f'{session.unmatched[0]}')
+
+
+def main() -> None:
+    directory = sys.argv[1]
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    asyncio.run(measure(directory, scale))
+
+
+if __name__ == '__main__':
+    main()
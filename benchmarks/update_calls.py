@@ -0,0 +1,80 @@
+"""Count the GitHub API calls made per event when labeling vs. setting a status.
+
+Each update is counted as the first a process makes to the pull request,
+which has no CLA comment yet, and then again as a repeat of it.
+"""
+import asyncio
+import itertools
+from typing import List, Tuple
+
+from ni import abc as ni_abc
+from ni import github
+from ni.test import test_github
+from ni.test import util
+
+
+class CountingSession(util.FakeSession):
+
+    """Answer every request, recording it."""
+
+    def __init__(self, current_label: str) -> None:
+        super().__init__()
+        self.current_label = current_label
+        self.requested: List[Tuple[str, str]] = []
+        self.issue = test_github.example('issues.json')
+
+    def request(self, method, url, headers=None, data=None):
+        self.requested.append((method, url))
+        if method == 'GET' and url.endswith('/labels'):
+            data = [{'name': self.current_label}] if self.current_label else []
+        elif method == 'GET' and url.endswith('/comments'):
+            data = []
+        elif method == 'GET' and url.endswith('/user'):
+            data = {'login': 'the-knights-who-say-ni'}
+        elif method == 'GET':
+            data = self.issue
+        else:
+            data = {}
+        self.next_response = util.FakeResponse(status=200, data=data)
+        return self
+
+
+async def calls(mode: str, event: github.PullRequestEvent, current_label: str,
+                problems: dict) -> Tuple[int, int]:
+    """Return the calls made by the first update and by a repeat of it."""
+    server = util.FakeServerHost()
+    if mode == 'status':
+        server.status_repos = frozenset(['microsoft/pyjion'])
+    payload = test_github.example(f'{event.value}.json')
+    for memo in (github._comment_digests, github._comment_urls, github._logins):
+        memo.clear()
+    counts = []
+    for _ in range(2):
+        session = CountingSession(current_label)
+        contrib = github.Host(server, session, event, payload)
+        await contrib.update(problems)
+        counts.append(len(session.requested))
+    return counts[0], counts[1]
+
+
+async def measure() -> None:
+    events = [github.PullRequestEvent.opened, github.PullRequestEvent.synchronize,
+              github.PullRequestEvent.unlabeled]
+    labels = ['', github.CLA_OK, github.NO_CLA]
+    outcomes = {'signed': {}, 'not signed': {ni_abc.Status.not_signed: {'someone'}}}
+    print(f'{"event":>12} {"label before":>14} {"CLA":>11} {"labels":>7} {"again":>7} '
+          f'{"status":>7} {"again":>7}')
+    totals = [0] * 4
+    for event, label, (outcome, problems) in itertools.product(
+            events, labels, outcomes.items()):
+        counts = [count for mode in ('label', 'status')
+                  for count in await calls(mode, event, label, problems)]
+        totals = [total + count for total, count in zip(totals, counts)]
+        print(f'{event.value:>12} {label or "-":>14} {outcome:>11} '
+              + ' '.join(f'{count:>7}' for count in counts))
+    scenarios = len(events) * len(labels) * len(outcomes)
+    print(f'{"mean":>39} ' + ' '.join(f'{total / scenarios:>7.2f}' for total in totals))
+
+
+if __name__ == '__main__':
+    asyncio.run(measure())
@@ -0,0 +1,85 @@
+"""Compare webhook parsing against gidgethub's sansio.Event.from_http()."""
+import asyncio
+import copy
+import hashlib
+import hmac
+import json
+import timeit
+
+from gidgethub import sansio
+
+from ni import github
+from ni.test import test_github
+from ni.test import util
+
+
+SECRET = 'secret'
+
+
+def payload(action: str) -> dict:
+    """A pull request with a long description and many labels."""
+    data = copy.deepcopy(test_github.example('opened.json'))
+    data['action'] = action
+    data['pull_request']['body'] = 'Lorem ipsum dolor sit amet. ' * 2000
+    data['pull_request']['labels'] = [
+        {'id': n, 'name': f'label {n}', 'color': 'ededed', 'default': False,
+         'url': f'https://api.github.com/repos/Microsoft/Pyjion/labels/label%20{n}'}
+        for n in range(100)]
+    return data
+
+
+class EncodedRequest(util.FakeRequest):
+
+    """A fake request which encodes its payload once, up front."""
+
+    def __init__(self, data: dict) -> None:
+        super().__init__(data)
+        self._body = json.dumps(data).encode('utf-8')
+
+    @property
+    def content(self) -> util.FakeStreamReader:
+        return util.FakeStreamReader(self._body)
+
+    @property
+    def content_length(self) -> int:
+        return len(self._body)
+
+    async def read(self) -> bytes:
+        return self._body
+
+
+def request(data: dict) -> EncodedRequest:
+    fake = EncodedRequest(data)
+    body = fake._body
+    signature = hmac.new(SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    fake.headers['x-hub-signature-256'] = 'sha256=' + signature
+    return fake
+
+
+async def baseline(fake: EncodedRequest) -> None:
+    sansio.Event.from_http(fake.headers, await fake.read(), secret=SECRET)
+
+
+async def current(fake: EncodedRequest) -> None:
+    server = util.FakeServerHost()
+    server.secret = SECRET
+    try:
+        await github.Host._read_event(server, fake)
+    except github.ni_abc.ResponseExit:
+        pass
+
+
+def main(number: int = 200) -> None:
+    loop = asyncio.new_event_loop()
+    for action in ('synchronize', 'labeled'):
+        fake = request(payload(action))
+        print(f'{action} ({fake.content_length:,} bytes)')
+        for name, parse in (('from_http', baseline), ('Host', current)):
+            seconds = timeit.timeit(lambda: loop.run_until_complete(parse(fake)),
+                                    number=number)
+            print(f'  {name:>10}: {seconds / number * 1e6:8.1f} µs')
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
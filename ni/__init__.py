@@ -6,6 +6,28 @@ this also makes forks with different backend needs easier to manage as they
 will only need to change this file and add their own implementations to their
 fork.
 """
-from .bpo import Host as CLAHost
-from .github import Host as ContribHost
-from .heroku import Host as ServerHost
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .bpo import Host as CLAHost
+    from .github import Host as ContribHost
+    from .heroku import Host as ServerHost
+
+# The hosts are only imported when first used so that tools which only need
+# e.g. ni.index don't pay for importing aiohttp and gidgethub.
+_HOSTS = {
+    'CLAHost': '.bpo',
+    'ContribHost': '.github',
+    'ServerHost': '.heroku',
+}
+
+
+def __getattr__(name: str) -> Any:
+    try:
+        module = _HOSTS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    host = importlib.import_module(module, __name__).Host
+    globals()[name] = host
+    return host
@@ -1,7 +1,16 @@
 """Implement a server to check if a contribution is covered by a CLA(s)."""
+import asyncio
+import collections
+import contextlib
+import hmac
 import http
+import itertools
+import time
+import types
 
-from typing import Awaitable, Callable
+from typing import (AbstractSet, Any, AsyncContextManager, AsyncIterator, Awaitable,
+                    Callable, Counter, Deque, Dict, Iterable, Iterator, List, Mapping,
+                    NamedTuple, Optional, Tuple)
 
 # ONLY third-party libraries that don't break the abstraction promise may be
 # imported.
@@ -9,48 +18,625 @@ import aiohttp
 from aiohttp import web
 
 from . import abc as ni_abc
+from . import journal
+from . import monitor
+from . import scheduler
+from . import upstream
+from . import workers
 from . import CLAHost
 from . import ContribHost
 from . import ServerHost
 
-import os
-import sentry_sdk
 
-sentry_sdk.init(os.environ.get("SENTRY_DSN"))
+READY_ROUTE = 'GET', '/ready'
+ADMIN_ROUTE = 'GET', '/admin'
+# The admin route lists at most this many of the oldest in-flight deliveries.
+ADMIN_DELIVERIES = 50
+# Replayed requests carry the sequence number of their journal entry.
+JOURNAL_SEQUENCE = 'ni.journal.sequence'
+# How many unfinished deliveries are replayed at once.
+REPLAY_CONCURRENCY = 4
+# The steps completed for a delivery which then failed are kept this many
+# seconds, for at most this many deliveries, to be reused on redelivery.
+STEPS_TTL = 600.0
+STEPS_SIZE = 256
+# How many seconds a request turned away under load is asked to wait, should
+# it not be kept to be handled again.
+SHED_RETRY_AFTER = 60
+# At most this many requests turned away under load are kept, and whether
+# nothing is waiting any more (so they can be handled again) is checked
+# this often, in seconds.
+SHED_SIZE = 1024
+SHED_CHECK_INTERVAL = 1.0
+
+
+class ClientPool:
+
+    """Share one pool of connections between the client sessions of requests.
+
+    Until opened, every session has a connection pool of its own.
+    """
+
+    def __init__(self, session_class: Callable[..., aiohttp.ClientSession]
+                 = aiohttp.ClientSession) -> None:
+        self.session_class = session_class
+        self._connector: Optional[aiohttp.BaseConnector] = None
+        # Requests in flight, those waiting for a free connection and how
+        # connections were obtained, counted through tracing.
+        self.requests = self.waiting = self.created = self.reused = 0
+        self._trace = aiohttp.TraceConfig()
+        self._trace.on_request_start.append(self._started)
+        self._trace.on_request_end.append(self._ended)
+        self._trace.on_request_exception.append(self._ended)
+        self._trace.on_connection_queued_start.append(self._queued)
+        self._trace.on_connection_queued_end.append(self._dequeued)
+        self._trace.on_connection_create_end.append(self._created)
+        self._trace.on_connection_reuseconn.append(self._reused)
+
+    def __call__(self) -> aiohttp.ClientSession:
+        return self.session_class(connector=self._connector,
+                                  connector_owner=self._connector is None,
+                                  trace_configs=[self._trace])
+
+    async def _started(self, session: aiohttp.ClientSession,
+                       context: types.SimpleNamespace, params: Any) -> None:
+        self.requests += 1
+
+    async def _ended(self, session: aiohttp.ClientSession,
+                     context: types.SimpleNamespace, params: Any) -> None:
+        self.requests -= 1
+
+    async def _queued(self, session: aiohttp.ClientSession,
+                      context: types.SimpleNamespace, params: Any) -> None:
+        self.waiting += 1
+
+    async def _dequeued(self, session: aiohttp.ClientSession,
+                        context: types.SimpleNamespace, params: Any) -> None:
+        self.waiting -= 1
+
+    async def _created(self, session: aiohttp.ClientSession,
+                       context: types.SimpleNamespace, params: Any) -> None:
+        self.created += 1
+
+    async def _reused(self, session: aiohttp.ClientSession,
+                      context: types.SimpleNamespace, params: Any) -> None:
+        self.reused += 1
+
+    def stats(self) -> Dict[str, Any]:
+        limit = self._connector.limit if self._connector is not None else None
+        return {'limit': limit, 'requests': self.requests, 'waiting': self.waiting,
+                'created': self.created, 'reused': self.reused}
+
+    async def open(self, app: web.Application) -> None:
+        self._connector = aiohttp.TCPConnector()
+
+    async def close(self, app: web.Application) -> None:
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
+
+
+class Readiness:
+
+    """Warm up in the background, reporting ready once done.
+
+    Deliveries are served while warming up; the readiness route only tells
+    a load balancer whether they will be served at full speed. Warming up
+    is abandoned after the deadline (in seconds), if any.
+    """
+
+    def __init__(self, server: ni_abc.ServerHost,
+                 warm_up: Callable[[], Awaitable[None]],
+                 deadline: Optional[float] = None) -> None:
+        self.server = server
+        self.warm_up = warm_up
+        self.deadline = deadline
+        # Created by start(), under the running loop: before Python 3.10 an
+        # Event is bound to the loop current when it is created.
+        self.ready: Optional[asyncio.Event] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def _run(self) -> None:
+        try:
+            await asyncio.wait_for(self.warm_up(), self.deadline)
+        except asyncio.TimeoutError:
+            self.server.log(f"Warming up cut short after {self.deadline} seconds")
+        except asyncio.CancelledError:
+            # An Exception before Python 3.8.
+            raise
+        except Exception as exc:
+            # Being cold is slower, not broken.
+            self.server.log_exception(exc)
+        assert self.ready is not None
+        self.ready.set()
+
+    async def start(self, app: web.Application) -> None:
+        self.ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, app: web.Application) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def respond(self, request: web.Request) -> web.Response:
+        """Report whether the server has warmed up."""
+        if self.ready is not None and self.ready.is_set():
+            return web.Response(status=http.HTTPStatus.OK, text='ready')
+        return web.Response(status=http.HTTPStatus.SERVICE_UNAVAILABLE,
+                            text='warming up')
+
+
+class InFlight:
+
+    """Track the stage of every delivery being handled, for the admin route.
+
+    How many deliveries are at each stage is counted as they move along,
+    rather than by going through them.
+    """
+
+    def __init__(self) -> None:
+        self.handled = 0
+        self.stages: Counter[str] = collections.Counter()
+        # The stage, group, start and time the stage was entered, by delivery.
+        self._deliveries: Dict[int, List[Any]] = {}
+        self._ids = itertools.count()
+
+    @contextlib.contextmanager
+    def track(self) -> Iterator[Callable[..., None]]:
+        """Track a delivery, providing a function to move it to a stage."""
+        ident = next(self._ids)
+        now = time.monotonic()
+        self._deliveries[ident] = ['screening', '', now, now]
+        self.stages['screening'] += 1
+
+        def enter(stage: str, group: Optional[str] = None) -> None:
+            record = self._deliveries[ident]
+            self.stages[record[0]] -= 1
+            self.stages[stage] += 1
+            record[0] = stage
+            record[3] = time.monotonic()
+            if group is not None:
+                record[1] = group
+
+        try:
+            yield enter
+        finally:
+            stage = self._deliveries.pop(ident)[0]
+            self.stages[stage] -= 1
+            self.handled += 1
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        # Deliveries are kept in the order they arrived, so the oldest are first.
+        oldest = itertools.islice(self._deliveries.values(), ADMIN_DELIVERIES)
+        return {'handled': self.handled, 'in_flight': len(self._deliveries),
+                'stages': {stage: count for stage, count in self.stages.items() if count},
+                'oldest': [{'stage': stage, 'group': group,
+                            'elapsed': round(now - started, 3),
+                            'in_stage': round(now - entered, 3)}
+                           for stage, group, started, entered in oldest]}
+
+
+class Steps(NamedTuple):
+
+    """The results of the steps of handling a delivery, as far as it got."""
+
+    usernames: Optional[AbstractSet[str]] = None
+    problems: Optional[Mapping[ni_abc.Status, AbstractSet[str]]] = None
+
+
+class CompletedSteps:
+
+    """Keep the steps completed for failed deliveries, by delivery ID.
+
+    When a failed delivery is delivered again (or replayed from the
+    journal), the steps which succeeded before are not repeated.
+    """
+
+    def __init__(self, ttl: float = STEPS_TTL, size: int = STEPS_SIZE) -> None:
+        self.ttl = ttl
+        self.size = size
+        self.reused = 0
+        self._steps: "collections.OrderedDict[str, Tuple[float, Steps]]" = (
+            collections.OrderedDict())
+
+    def __bool__(self) -> bool:
+        self._expire()
+        return bool(self._steps)
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._steps and next(iter(self._steps.values()))[0] <= now:
+            self._steps.popitem(last=False)
+
+    def pop(self, key: str) -> Steps:
+        self._expire()
+        _, steps = self._steps.pop(key, (0.0, Steps()))
+        if steps != Steps():
+            self.reused += 1
+        return steps
+
+    def keep(self, key: str, steps: Steps) -> None:
+        if steps == Steps():
+            return
+        self._steps.pop(key, None)
+        self._steps[key] = time.monotonic() + self.ttl, steps
+        while len(self._steps) > self.size:
+            self._steps.popitem(last=False)
+
+
+# A serialized request, with the sequence number of its journal entry if any.
+Redelivery = Tuple[Optional[int], str, bytes]
+
+
+class ShedDeliveries:
+
+    """Keep the requests turned away under load, to handle them again.
+
+    The contribution host doesn't deliver a request again, so it is kept,
+    as serialized by ContribHost.dump(), until nothing is waiting. Beyond
+    ``size`` of them the oldest are dropped, though a journaled request is
+    still replayed when the server next starts.
+    """
+
+    def __init__(self, size: int = SHED_SIZE) -> None:
+        self.size = size
+        self.retried = self.dropped = 0
+        self._requests: Deque[Redelivery] = collections.deque()
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def keep(self, sequence: Optional[int], key: str, data: bytes) -> None:
+        self._requests.append((sequence, key, data))
+        while len(self._requests) > self.size:
+            self._requests.popleft()
+            self.dropped += 1
+
+    def take(self) -> List[Redelivery]:
+        """Return the kept requests, forgetting them."""
+        requests = list(self._requests)
+        self._requests.clear()
+        self.retried += len(requests)
+        return requests
+
+    async def retry(self, server: ni_abc.ServerHost, fair_scheduler: scheduler.FairScheduler,
+                    respond: Callable[[web.Request], Awaitable[web.Response]],
+                    deliveries: Optional[journal.Journal] = None,
+                    interval: float = SHED_CHECK_INTERVAL) -> None:
+        """Handle the kept requests again whenever nothing is waiting, until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            if self._requests and not fair_scheduler.queued:
+                requests = self.take()
+                server.log(f"Handling {len(requests)} shed deliveries again")
+                await redeliver(server, deliveries, requests, respond)
+
+    def stats(self) -> Dict[str, int]:
+        return {'kept': len(self), 'retried': self.retried, 'dropped': self.dropped}
+
+
+@contextlib.asynccontextmanager
+async def _not_journaled() -> AsyncIterator[None]:
+    """Stand in for the journal entry of a request which isn't journaled."""
+    yield
 
 
 def handler(create_client: Callable[[], aiohttp.ClientSession], server: ni_abc.ServerHost,
-            cla_records: ni_abc.CLAHost) -> Callable[[web.Request], Awaitable[web.Response]]:
-    """Create a closure to handle requests from the contribution host."""
+            cla_records: ni_abc.CLAHost,
+            locks: Optional[workers.ContributionLocks] = None,
+            fair_scheduler: Optional[scheduler.FairScheduler] = None,
+            deliveries: Optional[journal.Journal] = None,
+            completed: Optional[CompletedSteps] = None,
+            in_flight: Optional[InFlight] = None,
+            shed: Optional[ShedDeliveries] = None,
+            ) -> Callable[[web.Request], Awaitable[web.Response]]:
+    """Create a closure to handle requests from the contribution host.
+
+    Requests turned away under load are kept in ``shed``, if given, to be
+    handled again.
+    """
+    contribution_locks = locks if locks is not None else workers.ContributionLocks()
+    fair_share = (fair_scheduler if fair_scheduler is not None
+                  else scheduler.FairScheduler())
+    completed_steps = completed if completed is not None else CompletedSteps()
+    tracked = in_flight if in_flight is not None else InFlight()
+
+    def journaled(request: web.Request) -> AsyncContextManager[Optional[int]]:
+        """Journal the screened request until it has been handled.
+
+        The context is the sequence number of the journal entry, if any.
+        """
+        if deliveries is None:
+            return _not_journaled()
+        # A shed request is left in the journal to be replayed, as the
+        # contribution host doesn't deliver it again.
+        sequence = request.get(JOURNAL_SEQUENCE)
+        if sequence is not None:
+            return deliveries.entry('', b'', sequence, unfinished=(scheduler.Shed,))
+        entry = ContribHost.dump(request)
+        if entry is None:
+            return _not_journaled()
+        return deliveries.entry(*entry, unfinished=(scheduler.Shed,))
+
     async def respond(request: web.Request) -> web.Response:
+        with tracked.track() as enter:
+            return await handle(request, enter)
+
+    async def handle(request: web.Request, enter: Callable[..., None]) -> web.Response:
         """Handle a webhook trigger from the contribution host."""
-        async with create_client() as client:
-            try:
+        steps = Steps()
+        sequence = None
+        try:
+            # Turn away uninteresting requests before creating a client.
+            await ContribHost.screen(server, request)
+            # Only look for earlier steps when some delivery has failed.
+            key = ContribHost.delivery_id(request) if completed_steps else None
+            if key is not None:
+                steps = completed_steps.pop(key)
+            group = ContribHost.group(request)
+            priority = ContribHost.priority(server, request)
+            enter('queued', group)
+            # Share capacity fairly so one busy group can't starve the rest,
+            # only process the newest of the requests waiting for a
+            # contribution, and shed the least important work when too much
+            # is waiting.
+            async with journaled(request) as sequence, \
+                    fair_share.slot(group, priority,
+                                    ContribHost.contribution_key(request)), \
+                    create_client() as client:
+                enter('processing')
                 contribution = await ContribHost.process(server, request, client)
-                usernames = await contribution.usernames()
+                usernames = steps.usernames
+                if usernames is None:
+                    enter('usernames')
+                    usernames = await contribution.usernames()
+                    steps = steps._replace(usernames=usernames)
                 server.log("Usernames: " + str(usernames))
-                trusted_users = server.trusted_users()
-                usernames_to_check = usernames - trusted_users
-                problems = await cla_records.problems(client, usernames_to_check)
+                problems = steps.problems
+                if problems is None:
+                    enter('problems')
+                    trusted_users = server.trusted_users()
+                    usernames_to_check = usernames - trusted_users
+                    problems = await cla_records.problems(client, usernames_to_check)
+                    steps = steps._replace(problems=problems)
                 server.log("CLA problems: " + str(problems))
                 # With a work queue, one could make the updating of the
                 # contribution a work item and return an HTTP 202 response.
-                await contribution.update(problems)
-                return web.Response(status=http.HTTPStatus.OK)
+                # Serialize updates so that concurrent deliveries for the same
+                # contribution -- possibly in other workers -- don't race.
+                enter('locking')
+                async with contribution_locks.hold(contribution.key()):
+                    enter('updating')
+                    await contribution.update(problems)
+            return web.Response(status=http.HTTPStatus.OK)
+        except ni_abc.ResponseExit as exc:
+            return exc.response
+        except scheduler.Superseded as exc:
+            # A newer request for the contribution does the work.
+            server.log(f"Dropped a request: {exc}")
+            return web.Response(status=http.HTTPStatus.ACCEPTED)
+        except scheduler.Shed as exc:
+            server.log(f"Turned away a request: {exc}")
+            entry = ContribHost.dump(request) if shed is not None else None
+            if shed is not None and entry is not None:
+                # To be handled once nothing is waiting.
+                shed.keep(sequence, *entry)
+                return web.Response(status=http.HTTPStatus.ACCEPTED)
+            return web.Response(status=http.HTTPStatus.SERVICE_UNAVAILABLE,
+                                headers={'Retry-After': str(SHED_RETRY_AFTER)})
+        except asyncio.CancelledError:
+            # An Exception before Python 3.8; the delivery is left to be replayed.
+            raise
+        except Exception as exc:
+            server.log_exception(exc)
+            if steps != Steps():
+                key = ContribHost.delivery_id(request)
+                if key is not None:
+                    completed_steps.keep(key, steps)
+            return web.Response(
+                    status=http.HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    return respond
+
+
+def admin(server: ni_abc.ServerHost, cla_records: ni_abc.CLAHost, pool: ClientPool,
+          fair_scheduler: scheduler.FairScheduler, in_flight: InFlight,
+          deliveries: Optional[journal.Journal] = None,
+          loop_monitor: Optional[monitor.LoopMonitor] = None,
+          shed: Optional[ShedDeliveries] = None,
+          ) -> Callable[[web.Request], Awaitable[web.Response]]:
+    """Create a closure reporting on the work and caches of the server.
+
+    Requests must carry the server's admin token as a bearer token.
+    """
+    token = server.admin_token()
+    assert token, 'the admin route needs a token'
+    expected = f'Bearer {token}'.encode('utf-8')
+
+    async def respond(request: web.Request) -> web.Response:
+        authorization = request.headers.get('authorization', '').encode('utf-8')
+        if not hmac.compare_digest(authorization, expected):
+            return web.Response(status=http.HTTPStatus.UNAUTHORIZED,
+                                headers={'WWW-Authenticate': 'Bearer'})
+        queues = fair_scheduler.stats()
+        report = {
+            'deliveries': in_flight.stats(),
+            'scheduler': {'running': fair_scheduler.running,
+                          'queued': sum(group['queued'] for group in queues.values()),
+                          'groups': queues,
+                          'tiers': {ni_abc.Priority(tier).name: stats
+                                    for tier, stats in fair_scheduler.tier_stats().items()}},
+            'pool': pool.stats(),
+            'retries': {'tokens': upstream.retry_budget.tokens,
+                        'retries': upstream.retry_budget.retries,
+                        'exhausted': upstream.retry_budget.exhausted},
+            'contributions': ContribHost.stats(),
+            'cla': cla_records.stats(),
+        }
+        if loop_monitor is not None:
+            report['loop'] = loop_monitor.stats()
+        if deliveries is not None:
+            report['journal'] = {'appends': deliveries.appends, 'syncs': deliveries.syncs,
+                                 'bytes_written': deliveries.bytes_written}
+        if shed is not None:
+            report['shed'] = shed.stats()
+        return web.json_response(report)
+
+    return respond
+
+
+async def redeliver(server: ni_abc.ServerHost, deliveries: Optional[journal.Journal],
+                    requests: Iterable[Redelivery],
+                    respond: Callable[[web.Request], Awaitable[web.Response]],
+                    concurrency: int = REPLAY_CONCURRENCY) -> None:
+    """Handle serialized requests again, completing the journal entry of any
+    which can't be loaded.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def handle(sequence: Optional[int], key: str, data: bytes) -> None:
+        async with semaphore:
+            try:
+                request = ContribHost.load(data)
             except ni_abc.ResponseExit as exc:
-                return exc.response
+                server.log(f"Skipped replaying delivery {key}: {exc.response.text}")
+                if deliveries is not None and sequence is not None:
+                    deliveries.complete(sequence)
+                return
             except Exception as exc:
+                # Replaying would never succeed.
                 server.log_exception(exc)
-                return web.Response(
-                        status=http.HTTPStatus.INTERNAL_SERVER_ERROR)
+                if deliveries is not None and sequence is not None:
+                    deliveries.complete(sequence)
+                return
+            if sequence is not None:
+                request[JOURNAL_SEQUENCE] = sequence
+            response = await respond(request)
+        server.log(f"Replayed delivery {key}: {response.status}")
 
-    return respond
+    await asyncio.gather(*(handle(sequence, key, data) for sequence, key, data in requests))
 
 
-if __name__ == '__main__':
+async def replay(server: ni_abc.ServerHost, deliveries: journal.Journal,
+                 entries: List[journal.Entry],
+                 respond: Callable[[web.Request], Awaitable[web.Response]],
+                 concurrency: int = REPLAY_CONCURRENCY) -> None:
+    """Handle the unfinished deliveries of a journal again, once each."""
+    replayed: Dict[str, int] = {}
+    for sequence, key, data in entries:
+        if key in replayed:
+            # The contribution host redelivered it before the process died.
+            deliveries.complete(sequence)
+        else:
+            replayed[key] = sequence
+    server.log(f"Replaying {len(replayed)} unfinished deliveries")
+    await redeliver(server, deliveries,
+                    [(sequence, key, data) for sequence, key, data in entries
+                     if replayed[key] == sequence],
+                    respond, concurrency)
+
+
+def create_app(server: ni_abc.ServerHost,
+               locks: Optional[workers.ContributionLocks] = None,
+               pool: Optional[ClientPool] = None) -> web.Application:
+    """Create the web application."""
     app = web.Application()
-    server = ServerHost()
+    ContribHost.configure(server)
     cla_records = CLAHost(server)
-    app.router.add_route(*ContribHost.route,
-                         handler(lambda: aiohttp.ClientSession(), server, cla_records))
-    web.run_app(app, port=server.port())
+    if pool is None:
+        pool = ClientPool()
+
+    async def warm_up() -> None:
+        async with pool() as client:
+            usernames = await ContribHost.warm_up(server, client)
+            await cla_records.warm_up(client, usernames - server.trusted_users())
+
+    async def close_hosts(app: web.Application) -> None:
+        await ContribHost.close()
+        await cla_records.close()
+
+    readiness = Readiness(server, warm_up, server.warm_up_deadline())
+    app.on_startup.extend([pool.open, readiness.start])
+    app.on_cleanup.extend([readiness.stop, pool.close, close_hosts])
+    journal_directory = server.journal_directory()
+    deliveries = journal.Journal(journal_directory) if journal_directory else None
+    fair_scheduler = scheduler.FairScheduler()
+    in_flight = InFlight()
+    shed = ShedDeliveries()
+    respond = handler(pool, server, cla_records, locks, fair_scheduler,
+                      deliveries=deliveries, in_flight=in_flight, shed=shed)
+    if deliveries is not None:
+        replaying: List["asyncio.Task[None]"] = []
+
+        async def open_journal(app: web.Application) -> None:
+            assert deliveries is not None
+            loop = asyncio.get_running_loop()
+            entries = await loop.run_in_executor(None, deliveries.open)
+            replaying.append(asyncio.create_task(
+                replay(server, deliveries, entries, respond)))
+
+        async def close_journal(app: web.Application) -> None:
+            assert deliveries is not None
+            for task in replaying:
+                task.cancel()
+            await asyncio.gather(*replaying, return_exceptions=True)
+            await deliveries.close()
+
+        # The replay needs the pool to be open, and to be stopped before it closes.
+        app.on_startup.append(open_journal)
+        app.on_cleanup.insert(0, close_journal)
+    retrying: List["asyncio.Task[None]"] = []
+
+    async def retry_shed(app: web.Application) -> None:
+        retrying.append(asyncio.create_task(
+            shed.retry(server, fair_scheduler, respond, deliveries)))
+
+    async def stop_retrying(app: web.Application) -> None:
+        for task in retrying:
+            task.cancel()
+        await asyncio.gather(*retrying, return_exceptions=True)
+
+    # Retrying needs the pool and the journal to be open, and to be stopped
+    # before they close.
+    app.on_startup.append(retry_shed)
+    app.on_cleanup.insert(0, stop_retrying)
+    app.router.add_route(*ContribHost.route, respond)
+    app.router.add_route(*READY_ROUTE, readiness.respond)
+    loop_monitor = None
+    monitor_directory = server.loop_monitor_directory()
+    if monitor_directory:
+        loop_monitor = monitor.LoopMonitor(server, monitor_directory,
+                                           focus=respond.__code__)
+        app.on_startup.append(loop_monitor.start)
+        app.on_cleanup.append(loop_monitor.stop)
+    if server.admin_token():
+        app.router.add_route(*ADMIN_ROUTE, admin(server, cla_records, pool, fair_scheduler,
+                                                 in_flight, deliveries, loop_monitor,
+                                                 shed))
+    return app
+
+
+if __name__ == '__main__':
+    # Only needed when serving, so not imported along with the module.
+    import argparse
+    import os
+    import tempfile
+
+    import sentry_sdk
+
+    sentry_sdk.init(os.environ.get("SENTRY_DSN"))
+    parser = argparse.ArgumentParser(prog='python3 -m ni')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes sharing the port')
+    args = parser.parse_args()
+    server = ServerHost()
+    if args.workers > 1:
+        with tempfile.TemporaryDirectory(prefix='ni-locks-') as lock_dir:
+            workers.serve(
+                server,
+                lambda: create_app(server, workers.ContributionLocks(lock_dir)),
+                args.workers)
+    else:
+        web.run_app(create_app(server), port=server.port())
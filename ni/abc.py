@@ -1,12 +1,14 @@
 import abc
 import enum
 import http
-from typing import AbstractSet, Any, Mapping, Optional, Tuple
+from typing import (AbstractSet, Any, ClassVar, Dict, FrozenSet, Hashable, Iterator,
+                    Mapping, Optional, Sequence, Tuple, TypeVar, cast)
 
 # ONLY third-party libraries which won't break the abstraction promise may be
 # imported.
 import aiohttp
 from aiohttp import web
+from multidict import CIMultiDict, CIMultiDictProxy
 
 
 class ResponseExit(Exception):
@@ -28,9 +30,112 @@ class Status(enum.Enum):
     username_not_found = 3
 
 
+class Priority(enum.IntEnum):
+
+    """How soon a screened request should be processed under load.
+
+    Lower priorities are queued behind higher ones and shed first when the
+    queue is full.
+    """
+
+    high = 0
+    normal = 1
+    low = 2
+
+
+Key = TypeVar('Key', bound=Hashable)
+
+
+class Problems(Mapping[Status, FrozenSet[str]]):
+
+    """An immutable mapping of CLA problems to the usernames which have them.
+
+    Only the problems which some username has are kept, as a tuple of
+    pairs in the order of the statuses. Having no problems is the common
+    case, so every empty instance is the same object.
+    """
+
+    __slots__ = ('_problems',)
+    _problems: Tuple[Tuple[Status, FrozenSet[str]], ...]
+    _empty: ClassVar["Problems"]
+
+    def __new__(cls, problems: Mapping[Status, AbstractSet[str]] = {}) -> "Problems":
+        if isinstance(problems, Problems):
+            return problems
+        pairs = tuple(sorted(((status, frozenset(usernames))
+                              for status, usernames in problems.items() if usernames),
+                             key=lambda pair: pair[0].value))
+        if not pairs and hasattr(cls, '_empty'):
+            return cls._empty
+        self = super().__new__(cls)
+        self._problems = pairs
+        return self
+
+    def __getitem__(self, status: Status) -> FrozenSet[str]:
+        for problem, usernames in self._problems:
+            if problem is status:
+                return usernames
+        raise KeyError(status)
+
+    def __iter__(self) -> Iterator[Status]:
+        return (status for status, _ in self._problems)
+
+    def __len__(self) -> int:
+        return len(self._problems)
+
+    def __hash__(self) -> int:
+        return hash(self._problems)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(self._problems)!r})'
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return type(self), (dict(self._problems),)
+
+
+Problems._empty = Problems()
+
+
+def select_problems(problems: Mapping[Status, AbstractSet[str]],
+                    usernames: AbstractSet[str]) -> Problems:
+    """Return the problems which concern any of the usernames."""
+    return Problems({status: problem_usernames & usernames
+                     for status, problem_usernames in problems.items()})
+
+
+class ReplayedRequest(Dict[str, Any]):
+
+    """Stand in for a screened request being replayed, e.g. from a journal.
+
+    Like a request, it holds the state set on it while it is handled. The
+    request itself is gone, so it has no headers and an empty body.
+    """
+
+    method = 'POST'
+    headers: "CIMultiDictProxy[str]" = CIMultiDictProxy(CIMultiDict())
+    content_type = ''
+    content_length = 0
+    body_exists = False
+
+    @classmethod
+    def create(cls, state: Mapping[str, Any]) -> web.Request:
+        """Return a stand-in for a request with the state, typed as a request."""
+        return cast(web.Request, cls(state))
+
+    async def read(self) -> bytes:
+        return b''
+
+    async def text(self) -> str:
+        return ''
+
+
 class ServerHost(abc.ABC):
 
-    """Abstract base class for the server hosting platform."""
+    """Abstract base class for the server hosting platform.
+
+    Optional settings have a default implementation, which leaves the
+    feature they configure off.
+    """
 
     @abc.abstractmethod
     def port(self) -> int:
@@ -42,6 +147,17 @@ class ServerHost(abc.ABC):
         """Return the authorization token for the contribution host."""
         raise NotImplementedError
 
+    def contrib_app_id(self) -> Optional[str]:
+        """Return the app ID to authenticate to the contribution host as, or None.
+
+        When None, contrib_auth_token() is used instead.
+        """
+        return None
+
+    def contrib_private_key(self) -> Optional[str]:
+        """Return the private key of the contribution host app, or None."""
+        return None
+
     @abc.abstractmethod
     def contrib_secret(self) -> str:
         """Return the secret for the contribution host."""
@@ -66,6 +182,72 @@ class ServerHost(abc.ABC):
         """
         return frozenset()
 
+    def status_repositories(self) -> AbstractSet[str]:
+        """Return the repositories to report the CLA status to as a commit status.
+
+        Other repositories are labeled with the CLA status.
+        """
+        return frozenset()
+
+    def priority_repositories(self) -> AbstractSet[str]:
+        """Return the repositories whose contributions are processed sooner under load."""
+        return frozenset()
+
+    def update_comments(self) -> bool:
+        """Return whether to edit the previous CLA comment instead of adding one."""
+        return False
+
+    def warm_up_repositories(self) -> AbstractSet[str]:
+        """Return the repositories whose recent contributions warm the caches."""
+        return frozenset()
+
+    def warm_up_deadline(self) -> float:
+        """Return the most seconds to warm up before reporting ready."""
+        return 30.0
+
+    def hedge_budget(self) -> float:
+        """Return the most of the idempotent upstream calls to hedge, as a fraction.
+
+        A hedged call is made a second time should it be slower than usual.
+        """
+        return 0.0
+
+    def journal_directory(self) -> Optional[str]:
+        """Return the directory of the journals of accepted deliveries, or None.
+
+        Deliveries which were journaled but never finished processing are
+        replayed at startup.
+        """
+        return None
+
+    def loop_monitor_directory(self) -> Optional[str]:
+        """Return the directory to write event loop stalls and profiles to, or None.
+
+        Without a directory the event loop isn't monitored.
+        """
+        return None
+
+    def admin_token(self) -> Optional[str]:
+        """Return the bearer token protecting the admin route, or None.
+
+        Without a token the admin route is not served.
+        """
+        return None
+
+    def cache_url(self) -> Optional[str]:
+        """Return the URL of a cache shared by every process, or None.
+
+        Without a URL each process caches in memory.
+        """
+        return None
+
+    def cla_index_path(self) -> Optional[str]:
+        """Return the path of the on-disk CLA status index, or None.
+
+        The index may be shared by every process running on the same host.
+        """
+        return None
+
 
 class ContribHost(abc.ABC):
 
@@ -76,6 +258,100 @@ class ContribHost(abc.ABC):
     def route(self) -> Tuple[str, str]:
         return '*', '/'  # pragma: no cover
 
+    @classmethod
+    def configure(cls, server: ServerHost) -> None:
+        """Apply the server's settings which hold for the whole process.
+
+        Called once, as the web application is created.
+        """
+
+    @classmethod
+    async def screen(cls, server: ServerHost, request: web.Request) -> None:
+        """Cheaply vet a request before any resources are committed to it.
+
+        Raise ResponseExit to answer the request without processing it.
+        """
+
+    @classmethod
+    def group(cls, request: web.Request) -> str:
+        """Return the group a screened request is scheduled under.
+
+        Requests in the same group (e.g. a repository) share processing
+        capacity fairly with other groups.
+        """
+        return ''
+
+    @classmethod
+    def priority(cls, server: ServerHost, request: web.Request) -> Priority:
+        """Return how soon a screened request should be processed under load.
+
+        Should too much work be waiting, the lowest priority requests are
+        turned away for the contribution host to deliver again later.
+        """
+        return Priority.normal
+
+    @classmethod
+    def contribution_key(cls, request: web.Request) -> Optional[str]:
+        """Return the key() of the contribution a screened request is for.
+
+        A request waiting to be processed is dropped in favour of a newer one
+        with the same key, so only requests which do at least what any other
+        with the key would should have one. None if the request is not to be
+        coalesced.
+        """
+        return None
+
+    @classmethod
+    def delivery_id(cls, request: web.Request) -> Optional[str]:
+        """Return the unique ID of a screened request's delivery, or None.
+
+        A delivery which is delivered again keeps its ID.
+        """
+        return None
+
+    @classmethod
+    def dump(cls, request: web.Request) -> Optional[Tuple[str, bytes]]:
+        """Serialize a screened request so it can be replayed.
+
+        Return the request's delivery_id() and its serialization, or None if it cannot be replayed. Override load()
+        along with it.
+        """
+        return None
+
+    @classmethod
+    def load(cls, data: bytes) -> web.Request:
+        """Recreate a screened request from its serialization by dump().
+
+        The request may be a ReplayedRequest, carrying what was kept when
+        it was screened. Raise ResponseExit to skip replaying it.
+        """
+        raise ResponseExit(status=http.HTTPStatus.NOT_IMPLEMENTED,
+                           text='replaying requests is not supported')
+
+    @classmethod
+    async def warm_up(cls, server: ServerHost,
+                      client: aiohttp.ClientSession) -> AbstractSet[str]:
+        """Prepare to process requests before the server reports it is ready.
+
+        Called once at startup, e.g. to open pooled connections to the host.
+        Return the usernames of recently active contributors, whose CLA
+        status is then checked ahead of their next contribution.
+        """
+        return frozenset()
+
+    @classmethod
+    def stats(cls) -> Mapping[str, Any]:
+        """Return JSON-serializable statistics, e.g. of caches, for the admin route.
+
+        Called often, so only counters kept up to date as they change should
+        be read.
+        """
+        return {}
+
+    @classmethod
+    async def close(cls) -> None:
+        """Release resources, e.g. connections, as the server shuts down."""
+
     @classmethod
     @abc.abstractmethod
     async def process(cls, server: ServerHost,
@@ -85,6 +361,11 @@ class ContribHost(abc.ABC):
         # This method exists because __init__() cannot be a coroutine.
         raise ResponseExit(status=http.HTTPStatus.NOT_IMPLEMENTED)  # pragma: no cover
 
+    @abc.abstractmethod
+    def key(self) -> str:
+        """Return a key identifying the contribution across requests."""
+        raise NotImplementedError
+
     @abc.abstractmethod
     async def usernames(self) -> AbstractSet[str]:
         """Return an iterable of all the contributors' usernames."""
@@ -107,3 +388,64 @@ class CLAHost(abc.ABC):
         Return a Mapping of problems and the associated list of usernames.
         """
         raise NotImplementedError
+
+    async def warm_up(self, client: aiohttp.ClientSession,
+                      usernames: AbstractSet[str]) -> None:
+        """Prepare to check CLAs before the server reports it is ready.
+
+        The usernames are of recently active contributors and may be checked
+        ahead of time should the results be kept.
+        """
+
+    def stats(self) -> Mapping[str, Any]:
+        """Return JSON-serializable statistics for the admin route.
+
+        Called often, so only counters kept up to date as they change should
+        be read.
+        """
+        return {}
+
+    async def close(self) -> None:
+        """Release resources, e.g. connections, as the server shuts down."""
+
+    async def batch_problems(self, client: aiohttp.ClientSession,
+                             usernames: Mapping[Key, AbstractSet[str]],
+                             ) -> Dict[Key, Mapping[Status, AbstractSet[str]]]:
+        """Check the CLA status of many sets of usernames at once.
+
+        Return the problems of each set of usernames under the same key. The
+        default implementation checks the union of the sets with a single call
+        to problems().
+        """
+        everyone = frozenset().union(*usernames.values())
+        problems = await self.problems(client, everyone) if everyone else {}
+        return {key: select_problems(problems, key_usernames)
+                for key, key_usernames in usernames.items()}
+
+
+class Cache(abc.ABC):
+
+    """Abstract base class for a key-value cache, e.g. one shared by every process.
+
+    Values are bytes which expire after a number of seconds. Many keys are
+    read or written at once, in a single round trip where the cache is
+    remote. A cache is only an optimization, so one which can't be reached
+    behaves as if it were empty.
+    """
+
+    @abc.abstractmethod
+    async def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        """Return the values of those keys which are cached."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def set_many(self, values: Mapping[str, bytes], ttl: float) -> None:
+        """Cache the values for ttl seconds."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Release the cache's resources, e.g. its connections."""
+
+    def stats(self) -> Mapping[str, Any]:
+        """Return JSON-serializable statistics for the admin route."""
+        return {}
@@ -1,10 +1,28 @@
+import asyncio
 from http import client
 import json
-from typing import AbstractSet, Mapping, MutableMapping, Set
+from typing import (AbstractSet, Any, Dict, FrozenSet, List, Mapping, MutableMapping,
+                    Optional, Set, Tuple)
 
 import aiohttp
 
 from . import abc as ni_abc
+from . import cache
+from . import index
+from . import upstream
+
+
+# The most usernames to check with a single request, keeping the URL short,
+# and the most requests to make at once.
+CHECK_CHUNK_SIZE = 50
+CHECK_CONCURRENCY = 4
+# How many seconds a signed CLA is cached for.
+SIGNED_TTL = 24 * 60 * 60.0
+_SIGNED = b'signed'
+
+
+def _cache_key(username: str) -> str:
+    return 'cla:' + username.lower()
 
 
 class Host(ni_abc.CLAHost):
@@ -13,19 +31,118 @@ class Host(ni_abc.CLAHost):
 
     def __init__(self, server: ni_abc.ServerHost) -> None:
         self.server = server
+        self.upstream = upstream.Upstream('bugs.python.org', server.hedge_budget())
+        index_path = server.cla_index_path()
+        self._index: Optional[index.StatusIndex] = None
+        if index_path:
+            self._index = index.StatusIndex(index_path)
+        self._cache = cache.create(server)
+
+    async def warm_up(self, aio_client: aiohttp.ClientSession,
+                      usernames: AbstractSet[str]) -> None:
+        """Prefetch the usernames' CLA status, or else open a pooled connection.
+
+        Signed CLAs are cached, and every status is indexed if there is an index.
+        """
+        if usernames:
+            problems = await self.problems(aio_client, usernames)
+            self.server.log(f"Prefetched the CLA status of {len(usernames)} "
+                            f"usernames: {problems}")
+        else:
+            async with aio_client.head("https://bugs.python.org/"):
+                pass
+
+    def stats(self) -> Mapping[str, Any]:
+        """Report the cache and the latency of b.p.o."""
+        return {'indexed': self._index is not None, 'cache': self._cache.stats(),
+                'bpo': self.upstream.stats()}
+
+    async def close(self) -> None:
+        await self._cache.close()
 
     async def problems(self, aio_client: aiohttp.ClientSession,
                     usernames: AbstractSet[str]) -> Mapping[ni_abc.Status, AbstractSet[str]]:
+        return await self._problems(aio_client, frozenset(usernames))
+
+    async def batch_problems(self, aio_client: aiohttp.ClientSession,
+                             usernames: Mapping[ni_abc.Key, AbstractSet[str]],
+                             ) -> Dict[ni_abc.Key, Mapping[ni_abc.Status, AbstractSet[str]]]:
+        """Check every distinct username once, CHECK_CHUNK_SIZE per request."""
+        everyone = frozenset().union(*usernames.values())
+        problems = await self._problems(aio_client, everyone)
+        return {key: ni_abc.select_problems(problems, key_usernames)
+                for key, key_usernames in usernames.items()}
+
+    async def _problems(self, aio_client: aiohttp.ClientSession,
+                        usernames: FrozenSet[str]) -> ni_abc.Problems:
+        if self._index is not None:
+            # Only a signed CLA is permanent; anything else may have changed
+            # since it was recorded and so is always checked again.
+            known = self._index.lookup_many(usernames)
+            signed = {username for username, status in known.items()
+                      if status == ni_abc.Status.signed}
+            if signed:
+                self.server.log("Indexed as signed: " + str(signed))
+                usernames -= signed
+        if usernames:
+            # The whole set is looked up at once.
+            cached = await self._cache.get_many([_cache_key(username)
+                                                 for username in sorted(usernames)])
+            signed = {username for username in usernames
+                      if cached.get(_cache_key(username)) == _SIGNED}
+            if signed:
+                self.server.log("Cached as signed: " + str(signed))
+                usernames -= signed
+        ordered = sorted(usernames)
+        chunks = [frozenset(ordered[start:start + CHECK_CHUNK_SIZE])
+                  for start in range(0, len(ordered), CHECK_CHUNK_SIZE)]
+        semaphore = asyncio.Semaphore(CHECK_CONCURRENCY)
+
+        async def check(chunk: FrozenSet[str]) -> List[Tuple[str, Optional[bool]]]:
+            async with semaphore:
+                return await self._check(aio_client, chunk)
+
+        checked = await asyncio.gather(*map(check, chunks))
+
+        failures = {
+            None: ni_abc.Status.username_not_found,
+            False: ni_abc.Status.not_signed,
+        }
+        problems: MutableMapping[ni_abc.Status, Set[str]] = {}
+        statuses = {}
+        for results in checked:
+            for username, result in results:
+                if result in failures:
+                    problems.setdefault(failures[result], set()).add(username)
+                if username in usernames:
+                    statuses[username] = failures.get(result, ni_abc.Status.signed)
+
+        if self._index is not None and statuses:
+            await self._record(statuses)
+        await self._cache.set_many({_cache_key(username): _SIGNED
+                                    for username, status in statuses.items()
+                                    if status == ni_abc.Status.signed}, SIGNED_TTL)
+        return ni_abc.Problems(problems)
+
+    async def _check(self, aio_client: aiohttp.ClientSession,
+                     usernames: FrozenSet[str]) -> List[Tuple[str, Optional[bool]]]:
+        """Return the raw results of checking the usernames with b.p.o."""
         base_url = "https://bugs.python.org/user?@template=clacheck&github_names="
         url = base_url + ','.join(usernames)
         self.server.log("Checking CLA status: " + url)
-        async with aio_client.get(url) as response:
-            if response.status >= 300:
-                msg = f'unexpected response for {response.url!r}: {response.status}'
-                raise client.HTTPException(msg)
-            # Explicitly decode JSON as b.p.o doesn't set the content-type as
-            # `application/json`.
-            results = json.loads(await response.text())
+
+        async def fetch() -> Any:
+            async with aio_client.get(url) as response:
+                if response.status >= 300:
+                    msg = f'unexpected response for {response.url!r}: {response.status}'
+                    if response.status in upstream.TRANSIENT_STATUSES:
+                        raise upstream.Transient(msg, upstream.retry_after(response.headers))
+                    raise client.HTTPException(msg)
+                # Explicitly decode JSON as b.p.o doesn't set the content-type as
+                # `application/json`.
+                return json.loads(await response.text())
+
+        results = await self.upstream.call(fetch, hedge=True, retry=True)
         self.server.log("Raw CLA status: " + str(results))
         status_results = [results[k] for k in results.keys() if k in usernames]
         self.server.log("Filtered CLA status: " + str(status_results))
@@ -34,14 +151,15 @@ class Host(ni_abc.CLAHost):
                              "({} != {})".format(len(usernames), len(status_results)))
         elif any(x not in (True, False, None) for x in status_results):
             raise TypeError("unexpected value in " + str(status_results))
+        return list(results.items())
 
-        failures = {
-            None: ni_abc.Status.username_not_found,
-            False: ni_abc.Status.not_signed,
-        }
-        problems: MutableMapping[ni_abc.Status, Set[str]] = {}
-        for username, result in results.items():
-            if result in failures:
-                problems.setdefault(failures[result], set()).add(username)
-
-        return problems
+    async def _record(self, statuses: Mapping[str, ni_abc.Status]) -> None:
+        """Write the statuses to the on-disk index without blocking the loop."""
+        assert self._index is not None
+        known = self._index.lookup_many(statuses)
+        if all(known.get(username) == status
+               for username, status in statuses.items()):
+            return
+        loop = asyncio.get_running_loop()
+        changed = await loop.run_in_executor(None, self._index.update, statuses)
+        self.server.log("Indexed CLA status: " + str(changed))
@@ -0,0 +1,271 @@
+"""Cache values in memory, or in a Redis server shared by every process.
+
+The Redis client speaks RESP, Redis's wire protocol, over one connection.
+Commands from concurrent callers are pipelined: each caller writes all of
+its commands at once and the replies, which come back in order, are handed
+out as they arrive. Reading many keys takes a single ``MGET``, and writing
+them one ``SET`` each in the same write, so either takes one round trip.
+"""
+import asyncio
+import collections
+import ssl
+import time
+import urllib.parse
+from typing import Any, Deque, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+from . import abc as ni_abc
+from . import upstream
+
+
+# How many values the in-memory cache holds.
+CACHE_SIZE = 16384
+# Prefixes every key in Redis, so that a server may be shared with others.
+KEY_PREFIX = 'ni:'
+DEFAULT_PORT = 6379
+
+Reply = Union[None, int, bytes, List[Any]]
+
+
+class ReplyError(Exception):
+
+    """An error reply from the Redis server."""
+
+
+def encode_command(*arguments: bytes) -> bytes:
+    """Encode a command as a RESP array of bulk strings."""
+    parts = [b'*%d\r\n' % len(arguments)]
+    for argument in arguments:
+        parts.append(b'$%d\r\n%s\r\n' % (len(argument), argument))
+    return b''.join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Union[Reply, ReplyError]:
+    """Read a reply, returning rather than raising an error reply."""
+    line = await reader.readuntil(b'\r\n')
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest
+    elif kind == b'-':
+        return ReplyError(rest.decode('utf-8', 'replace'))
+    elif kind == b':':
+        return int(rest)
+    elif kind == b'$':
+        length = int(rest)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    elif kind == b'*':
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f'unexpected reply from Redis: {line!r}')
+
+
+class MemoryCache(ni_abc.Cache):
+
+    """Cache values in the memory of the process, dropping the least recently used."""
+
+    def __init__(self, size: int = CACHE_SIZE) -> None:
+        self.size = size
+        self.hits = self.misses = 0
+        self._values: "collections.OrderedDict[str, Tuple[float, bytes]]"
+        self._values = collections.OrderedDict()
+
+    async def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        now = time.monotonic()
+        found = {}
+        for key in keys:
+            entry = self._values.get(key)
+            if entry is None:
+                continue
+            expires, value = entry
+            if expires <= now:
+                del self._values[key]
+                continue
+            self._values.move_to_end(key)
+            found[key] = value
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    async def set_many(self, values: Mapping[str, bytes], ttl: float) -> None:
+        expires = time.monotonic() + ttl
+        for key, value in values.items():
+            self._values[key] = expires, value
+            self._values.move_to_end(key)
+        while len(self._values) > self.size:
+            self._values.popitem(last=False)
+
+    def stats(self) -> Mapping[str, Any]:
+        return {'backend': 'memory', 'size': len(self._values),
+                'hits': self.hits, 'misses': self.misses}
+
+
+class _Connection:
+
+    """A connection to Redis and the replies awaited from it, in order."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.pending: Deque["asyncio.Future[Reply]"] = collections.deque()
+        self.reading: Optional["asyncio.Task[None]"] = None
+
+
+class RedisCache(ni_abc.Cache):
+
+    """Cache values in Redis, given by a ``redis://`` or ``rediss://`` URL.
+
+    The URL may carry a password and a database number, e.g.
+    ``redis://:password@localhost:6379/1``. Calls time out adaptively, as
+    calls to other upstreams do; a failed call counts as a miss and is
+    logged.
+    """
+
+    def __init__(self, server: ni_abc.ServerHost, url: str) -> None:
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in {'redis', 'rediss'}:
+            raise ValueError(f'not a Redis URL: {url!r}')
+        self.server = server
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or DEFAULT_PORT
+        self.ssl = parsed.scheme == 'rediss'
+        self.password = (urllib.parse.unquote(parsed.password)
+                         if parsed.password is not None else None)
+        database = parsed.path.lstrip('/')
+        self.database = int(database) if database else 0
+        # Calls to Redis aren't retried, so they mustn't earn retries of
+        # calls to the upstreams which share the retry budget either.
+        self.upstream = upstream.Upstream(f'redis {self.host}:{self.port}',
+                                          budget=upstream.RetryBudget())
+        self.hits = self.misses = self.errors = self.round_trips = 0
+        self._connection: Optional[_Connection] = None
+        self._connecting: Optional[asyncio.Lock] = None
+
+    async def _connect(self) -> _Connection:
+        if self._connection is not None:
+            return self._connection
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self._connection is not None:
+                return self._connection
+            context = ssl.create_default_context() if self.ssl else None
+            reader, writer = await asyncio.open_connection(self.host, self.port,
+                                                           ssl=context)
+            connection = _Connection(reader, writer)
+            connection.reading = asyncio.create_task(self._read(connection))
+            setup = []
+            if self.password is not None:
+                setup.append((b'AUTH', self.password.encode('utf-8')))
+            if self.database:
+                setup.append((b'SELECT', str(self.database).encode('ascii')))
+            if setup:
+                try:
+                    await self._send(connection, setup)
+                except BaseException:
+                    connection.reading.cancel()
+                    raise
+            self._connection = connection
+            return connection
+
+    async def _read(self, connection: _Connection) -> None:
+        """Hand out replies in order until the connection is lost or closed."""
+        error: Exception = ConnectionError(f'lost the connection to Redis at {self.host}')
+        try:
+            while True:
+                reply = await read_reply(connection.reader)
+                if not connection.pending:
+                    raise ConnectionError('unexpected reply from Redis')
+                waiter = connection.pending.popleft()
+                if waiter.done():
+                    # The caller timed out.
+                    continue
+                if isinstance(reply, ReplyError):
+                    waiter.set_exception(reply)
+                else:
+                    waiter.set_result(reply)
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ValueError) as exc:
+            error = ConnectionError(f'lost the connection to Redis at {self.host}: {exc}')
+        finally:
+            if self._connection is connection:
+                self._connection = None
+            connection.writer.close()
+            while connection.pending:
+                waiter = connection.pending.popleft()
+                if not waiter.done():
+                    waiter.set_exception(error)
+
+    async def _send(self, connection: _Connection,
+                    commands: Sequence[Sequence[bytes]]) -> List[Reply]:
+        """Pipeline the commands, returning their replies."""
+        loop = asyncio.get_running_loop()
+        waiters = [loop.create_future() for _ in commands]
+        connection.pending.extend(waiters)
+        connection.writer.write(b''.join(encode_command(*command) for command in commands))
+        self.round_trips += 1
+        await connection.writer.drain()
+        return await asyncio.gather(*waiters)
+
+    async def execute(self, commands: Sequence[Sequence[bytes]]) -> List[Reply]:
+        """Send the commands in one round trip, raising ReplyError for an error reply."""
+
+        async def send() -> List[Reply]:
+            return await self._send(await self._connect(), commands)
+
+        return await self.upstream.call(send)
+
+    def _failed(self, exc: Exception) -> None:
+        self.errors += 1
+        self.server.log(f"Redis cache unavailable: {exc!r}")
+
+    async def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        if not keys:
+            return {}
+        command = [b'MGET'] + [(KEY_PREFIX + key).encode('utf-8') for key in keys]
+        try:
+            values, = await self.execute([command])
+        except (OSError, asyncio.TimeoutError, ReplyError) as exc:
+            self._failed(exc)
+            values = [None] * len(keys)
+        assert isinstance(values, list)
+        found = {key: value for key, value in zip(keys, values)
+                 if isinstance(value, bytes)}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    async def set_many(self, values: Mapping[str, bytes], ttl: float) -> None:
+        if not values:
+            return
+        milliseconds = str(max(1, round(ttl * 1000))).encode('ascii')
+        commands = [(b'SET', (KEY_PREFIX + key).encode('utf-8'), value, b'PX', milliseconds)
+                    for key, value in values.items()]
+        try:
+            await self.execute(commands)
+        except (OSError, asyncio.TimeoutError, ReplyError) as exc:
+            self._failed(exc)
+
+    async def close(self) -> None:
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        assert connection.reading is not None
+        connection.reading.cancel()
+        await asyncio.gather(connection.reading, return_exceptions=True)
+        await connection.writer.wait_closed()
+
+    def stats(self) -> Mapping[str, Any]:
+        return {'backend': 'redis', 'connected': self._connection is not None,
+                'hits': self.hits, 'misses': self.misses, 'errors': self.errors,
+                'round_trips': self.round_trips, 'redis': self.upstream.stats()}
+
+
+def create(server: ni_abc.ServerHost) -> ni_abc.Cache:
+    """Return the server's shared cache, or else one in memory."""
+    url = server.cache_url()
+    if url:
+        return RedisCache(server, url)
+    return MemoryCache()
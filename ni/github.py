@@ -1,17 +1,36 @@
 import asyncio
+import collections
+import datetime
 import enum
+import functools
+import hashlib
+import hmac
 import http
+import importlib
+import json
+import math
 import random
-from collections import defaultdict
-from typing import AbstractSet, Any, Dict, Mapping, Optional
+import re
+import string
+import time
+from typing import (AbstractSet, Any, AsyncIterator, Callable, Deque, Dict, FrozenSet,
+                    List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple, Union)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
 
 import aiohttp
 from aiohttp import web
+import gidgethub
 from gidgethub.aiohttp import GitHubAPI
 from gidgethub import sansio
+from multidict import CIMultiDict
 import uritemplate
 
 from . import abc as ni_abc
+from . import upstream
 
 JSON = Any
 JSONDict = Dict[str, Any]
@@ -20,7 +39,15 @@ JSONDict = Dict[str, Any]
 LABEL_PREFIX = 'CLA '
 CLA_OK = LABEL_PREFIX + 'signed'
 NO_CLA = LABEL_PREFIX + 'not signed'
+STATUS_CONTEXT = 'cla/psf'
+STATUS_TARGET_URL = 'https://devguide.python.org/pullrequest/#licensing'
+# GitHub truncates longer commit status descriptions.
+STATUS_DESCRIPTION_LENGTH = 140
 EASTEREGG_PROBABILITY = 0.01
+# How many of the most recently updated open pull requests of each warm-up
+# repository are read at startup, and how many requests are made at once.
+WARM_UP_PULL_REQUESTS = 30
+WARM_UP_CONCURRENCY = 4
 
 NO_CLA_TEMPLATE = """Hello, and thanks for your contribution!
 
@@ -75,6 +102,509 @@ to rectify this issue.
 
 GITHUB_EMAIL = 'noreply@github.com'.lower()  # Normalized for easy comparisons.
 
+REQUESTER = "the-knights-who-say-ni"
+
+# Installation tokens are renewed in the background once they are this close
+# to expiring, and are not used at all once they are within a minute of it.
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=10)
+TOKEN_EXPIRY_MARGIN = datetime.timedelta(minutes=1)
+
+# GitHub lists at most 250 commits for a pull request, at most 100 per page.
+MAX_LISTED_COMMITS = 250
+COMMITS_PER_PAGE = 100
+# How many pages of commits to request at once.
+PAGE_CONCURRENCY = 3
+
+# How many distinct comments to keep rendered, and for how many pull requests
+# to remember the last comment posted.
+COMMENT_CACHE_SIZE = 256
+COMMENT_HISTORY_SIZE = 1024
+
+# For how many pull request commit ranges to remember the contributors.
+RANGE_CACHE_SIZE = 1024
+
+# How long to expect the webhook for a label the bot removed, and how many
+# removals to remember.
+LABEL_ECHO_WINDOW = 60.0
+LABEL_ECHO_SIZE = 1024
+
+# A pull request synchronized this many times within the window is busy,
+# and further synchronizations wait behind other work under load. How many
+# pull requests to keep track of.
+SYNCHRONIZE_BURST = 4
+SYNCHRONIZE_WINDOW = 60.0
+SYNCHRONIZE_SIZE = 1024
+
+# The most response data to keep for conditional requests.
+RESPONSE_CACHE_SIZE = 32 * 1024**2
+
+# Matches aiohttp's default limit on the size of a request body.
+MAX_PAYLOAD_SIZE = 1024**2
+
+# Where Host.screen() leaves the validated event on the request.
+_SCREENED_EVENT = 'ni.github.event'
+
+# GitHub serializes the action as the first key of the payload.
+_LEADING_ACTION = re.compile(rb'\s*\{\s*"action"\s*:\s*"([a-z_]+)"')
+
+
+def _loads(body: bytes) -> Any:
+    """Decode JSON, using orjson when it is installed."""
+    if orjson is None:
+        return json.loads(body)
+    return orjson.loads(body)  # pragma: no cover
+
+
+def _dumps(obj: Any) -> bytes:
+    """Encode JSON, using orjson when it is installed."""
+    if orjson is None:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    return orjson.dumps(obj)  # pragma: no cover
+
+
+async def _read_body(request: web.Request, secret: Optional[str]) -> bytes:
+    """Read the body of the request, validating its signature as it arrives.
+
+    The validation mirrors sansio.Event.from_http().
+    """
+    if (request.content_length or 0) > MAX_PAYLOAD_SIZE:
+        raise ni_abc.ResponseExit(status=http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+    signature = request.headers.get('x-hub-signature-256',
+                                    request.headers.get('x-hub-signature'))
+    digest = None
+    if signature is not None:
+        if secret is None:
+            raise gidgethub.ValidationFailure("secret not provided")
+        algorithm, _, _ = signature.partition('=')
+        if algorithm not in {'sha256', 'sha1'}:
+            raise gidgethub.ValidationFailure(
+                f"unsupported signature algorithm {algorithm!r}")
+        digest = hmac.new(secret.encode('utf-8'), digestmod=algorithm)
+    elif secret is not None:
+        raise gidgethub.ValidationFailure("signature is missing")
+
+    chunks = []
+    size = 0
+    async for chunk in request.content.iter_any():
+        size += len(chunk)
+        if size > MAX_PAYLOAD_SIZE:
+            raise ni_abc.ResponseExit(status=http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        if digest is not None:
+            digest.update(chunk)
+        chunks.append(chunk)
+
+    if digest is not None:
+        assert signature is not None
+        calculated = f'{algorithm}={digest.hexdigest()}'
+        if not hmac.compare_digest(signature, calculated):
+            raise gidgethub.ValidationFailure(
+                "payload's signature does not align with the secret")
+    return b''.join(chunks)
+
+
+def _sniff_action(body: bytes) -> Optional[str]:
+    """Return the payload's action without decoding the whole payload.
+
+    None is returned when the action isn't the leading key of the payload.
+    """
+    match = _LEADING_ACTION.match(body)
+    return match.group(1).decode('ascii') if match else None
+
+
+class InstallationTokens:
+
+    """Cache GitHub App installation access tokens by installation ID.
+
+    Only one renewal per installation is in flight at a time, and tokens are
+    renewed ahead of their expiry so requests rarely wait on a renewal.
+    Renewals outlive the deliveries which start them, so they are made with
+    a client session of the cache's own, created when first needed.
+    """
+
+    def __init__(self, create_client: Callable[[], aiohttp.ClientSession]
+                 = aiohttp.ClientSession) -> None:
+        self.create_client = create_client
+        self._client: Optional[aiohttp.ClientSession] = None
+        self._tokens: Dict[int, Tuple[str, datetime.datetime]] = {}
+        self._renewals: Dict[int, "asyncio.Future[str]"] = {}
+
+    @staticmethod
+    def _now() -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc)
+
+    async def token(self, server: ni_abc.ServerHost, installation_id: int) -> str:
+        """Return a token for the installation, renewing it if necessary."""
+        now = self._now()
+        cached = self._tokens.get(installation_id)
+        if cached is not None:
+            token, expires_at = cached
+            if expires_at - now > TOKEN_REFRESH_MARGIN:
+                return token
+            elif expires_at - now > TOKEN_EXPIRY_MARGIN:
+                self._renew(server, installation_id)
+                return token
+        return await asyncio.shield(self._renew(server, installation_id))
+
+    def _renew(self, server: ni_abc.ServerHost,
+               installation_id: int) -> "asyncio.Future[str]":
+        renewal = self._renewals.get(installation_id)
+        if renewal is None:
+            renewal = asyncio.ensure_future(self._fetch(server, installation_id))
+            self._renewals[installation_id] = renewal
+
+            def finished(renewal: "asyncio.Future[str]") -> None:
+                del self._renewals[installation_id]
+                # Failed background renewals are retried on the next request.
+                if not renewal.cancelled() and renewal.exception() is not None:
+                    server.log(f"Failed to renew token for installation "
+                               f"{installation_id}: {renewal.exception()!r}")
+
+            renewal.add_done_callback(finished)
+        return renewal
+
+    async def _fetch(self, server: ni_abc.ServerHost, installation_id: int) -> str:
+        # Imported lazily as JWT signing pulls in the cryptography package.
+        from gidgethub import apps
+        app_id = server.contrib_app_id()
+        private_key = server.contrib_private_key()
+        assert app_id is not None and private_key is not None
+        if self._client is None:
+            self._client = self.create_client()
+        gh = GitHubAPI(self._client, REQUESTER)
+        response = await apps.get_installation_access_token(
+            gh, installation_id=str(installation_id), app_id=app_id,
+            private_key=private_key)
+        expires_at = datetime.datetime.strptime(response['expires_at'],
+                                                '%Y-%m-%dT%H:%M:%SZ')
+        expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+        self._tokens[installation_id] = response['token'], expires_at
+        server.log(f"Renewed token for installation {installation_id}")
+        return response['token']
+
+    async def close(self) -> None:
+        """Stop any renewals and close the client session."""
+        renewals = list(self._renewals.values())
+        for renewal in renewals:
+            renewal.cancel()
+        await asyncio.gather(*renewals, return_exceptions=True)
+        client, self._client = self._client, None
+        if client is not None:
+            await client.close()
+
+
+_installation_tokens = InstallationTokens()
+
+
+class ResponseCache:
+
+    """A size-bounded LRU cache of GET responses and their ETags, keyed by URL."""
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries: "collections.OrderedDict[str, Tuple[str, CIMultiDict[str], bytes]]"
+        self._entries = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _size(url: str, headers: Mapping[str, str], body: bytes) -> int:
+        return (len(url) + len(body)
+                + sum(len(key) + len(value) for key, value in headers.items()))
+
+    def get(self, url: str) -> Optional[Tuple[str, "CIMultiDict[str]", bytes]]:
+        """Return the ETag, headers and body for the URL, if cached."""
+        entry = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+        return entry
+
+    def put(self, url: str, etag: str, headers: Mapping[str, str], body: bytes) -> None:
+        self.discard(url)
+        entry_headers = CIMultiDict(headers)
+        size = self._size(url, entry_headers, body)
+        if size > self.max_size:
+            return
+        self._entries[url] = etag, entry_headers, body
+        self.size += size
+        while self.size > self.max_size:
+            self.discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def discard(self, url: str) -> None:
+        entry = self._entries.pop(url, None)
+        if entry is not None:
+            self.size -= self._size(url, entry[1], entry[2])
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        lookups = self.hits + self.misses
+        return {'entries': len(self), 'bytes': self.size, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+_response_cache = ResponseCache()
+_api_upstream = upstream.Upstream('api.github.com')
+_IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'PUT', 'DELETE'})
+
+
+class CachingGitHubAPI(GitHubAPI):
+
+    """Make GET requests conditional on the ETag of a cached response.
+
+    GitHub doesn't count a 304 response against the rate limit, in which case
+    the cached response is used (with the fresh rate limit headers).
+    """
+
+    _RATE_LIMIT_HEADERS = ('x-ratelimit-limit', 'x-ratelimit-remaining',
+                           'x-ratelimit-reset')
+
+    def __init__(self, *args: Any, responses: ResponseCache,
+                 upstream: Optional[upstream.Upstream] = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._responses = responses
+        self._upstream = upstream
+
+    async def _call(self, method: str, url: str, headers: Mapping[str, str],
+                    body: bytes) -> Tuple[int, Mapping[str, str], bytes]:
+        """Make the request, timing it out (and hedging GETs) adaptively.
+
+        Idempotent requests are retried after a transient failure; should
+        every attempt fail, the last response is returned for gidgethub to
+        raise its usual exception. Other requests are made as is: cutting
+        one short, going by the latency of mostly cached GETs, could leave
+        it done without the delivery knowing, and then done again once the
+        delivery is redelivered.
+        """
+        request = functools.partial(super()._request, method, url, headers, body)
+        if self._upstream is None or method not in _IDEMPOTENT_METHODS:
+            return await request()
+        responses = []
+
+        async def attempt() -> Tuple[int, Mapping[str, str], bytes]:
+            response = await request()
+            status, response_headers, _ = response
+            rate_limited = (status == http.HTTPStatus.FORBIDDEN
+                            and response_headers.get('x-ratelimit-remaining') == '0')
+            if status in upstream.TRANSIENT_STATUSES or rate_limited:
+                responses.append(response)
+                raise upstream.Transient(f'{method} {url}: {status}',
+                                         upstream.retry_after(response_headers))
+            return response
+
+        try:
+            return await self._upstream.call(attempt, hedge=method == 'GET', retry=True)
+        except upstream.Transient:
+            return responses[-1]
+
+    async def _request(self, method: str, url: str, headers: Mapping[str, str],
+                       body: bytes = b'') -> Tuple[int, Mapping[str, str], bytes]:
+        if method != 'GET':
+            return await self._call(method, url, headers, body)
+        cached = self._responses.get(url)
+        if cached is not None:
+            headers = dict(headers, **{'if-none-match': cached[0]})
+        status, response_headers, response_body = await self._call(
+            method, url, headers, body)
+        if status == http.HTTPStatus.NOT_MODIFIED and cached is not None:
+            self._responses.hits += 1
+            _, cached_headers, cached_body = cached
+            fresh_headers = cached_headers.copy()
+            for name in self._RATE_LIMIT_HEADERS:
+                if name in response_headers:
+                    fresh_headers[name] = response_headers[name]
+            return http.HTTPStatus.OK, fresh_headers, cached_body
+        self._responses.misses += 1
+        etag = response_headers.get('etag')
+        if status == http.HTTPStatus.OK and etag:
+            self._responses.put(url, etag, response_headers, response_body)
+        else:
+            self._responses.discard(url)
+        return status, response_headers, response_body
+
+
+_Template = Tuple[Tuple[str, Optional[str]], ...]
+_ProblemsKey = FrozenSet[Tuple[ni_abc.Status, FrozenSet[str]]]
+
+
+class RenderedComment(NamedTuple):
+    body: str
+    digest: str
+
+
+class CommentRenderer:
+
+    """Render comments about CLA problems from templates parsed once.
+
+    Usernames are sorted so the same problems always render the same comment,
+    and rendered comments are memoized along with their SHA-256 digest.
+    """
+
+    def __init__(self, cache_size: int = COMMENT_CACHE_SIZE) -> None:
+        self._comment = self._compile(NO_CLA_TEMPLATE)
+        self._problems = {
+            ni_abc.Status.not_signed: self._compile(NO_CLA_BODY),
+            ni_abc.Status.username_not_found: self._compile(NO_USERNAME_BODY),
+        }
+        self._easteregg = self._compile(NO_CLA_BODY_EASTEREGG)
+        self._render = functools.lru_cache(maxsize=cache_size)(self._render_uncached)
+
+    @staticmethod
+    def _compile(template: str) -> _Template:
+        """Split the template into literal text and the fields which follow."""
+        return tuple((literal, field)
+                     for literal, field, _, _ in string.Formatter().parse(template))
+
+    @staticmethod
+    def _fill(template: _Template, fields: Mapping[str, str]) -> str:
+        # Missing fields are left empty.
+        return ''.join(literal + (fields.get(field, '') if field is not None else '')
+                       for literal, field in template)
+
+    def render(self, problems: Mapping[ni_abc.Status, AbstractSet[str]], *,
+               easteregg: bool = False) -> RenderedComment:
+        key = frozenset((status, frozenset(usernames))
+                        for status, usernames in problems.items())
+        return self._render(key, easteregg)
+
+    def _render_uncached(self, problems: _ProblemsKey,
+                         easteregg: bool) -> RenderedComment:
+        messages = {}
+        for status, usernames in problems:
+            if easteregg and status == ni_abc.Status.not_signed:
+                template = self._easteregg
+            else:
+                try:
+                    template = self._problems[status]
+                except KeyError:  # pragma: no cover
+                    # Should never be reached.
+                    raise TypeError("don't know how to handle {}".format(status))
+            mentions = ', '.join(f"@{username}" for username in sorted(usernames))
+            messages[status.name] = self._fill(template, {'': mentions})
+        body = self._fill(self._comment, messages)
+        return RenderedComment(body, hashlib.sha256(body.encode('utf-8')).hexdigest())
+
+
+_comment_renderer = CommentRenderer()
+# The digest of the last comment posted on recent pull requests.
+_comment_digests: "collections.OrderedDict[str, str]" = collections.OrderedDict()
+# The URL of the CLA comment on recent pull requests, or '' if there is none.
+_comment_urls: "collections.OrderedDict[str, str]" = collections.OrderedDict()
+
+# Every CLA comment starts with this text.
+_COMMENT_PREFIX = NO_CLA_TEMPLATE.partition('{')[0]
+# The login the bot comments as, by App ID (None when using a token).
+_logins: Dict[Optional[str], str] = {}
+
+
+def _remember(history: "collections.OrderedDict[str, str]", key: str,
+              value: str) -> None:
+    history[key] = value
+    history.move_to_end(key)
+    while len(history) > COMMENT_HISTORY_SIZE:
+        history.popitem(last=False)
+
+
+# A commit's author or committer as (login, GitHub-managed), or None if missing.
+_Identity = Optional[Tuple[Optional[str], bool]]
+_Contributors = Tuple[_Identity, _Identity]
+
+
+def _contributors(commit: JSONDict) -> _Contributors:
+    """Return the author and committer of the commit."""
+    identities: List[_Identity] = []
+    for role in ('author', 'committer'):
+        user = commit[role]
+        # When the author is missing there seems to typically be a
+        # matching commit that **does** specify the author. (issue #56)
+        if user:
+            email = commit['commit'][role]['email']
+            identities.append((user.get('login'), email.lower() == GITHUB_EMAIL))
+        else:
+            identities.append(None)
+    return identities[0], identities[1]
+
+
+class CommitCache:
+
+    """Remember the contributors of the commits of pull requests.
+
+    The commits of a pull request are determined by its base and head SHAs,
+    so a pull request whose head hasn't moved (e.g. when it is unlabeled)
+    isn't listed again.
+    """
+
+    def __init__(self, size: int = RANGE_CACHE_SIZE) -> None:
+        self.size = size
+        self.hits = self.misses = 0
+        self._ranges: "collections.OrderedDict[Tuple[str, str], Tuple[_Contributors, ...]]"
+        self._ranges = collections.OrderedDict()
+
+    def clear(self) -> None:
+        self._ranges.clear()
+        self.hits = self.misses = 0
+
+    def range(self, key: Tuple[str, str]) -> Optional[Tuple[_Contributors, ...]]:
+        """Return the contributors of every commit in the range, if known."""
+        contributors = self._ranges.get(key)
+        if contributors is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._ranges.move_to_end(key)
+        return contributors
+
+    def add_range(self, key: Tuple[str, str],
+                  contributors: Sequence[_Contributors]) -> None:
+        self._ranges[key] = tuple(contributors)
+        self._ranges.move_to_end(key)
+        if len(self._ranges) > self.size:
+            self._ranges.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {'ranges': len(self._ranges), 'hits': self.hits, 'misses': self.misses}
+
+
+_commit_cache = CommitCache()
+
+
+# When the bot removed a label from a pull request, by (pull request, label).
+_removed_labels: "collections.OrderedDict[Tuple[str, str], float]"
+_removed_labels = collections.OrderedDict()
+
+
+def _record_removal(pull_request: str, label: str) -> None:
+    _removed_labels[pull_request, label] = time.monotonic()
+    _removed_labels.move_to_end((pull_request, label))
+    while len(_removed_labels) > LABEL_ECHO_SIZE:
+        _removed_labels.popitem(last=False)
+
+
+def _is_echo(pull_request: str, label: str) -> bool:
+    """Check if the label's removal was done by the bot itself, recently."""
+    removed_at = _removed_labels.pop((pull_request, label), None)
+    return (removed_at is not None
+            and time.monotonic() - removed_at < LABEL_ECHO_WINDOW)
+
+
+_synchronized: "collections.OrderedDict[str, Deque[float]]" = collections.OrderedDict()
+
+
+def _is_burst(pull_request: str) -> bool:
+    """Record a synchronization, checking if it comes right after several others."""
+    now = time.monotonic()
+    recent = _synchronized.pop(pull_request, None)
+    if recent is None:
+        recent = collections.deque(maxlen=SYNCHRONIZE_BURST)
+    burst = len(recent) == SYNCHRONIZE_BURST and now - recent[0] < SYNCHRONIZE_WINDOW
+    recent.append(now)
+    _synchronized[pull_request] = recent
+    while len(_synchronized) > SYNCHRONIZE_SIZE:
+        _synchronized.popitem(last=False)
+    return burst
+
 
 @enum.unique
 class PullRequestEvent(enum.Enum):
@@ -89,6 +619,48 @@ class PullRequestEvent(enum.Enum):
     synchronize = "synchronize"
 
 
+class PullRequest(NamedTuple):
+
+    """The fields of a pull request event which are used, picked out when parsed.
+
+    Only this is kept while the delivery waits and is processed, rather
+    than the webhook payload it came from.
+    """
+
+    url: str
+    author: str
+    commits_url: str
+    issue_url: str
+    comments_url: str
+    statuses_url: str
+    repository: str
+    action: str = ''
+    delivery_id: str = ''
+    commits: Optional[int] = None
+    base_sha: Optional[str] = None
+    head_sha: Optional[str] = None
+    installation_id: Optional[int] = None
+
+    @classmethod
+    def from_payload(cls, data: JSONDict, delivery_id: str = '') -> "PullRequest":
+        pull_request = data['pull_request']
+        base = pull_request.get('base', {})
+        repository = base.get('repo') or data.get('repository') or {}
+        return cls(url=pull_request.get('url', ''),
+                   author=pull_request.get('user', {}).get('login', ''),
+                   commits_url=pull_request.get('commits_url', ''),
+                   issue_url=pull_request.get('issue_url', ''),
+                   comments_url=pull_request.get('comments_url', ''),
+                   statuses_url=pull_request.get('statuses_url', ''),
+                   repository=repository.get('full_name', ''),
+                   action=data.get('action', ''),
+                   delivery_id=delivery_id,
+                   commits=pull_request.get('commits'),
+                   base_sha=base.get('sha'),
+                   head_sha=pull_request.get('head', {}).get('sha'),
+                   installation_id=data.get('installation', {}).get('id'))
+
+
 class Host(ni_abc.ContribHost):
 
     """Implement a webhook for GitHub pull requests."""
@@ -100,22 +672,60 @@ class Host(ni_abc.ContribHost):
                         PullRequestEvent.synchronize.value}
 
     def __init__(self, server: ni_abc.ServerHost, client: aiohttp.ClientSession,
-                 event: PullRequestEvent,
-                 request: JSONDict) -> None:
-        """Represent a contribution."""
+                 event: PullRequestEvent, request: Union[JSONDict, PullRequest], *,
+                 oauth_token: Optional[str] = None) -> None:
+        """Represent a contribution, from its pull request or the event's payload."""
         self.server = server
         self.event = event
-        self.request = request
-        self._gh = GitHubAPI(client, "the-knights-who-say-ni",
-                             oauth_token=server.contrib_auth_token())
+        if not isinstance(request, PullRequest):
+            request = PullRequest.from_payload(request)
+        self.pull_request = request
+        if oauth_token is None:
+            oauth_token = server.contrib_auth_token()
+        self._gh = CachingGitHubAPI(client, REQUESTER, oauth_token=oauth_token,
+                                    responses=_response_cache, upstream=_api_upstream)
 
     @classmethod
-    async def process(cls, server: ni_abc.ServerHost,
-                      request: web.Request, client: aiohttp.ClientSession) -> "Host":
-        """Process the pull request."""
-        event = sansio.Event.from_http(request.headers,
-                                       await request.read(),
-                                       secret=server.contrib_secret())
+    def configure(cls, server: ni_abc.ServerHost) -> None:
+        """Hedge calls to the API within the server's budget."""
+        _api_upstream.hedge_budget = server.hedge_budget()
+
+    @classmethod
+    async def close(cls) -> None:
+        """Close the client session renewing App installation tokens."""
+        await _installation_tokens.close()
+
+    @classmethod
+    async def _read_event(cls, server: ni_abc.ServerHost,
+                          request: web.Request) -> sansio.Event:
+        """Read the webhook event, skipping the decoding of useless actions."""
+        content_type = request.headers.get('content-type', '')
+        if not content_type.startswith('application/json'):
+            # Let gidgethub deal with (or reject) other encodings.
+            return sansio.Event.from_http(request.headers, await request.read(),
+                                          secret=server.contrib_secret())
+        body = await _read_body(request, server.contrib_secret())
+        event = request.headers['x-github-event']
+        delivery_id = request.headers['x-github-delivery']
+        if event == "pull_request":
+            action = _sniff_action(body)
+            if action is not None and action not in cls._useful_actions:
+                raise ni_abc.ResponseExit(status=http.HTTPStatus.NO_CONTENT)
+        elif event == "ping":
+            return sansio.Event({}, event=event, delivery_id=delivery_id)
+        return sansio.Event(_loads(body), event=event, delivery_id=delivery_id)
+
+    @classmethod
+    async def screen(cls, server: ni_abc.ServerHost, request: web.Request) -> None:
+        """Reject pings and useless events before a client session is needed.
+
+        The pull request is kept on the request for process(), the rest of
+        the event's payload being dropped.
+        """
+        if _SCREENED_EVENT in request:
+            # Replayed.
+            return
+        event = await cls._read_event(server, request)
         if event.event == "ping":
             # A ping event; nothing to do.
             # https://developer.github.com/webhooks/#ping-event
@@ -125,55 +735,250 @@ class Host(ni_abc.ContribHost):
             raise TypeError(f"don't know how to handle a {event.event!r} event")
         elif event.data['action'] not in cls._useful_actions:
             raise ni_abc.ResponseExit(status=http.HTTPStatus.NO_CONTENT)
-        elif event.data['action'] in {PullRequestEvent.opened.value, PullRequestEvent.synchronize.value}:
-            if event.data['action'] == PullRequestEvent.opened.value:
-                # GitHub is eventually consistent, so add a delay to wait for
-                # the API to digest the new pull request.
-                await asyncio.sleep(1)
-            return cls(server, client, PullRequestEvent(event.data['action']),
-                       event.data)
         elif event.data['action'] == PullRequestEvent.unlabeled.value:
             label = event.data['label']['name']
             if not label.startswith(LABEL_PREFIX):
                 raise ni_abc.ResponseExit(status=http.HTTPStatus.NO_CONTENT)
-            return cls(server, client, PullRequestEvent.unlabeled, event.data)
-        else:  # pragma: no cover
-            # Should never happen.
-            raise TypeError(f"don't know how to handle a {event.data['action']!r} action")
+            elif _is_echo(event.data['pull_request']['url'], label):
+                # The bot removed the label itself while updating the PR.
+                server.log(f"Ignoring removal of {label!r} by the bot")
+                raise ni_abc.ResponseExit(status=http.HTTPStatus.NO_CONTENT)
+        request[_SCREENED_EVENT] = PullRequest.from_payload(event.data, event.delivery_id)
+
+    @classmethod
+    def group(cls, request: web.Request) -> str:
+        """Group requests by repository."""
+        pull_request = request.get(_SCREENED_EVENT)
+        if pull_request is None:
+            return ''
+        return pull_request.repository
+
+    @classmethod
+    def priority(cls, server: ni_abc.ServerHost, request: web.Request) -> ni_abc.Priority:
+        """Put newly opened pull requests first and bursts of pushes last.
+
+        Pull requests of the server's priority repositories go up a level.
+        """
+        pull_request = request.get(_SCREENED_EVENT)
+        if pull_request is None:
+            return ni_abc.Priority.normal
+        if pull_request.action == PullRequestEvent.opened.value:
+            priority = ni_abc.Priority.high
+        elif (pull_request.action == PullRequestEvent.synchronize.value
+                and _is_burst(pull_request.url)):
+            priority = ni_abc.Priority.low
+        else:
+            priority = ni_abc.Priority.normal
+        if pull_request.repository.lower() in server.priority_repositories():
+            priority = ni_abc.Priority(max(priority - 1, ni_abc.Priority.high))
+        return priority
+
+    @classmethod
+    def contribution_key(cls, request: web.Request) -> Optional[str]:
+        """Coalesce waiting requests by the API URL of the pull request.
+
+        Removing a label only relabels the pull request, without the comment
+        opening or pushing to it may call for, so it is never coalesced.
+        """
+        pull_request = request.get(_SCREENED_EVENT)
+        if pull_request is None or pull_request.action == PullRequestEvent.unlabeled.value:
+            return None
+        return pull_request.url
+
+    @classmethod
+    def delivery_id(cls, request: web.Request) -> Optional[str]:
+        """Return the ID GitHub gave the delivery."""
+        pull_request = request.get(_SCREENED_EVENT)
+        if pull_request is None:
+            return None
+        return pull_request.delivery_id or None
+
+    @classmethod
+    def dump(cls, request: web.Request) -> Optional[Tuple[str, bytes]]:
+        """Serialize the screened pull request under its delivery ID."""
+        pull_request = request.get(_SCREENED_EVENT)
+        if pull_request is None:
+            return None
+        return pull_request.delivery_id, _dumps(pull_request._asdict())
+
+    @classmethod
+    def load(cls, data: bytes) -> web.Request:
+        """Recreate a screened request from the serialized pull request."""
+        fields = _loads(data)
+        if 'data' in fields:
+            # The whole event, as journaled by earlier versions.
+            pull_request = PullRequest.from_payload(fields['data'], fields['delivery_id'])
+        else:
+            pull_request = PullRequest(**fields)
+        # Processing only needs the screened pull request.
+        return ni_abc.ReplayedRequest.create({_SCREENED_EVENT: pull_request})
+
+    @classmethod
+    def stats(cls) -> Mapping[str, Any]:
+        """Report the caches and the API's latency."""
+        return {'responses': _response_cache.stats(), 'commits': _commit_cache.stats(),
+                'comments': len(_comment_digests), 'comment_urls': len(_comment_urls),
+                'removed_labels': len(_removed_labels), 'synchronized': len(_synchronized),
+                'api': _api_upstream.stats()}
+
+    @classmethod
+    async def warm_up(cls, server: ni_abc.ServerHost,
+                      client: aiohttp.ClientSession) -> AbstractSet[str]:
+        """Open a pooled connection to the API and load the App support.
+
+        The contributors of the recently updated open pull requests in the
+        server's warm-up repositories are returned, with their commits cached.
+        """
+        if server.contrib_app_id():
+            importlib.import_module('gidgethub.apps')
+        # Checking the rate limit doesn't count against it.
+        await GitHubAPI(client, REQUESTER).getitem('/rate_limit')
+        semaphore = asyncio.Semaphore(WARM_UP_CONCURRENCY)
+
+        async def recent(repository: str) -> List["Host"]:
+            async with semaphore:
+                oauth_token = await cls._repository_token(server, client, repository)
+                gh = CachingGitHubAPI(
+                    client, REQUESTER,
+                    oauth_token=oauth_token or server.contrib_auth_token(),
+                    responses=_response_cache, upstream=_api_upstream)
+                pull_requests = await gh.getitem(
+                    f'/repos/{repository}/pulls?state=open&sort=updated'
+                    f'&direction=desc&per_page={WARM_UP_PULL_REQUESTS}')
+            return [cls(server, client, PullRequestEvent.synchronize,
+                        PullRequest.from_payload({'pull_request': pull_request}),
+                        oauth_token=oauth_token)
+                    for pull_request in pull_requests]
+
+        async def usernames(contribution: "Host") -> AbstractSet[str]:
+            async with semaphore:
+                return await contribution.usernames()
+
+        repositories = sorted(server.warm_up_repositories())
+        listed = await asyncio.gather(*map(recent, repositories))
+        contributions = [contribution for contributions in listed
+                         for contribution in contributions]
+        found = await asyncio.gather(*map(usernames, contributions))
+        server.log(f"Warmed up with {len(contributions)} pull requests")
+        return frozenset().union(*found)
+
+    @classmethod
+    async def _repository_token(cls, server: ni_abc.ServerHost,
+                                client: aiohttp.ClientSession,
+                                repository: str) -> Optional[str]:
+        """Return the App's token for the repository, or None without an App."""
+        app_id = server.contrib_app_id()
+        private_key = server.contrib_private_key()
+        if not app_id or not private_key:
+            return None
+        from gidgethub import apps
+        jwt = apps.get_jwt(app_id=app_id, private_key=private_key)
+        installation = await GitHubAPI(client, REQUESTER).getitem(
+            f'/repos/{repository}/installation', jwt=jwt)
+        return await _installation_tokens.token(server, installation['id'])
+
+    @classmethod
+    async def process(cls, server: ni_abc.ServerHost,
+                      request: web.Request, client: aiohttp.ClientSession) -> "Host":
+        """Process the pull request."""
+        if _SCREENED_EVENT not in request:
+            await cls.screen(server, request)
+        pull_request = request[_SCREENED_EVENT]
+        action = PullRequestEvent(pull_request.action)
+        if action == PullRequestEvent.opened:
+            # GitHub is eventually consistent, so add a delay to wait for
+            # the API to digest the new pull request.
+            await asyncio.sleep(1)
+        oauth_token = None
+        if server.contrib_app_id():
+            if pull_request.installation_id is None:
+                raise ni_abc.ResponseExit(status=http.HTTPStatus.BAD_REQUEST,
+                                          text='no App installation in the payload')
+            # Each installation has its own rate limit.
+            oauth_token = await _installation_tokens.token(
+                server, pull_request.installation_id)
+        return cls(server, client, action, pull_request, oauth_token=oauth_token)
+
+    def key(self) -> str:
+        """Return the API URL of the pull request."""
+        return self.pull_request.url
 
     async def usernames(self) -> AbstractSet[str]:
         """Return an iterable with all of the contributors' usernames."""
-        pull_request = self.request['pull_request']
+        pull_request = self.pull_request
         # Start with the author of the pull request.
-        logins = {pull_request['user']['login']}
+        logins: Set[Any] = {pull_request.author} if pull_request.author else set()
         # For each commit, get the author and committer.
-        async for commit in self._gh.getiter(pull_request['commits_url']):
-            author = commit['author']
-            # When the author is missing there seems to typically be a
-            # matching commit that **does** specify the author. (issue #56)
-            if author:
-                author_login = author.get('login')
-                if commit['commit']['author']['email'].lower() == GITHUB_EMAIL:
-                    self.server.log("Ignoring GitHub-managed username: "
-                                    + author_login)
-                else:
-                    logins.add(author_login)
-
-            committer = commit['committer']
-            if committer:
-                committer_login = committer.get('login')
-                if commit['commit']['committer']['email'].lower() == GITHUB_EMAIL:
-                    self.server.log("Ignoring GitHub-managed username: "
-                                    + committer_login)
+        base_sha = pull_request.base_sha
+        head_sha = pull_request.head_sha
+        range_key = (base_sha, head_sha) if base_sha and head_sha else None
+        contributors: Optional[Sequence[_Contributors]] = None
+        if range_key:
+            contributors = _commit_cache.range(range_key)
+        if contributors is None:
+            contributors = [_contributors(commit) async for commit in self._commits()]
+            if range_key:
+                _commit_cache.add_range(range_key, contributors)
+        for identities in contributors:
+            for identity in identities:
+                if identity is None:
+                    continue
+                login, github_managed = identity
+                if github_managed:
+                    self.server.log(f"Ignoring GitHub-managed username: {login}")
                 else:
-                    logins.add(committer_login)
+                    logins.add(login)
         return frozenset(logins)
 
+    async def _commits(self) -> AsyncIterator[JSONDict]:
+        """Yield the pull request's commits, fetching pages concurrently.
+
+        The number of pages is known up front from the commit count in the
+        payload. Should the count be stale, pages continue to be fetched one
+        at a time until one comes back short.
+        """
+        commits_url = self.pull_request.commits_url
+        count = self.pull_request.commits
+        if count is None:
+            async for commit in self._gh.getiter(commits_url):
+                yield commit
+            return
+
+        def page_url(page: int) -> str:
+            return f'{commits_url}?per_page={COMMITS_PER_PAGE}&page={page}'
+
+        last_page = max(1, math.ceil(min(count, MAX_LISTED_COMMITS)
+                                     / COMMITS_PER_PAGE))
+        semaphore = asyncio.Semaphore(PAGE_CONCURRENCY)
+
+        async def fetch(page: int) -> Tuple[int, List[JSONDict]]:
+            async with semaphore:
+                return page, await self._gh.getitem(page_url(page))
+
+        fetches = [asyncio.ensure_future(fetch(page))
+                   for page in range(1, last_page + 1)]
+        try:
+            for fetched in asyncio.as_completed(fetches):
+                page, commits = await fetched
+                for commit in commits:
+                    yield commit
+                if page == last_page:
+                    last_commits = commits
+        finally:
+            for pending in fetches:
+                pending.cancel()
+
+        while (len(last_commits) == COMMITS_PER_PAGE
+               and last_page * COMMITS_PER_PAGE < MAX_LISTED_COMMITS):
+            last_page += 1
+            last_commits = await self._gh.getitem(page_url(last_page))
+            for commit in last_commits:
+                yield commit
+
     async def labels_url(self, label: Optional[str] = None) -> str:
         """Construct the URL to the label."""
         if not hasattr(self, '_labels_url'):
-            issue_url = self.request['pull_request']['issue_url']
-            issue_data = await self._gh.getitem(issue_url)
+            issue_data = await self._gh.getitem(self.pull_request.issue_url)
             self._labels_url = uritemplate.URITemplate(issue_data['labels_url'])
         return self._labels_url.expand(name=label)  # type: ignore
 
@@ -203,42 +1008,143 @@ class Host(ni_abc.ContribHost):
         if cla_label is None:
             return None
         deletion_url = await self.labels_url(cla_label)
-        await self._gh.delete(deletion_url)
+        # Recorded first as the webhook for the removal may arrive before
+        # the response does.
+        _record_removal(self.key(), cla_label)
+        try:
+            await self._gh.delete(deletion_url)
+        except gidgethub.BadRequest as exc:
+            if exc.status_code != http.HTTPStatus.NOT_FOUND:
+                _removed_labels.pop((self.key(), cla_label), None)
+                raise
+            # Already removed, e.g. by an earlier attempt which was retried.
+        except BaseException:
+            _removed_labels.pop((self.key(), cla_label), None)
+            raise
         return cla_label
 
-    def _problem_message_template(self, status: ni_abc.Status) -> str:
-        if status == ni_abc.Status.not_signed:
-            if random.random() < EASTEREGG_PROBABILITY:  # pragma: no cover
-                return NO_CLA_BODY_EASTEREGG
-            else:
-                return NO_CLA_BODY
-        elif status == ni_abc.Status.username_not_found:
-            return NO_USERNAME_BODY
-        else:  # pragma: no cover
-            # Should never be reached.
-            raise TypeError("don't know how to handle {}".format(status))
-
     async def comment(self, problems: Mapping[ni_abc.Status, AbstractSet[str]]) -> Optional[str]:
-        """Add an appropriate comment relating to the CLA status."""
+        """Add an appropriate comment relating to the CLA status.
+
+        Nothing is posted if the comment is identical to the bot's last CLA
+        comment, which is looked for on the pull request unless the bot
+        remembers it. If the server says so, the previous
+        CLA comment is edited rather than a new comment being added.
+        """
         if not problems:
             return None
 
-        comments_url = self.request['pull_request']['comments_url']
-        problem_messages: Dict[str, str] = defaultdict(str)
-        for status, usernames in problems.items():
-            problem_messages[status.name] = self._problem_message_template(
-                status
-            ).format(
-                ', '.join(f"@{username}" for username in usernames)
-            )
+        easteregg = (ni_abc.Status.not_signed in problems
+                     and random.random() < EASTEREGG_PROBABILITY)
+        rendered = _comment_renderer.render(problems, easteregg=easteregg)
+        key = self.key()
+        repeated = {_comment_renderer.render(problems, easteregg=either).digest
+                    for either in (False, True)}
+        comment_url = None
+        if _comment_digests.get(key) not in repeated:
+            # Searching the comments remembers the last one's digest.
+            comment_url = await self.comment_url()
+        if _comment_digests.get(key) in repeated:
+            self.server.log("Skipping repeated comment on " + key)
+            return None
+
+        data = {'body': rendered.body}
+        if not self.server.update_comments():
+            comment_url = None
+        if comment_url:
+            try:
+                await self._gh.patch(comment_url, data=data)
+            except gidgethub.RateLimitExceeded:
+                raise
+            except gidgethub.BadRequest as exc:
+                if exc.status_code not in {http.HTTPStatus.NOT_FOUND,
+                                           http.HTTPStatus.FORBIDDEN}:
+                    raise
+                # The comment was deleted, or can't be edited by the bot.
+                comment_url = None
+        if not comment_url:
+            posted = await self._gh.post(self.pull_request.comments_url, data=data)
+            comment_url = posted.get('url', '') if isinstance(posted, dict) else ''
+        _remember(_comment_digests, key, rendered.digest)
+        _remember(_comment_urls, key, comment_url)
+        return rendered.body
 
-        message = NO_CLA_TEMPLATE.format_map(problem_messages)
+    async def login(self) -> str:
+        """Return the login the bot comments as, looking it up the first time."""
+        app_id = self.server.contrib_app_id()
+        try:
+            return _logins[app_id]
+        except KeyError:
+            pass
+        private_key = self.server.contrib_private_key()
+        if app_id and private_key:
+            from gidgethub import apps
+            jwt = apps.get_jwt(app_id=app_id, private_key=private_key)
+            app = await self._gh.getitem('/app', jwt=jwt)
+            login = f"{app['slug']}[bot]"
+        else:
+            login = (await self._gh.getitem('/user'))['login']
+        _logins[app_id] = login
+        return login
+
+    async def comment_url(self) -> Optional[str]:
+        """Return the URL of the bot's most recent CLA comment, or None.
+
+        The pull request's comments are only searched the first time, the
+        digest of the comment found being remembered too.
+        """
+        key = self.key()
+        try:
+            return _comment_urls[key] or None
+        except KeyError:
+            pass
+        comment_url = ''
+        body = None
+        async for comment in self._gh.getiter(self.pull_request.comments_url):
+            if not comment['body'].startswith(_COMMENT_PREFIX):
+                continue
+            author = (comment.get('user') or {}).get('login')
+            if author == await self.login():
+                comment_url = comment['url']
+                body = comment['body']
+        if body is not None:
+            _remember(_comment_digests, key,
+                      hashlib.sha256(body.encode('utf-8')).hexdigest())
+        _remember(_comment_urls, key, comment_url)
+        return comment_url or None
+
+    async def set_status(self, problems: Mapping[ni_abc.Status, AbstractSet[str]]) -> str:
+        """Set a commit status on the head of the pull request."""
+        statuses_url = self.pull_request.statuses_url
+        if problems:
+            state = 'failure'
+            usernames = sorted(set().union(*problems.values()))
+            description = 'CLA not signed by ' + ', '.join(f'@{username}'
+                                                           for username in usernames)
+            if len(description) > STATUS_DESCRIPTION_LENGTH:
+                description = description[:STATUS_DESCRIPTION_LENGTH - 3] + '...'
+        else:
+            state = 'success'
+            description = 'CLA signed'
+        await self._gh.post(statuses_url, data={'state': state,
+                                                'context': STATUS_CONTEXT,
+                                                'description': description,
+                                                'target_url': STATUS_TARGET_URL})
+        return state
 
-        await self._gh.post(comments_url, data={'body': message})
-        return message
+    def _uses_status(self) -> bool:
+        return self.pull_request.repository.lower() in self.server.status_repositories()
 
     async def update(self, problems: Mapping[ni_abc.Status, AbstractSet[str]]) -> None:
-        if self.event == PullRequestEvent.opened:
+        if self._uses_status():
+            # Setting a commit status is idempotent, so there's no need to
+            # check what it was before.
+            await self.set_status(problems)
+            if self.event != PullRequestEvent.unlabeled:
+                # Only comments which differ from the bot's last are posted,
+                # so pushes which change nothing are quiet.
+                await self.comment(problems)
+        elif self.event == PullRequestEvent.opened:
             await self.set_label(problems)
             await self.comment(problems)
         elif self.event == PullRequestEvent.unlabeled:
@@ -247,12 +1153,16 @@ class Host(ni_abc.ContribHost):
             # amount to a repeated message about lacking a CLA.
             await self.set_label(problems)
         elif self.event == PullRequestEvent.synchronize:
+            # The webhook for the removal of the label is ignored as the
+            # bot's own doing, so the new label is set here.
             current_label = await self.current_label()
             if not problems:
                 if current_label != CLA_OK:
                     await self.remove_label()
+                    await self.set_label(problems)
             elif current_label != NO_CLA:
                     await self.remove_label()
+                    await self.set_label(problems)
                     # Since there is a chance a new person was added to a PR
                     # which caused the change in status, a comment on how to
                     # resolve the CLA issue is probably called for.
@@ -6,6 +6,13 @@ from typing import AbstractSet, Optional
 from . import abc as ni_abc
 
 
+def _repositories(name: str) -> AbstractSet[str]:
+    """Return the lowercased repositories listed, comma-separated, in the variable."""
+    repositories = os.environ.get(name, '')
+    return frozenset(filter(None, (repository.strip().lower()
+                                   for repository in repositories.split(','))))
+
+
 class Host(ni_abc.ServerHost):
 
     """Server hosting on Heroku."""
@@ -18,6 +25,14 @@ class Host(ni_abc.ServerHost):
     def contrib_auth_token() -> str:
         return os.environ['GH_AUTH_TOKEN']
 
+    @staticmethod
+    def contrib_app_id() -> Optional[str]:
+        return os.environ.get('GH_APP_ID')
+
+    @staticmethod
+    def contrib_private_key() -> Optional[str]:
+        return os.environ.get('GH_PRIVATE_KEY')
+
     @staticmethod
     def contrib_secret() -> str:
         return os.environ["GH_SECRET"]
@@ -44,3 +59,47 @@ class Host(ni_abc.ServerHost):
 
         return frozenset([trusted.strip().lower()
                 for trusted in cla_trusted_users.split(",")])
+
+    def status_repositories(self) -> AbstractSet[str]:
+        """Return the repositories which use a commit status instead of labels."""
+        return _repositories('CLA_STATUS_REPOS')
+
+    def priority_repositories(self) -> AbstractSet[str]:
+        """Return the repositories to process the contributions of sooner under load."""
+        return _repositories('CLA_PRIORITY_REPOS')
+
+    def warm_up_repositories(self) -> AbstractSet[str]:
+        """Return the repositories to warm the caches from at startup."""
+        return _repositories('CLA_WARM_UP_REPOS')
+
+    @staticmethod
+    def warm_up_deadline() -> float:
+        return float(os.environ.get('CLA_WARM_UP_DEADLINE', 30))
+
+    @staticmethod
+    def update_comments() -> bool:
+        return os.environ.get('CLA_UPDATE_COMMENTS', '').lower() in {'1', 'true', 'yes'}
+
+    @staticmethod
+    def hedge_budget() -> float:
+        return float(os.environ.get('CLA_HEDGE_PERCENT', 0)) / 100
+
+    @staticmethod
+    def journal_directory() -> Optional[str]:
+        return os.environ.get('CLA_JOURNAL_DIR')
+
+    @staticmethod
+    def loop_monitor_directory() -> Optional[str]:
+        return os.environ.get('CLA_LOOP_MONITOR_DIR')
+
+    @staticmethod
+    def admin_token() -> Optional[str]:
+        return os.environ.get('CLA_ADMIN_TOKEN') or None
+
+    @staticmethod
+    def cache_url() -> Optional[str]:
+        return os.environ.get('CLA_CACHE_URL') or None
+
+    @staticmethod
+    def cla_index_path() -> Optional[str]:
+        return os.environ.get('CLA_INDEX_PATH')
@@ -0,0 +1,156 @@
+"""A memory-mapped on-disk index of CLA statuses.
+
+The index is a file of fixed-width records sorted by username, so any number
+of processes can ``mmap`` it and binary search it without deserializing the
+whole file. Each record is the lowercased, NUL-padded username followed by a
+single byte holding the ``ni.abc.Status`` value.
+
+Updates are made by rewriting the file to a temporary path and atomically
+renaming it over the old one; readers notice the new inode and remap. The
+old mapping is left for the garbage collector to close once nothing reads
+it, and updates (which may run in another thread) read the file through a
+mapping of their own.
+"""
+import mmap
+import os
+import tempfile
+from typing import AbstractSet, Dict, Iterable, Iterator, Mapping, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+from . import abc as ni_abc
+
+
+# GitHub usernames are at most 39 ASCII characters long.
+KEY_SIZE = 39
+RECORD_SIZE = KEY_SIZE + 1
+
+
+def _key(username: str) -> Optional[bytes]:
+    """Return the on-disk key for the username, or None if it can't be stored."""
+    try:
+        key = username.lower().encode('ascii')
+    except UnicodeEncodeError:
+        return None
+    if not key or len(key) > KEY_SIZE:
+        return None
+    return key.ljust(KEY_SIZE, b'\0')
+
+
+class StatusIndex:
+
+    """Read and update an on-disk index of usernames to their CLA status."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._identity: Optional[Tuple[int, int]] = None
+        self._map: Optional[mmap.mmap] = None
+
+    def _remap(self) -> Optional[mmap.mmap]:
+        """Return the current mapping, remapping if the file was replaced."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._map = self._identity = None
+            return None
+        identity = stat.st_ino, stat.st_size
+        if identity == self._identity:
+            return self._map
+        # Not closed, as a lookup or iteration may still be reading it.
+        self._map = None
+        self._identity = identity
+        if stat.st_size >= RECORD_SIZE:
+            with open(self.path, 'rb') as file:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._map = None
+        self._identity = None
+
+    @staticmethod
+    def _search(mapped: mmap.mmap, key: bytes) -> Optional[ni_abc.Status]:
+        low, high = 0, len(mapped) // RECORD_SIZE
+        while low < high:
+            middle = (low + high) // 2
+            offset = middle * RECORD_SIZE
+            found = mapped[offset:offset + KEY_SIZE]
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return ni_abc.Status(mapped[offset + KEY_SIZE])
+        return None
+
+    def lookup(self, username: str) -> Optional[ni_abc.Status]:
+        """Return the recorded status of the username, or None if unknown."""
+        return self.lookup_many([username]).get(username)
+
+    def lookup_many(self, usernames: Iterable[str]) -> Dict[str, ni_abc.Status]:
+        """Return the recorded status of every known username."""
+        mapped = self._remap()
+        if mapped is None:
+            return {}
+        found = {}
+        for username in usernames:
+            key = _key(username)
+            if key is None:
+                continue
+            status = self._search(mapped, key)
+            if status is not None:
+                found[username] = status
+        return found
+
+    def __iter__(self) -> Iterator[Tuple[bytes, int]]:
+        mapped = self._remap()
+        if mapped is None:
+            return
+        for offset in range(0, len(mapped) - RECORD_SIZE + 1, RECORD_SIZE):
+            yield mapped[offset:offset + KEY_SIZE], mapped[offset + KEY_SIZE]
+
+    def update(self, statuses: Mapping[str, ni_abc.Status]) -> AbstractSet[str]:
+        """Record the statuses, returning the usernames which changed.
+
+        Writers are serialized with an advisory lock so several processes may
+        safely call this, although one writer per index is expected.
+        """
+        with open(self.path + '.lock', 'wb') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Read through a separate mapping, as the index's own belongs
+            # to the thread doing lookups.
+            reader = StatusIndex(self.path)
+            try:
+                records = dict(reader)
+            finally:
+                reader.close()
+            changed = set()
+            for username, status in statuses.items():
+                key = _key(username)
+                if key is None or records.get(key) == status.value:
+                    continue
+                records[key] = status.value
+                changed.add(username)
+            if changed:
+                self._write(records)
+        return frozenset(changed)
+
+    def _write(self, records: Mapping[bytes, int]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.ni-index-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for key in sorted(records):
+                    file.write(key + bytes([records[key]]))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
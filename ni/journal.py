@@ -0,0 +1,243 @@
+"""Journal accepted deliveries so that none are lost should the process die.
+
+The journal is a file of frames, each a header of its kind, sequence number
+and data length, then the data, then a CRC-32 of everything before it.
+An entry frame's data is the delivery's key followed by its serialized
+request; a done frame has no data and marks the entry with the same
+sequence number as completed. A torn frame at the end of the file, from
+dying mid-write, fails its CRC and is discarded along with anything after it.
+"""
+import asyncio
+import contextlib
+import os
+import struct
+import tempfile
+import zlib
+from typing import IO, AsyncIterator, Dict, List, Optional, Tuple, Type
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+
+HEADER = struct.Struct('<BQI')
+TRAILER = struct.Struct('<I')
+KEY_LENGTH = struct.Struct('<H')
+ENTRY = 1
+DONE = 2
+# Once the journal file grows this big it is rewritten without the entries
+# which have been completed.
+COMPACT_SIZE = 16 * 1024**2
+
+Entry = Tuple[int, str, bytes]
+
+
+def frame(kind: int, sequence: int, data: bytes = b'') -> bytes:
+    """Frame the data."""
+    framed = HEADER.pack(kind, sequence, len(data)) + data
+    return framed + TRAILER.pack(zlib.crc32(framed))
+
+
+def entry_frame(sequence: int, key: str, data: bytes) -> bytes:
+    encoded_key = key.encode('utf-8')
+    return frame(ENTRY, sequence, KEY_LENGTH.pack(len(encoded_key)) + encoded_key + data)
+
+
+def read_frames(contents: bytes) -> Tuple[List[Tuple[int, int, bytes]], int]:
+    """Return the intact frames and the length of the contents they span."""
+    frames = []
+    offset = 0
+    while offset + HEADER.size <= len(contents):
+        kind, sequence, length = HEADER.unpack_from(contents, offset)
+        end = offset + HEADER.size + length
+        if end + TRAILER.size > len(contents):
+            break
+        crc, = TRAILER.unpack_from(contents, end)
+        if crc != zlib.crc32(contents[offset:end]) or kind not in (ENTRY, DONE):
+            break
+        frames.append((kind, sequence, contents[offset + HEADER.size:end]))
+        offset = end + TRAILER.size
+    return frames, offset
+
+
+class Journal:
+
+    """An append-only journal of accepted deliveries which aren't done yet.
+
+    Every process claims a journal of its own in the directory, taking over
+    the journal of a process which died. Appending waits until the entry is
+    durable; entries appended while a write is in progress are written and
+    fsynced together afterwards (group commit). Completion is not waited on
+    nor fsynced: should a done frame be lost, the delivery is merely
+    replayed, which updating a contribution tolerates.
+    """
+
+    def __init__(self, directory: str, compact_size: int = COMPACT_SIZE) -> None:
+        self.directory = directory
+        self.compact_size = compact_size
+        self.path: Optional[str] = None
+        # For measuring write amplification.
+        self.appends = self.syncs = self.bytes_written = 0
+        self._lock: Optional[IO[bytes]] = None
+        self._file: Optional[IO[bytes]] = None
+        self._size = 0
+        self._outstanding: Dict[int, Tuple[str, bytes]] = {}
+        self._next_sequence = 0
+        self._buffer = bytearray()
+        self._waiters: List["asyncio.Future[None]"] = []
+        self._writing: Optional["asyncio.Task[None]"] = None
+
+    def open(self) -> List[Entry]:
+        """Claim a journal and return its unfinished entries, oldest first.
+
+        This blocks, so should be run in an executor.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        slot = 0
+        while True:
+            lock = open(os.path.join(self.directory, f'{slot}.lock'), 'wb')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                slot += 1
+            else:
+                break
+        self._lock = lock
+        self.path = os.path.join(self.directory, f'{slot}.journal')
+        with contextlib.suppress(FileNotFoundError):
+            with open(self.path, 'rb') as file:
+                frames, _ = read_frames(file.read())
+            for kind, sequence, data in frames:
+                self._next_sequence = max(self._next_sequence, sequence + 1)
+                if kind == DONE:
+                    self._outstanding.pop(sequence, None)
+                else:
+                    key_length, = KEY_LENGTH.unpack_from(data)
+                    key = data[KEY_LENGTH.size:KEY_LENGTH.size + key_length]
+                    self._outstanding[sequence] = (key.decode('utf-8'),
+                                                   data[KEY_LENGTH.size + key_length:])
+        # Starting afresh also drops any torn frame at the end.
+        self._compact(sorted(self._outstanding.items()))
+        return [(sequence, key, data)
+                for sequence, (key, data) in sorted(self._outstanding.items())]
+
+    async def append(self, key: str, data: bytes) -> int:
+        """Durably journal the data, returning its sequence number."""
+        if self._file is None:
+            raise RuntimeError('the journal is not open')
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        self._outstanding[sequence] = key, data
+        self._buffer += entry_frame(sequence, key, data)
+        self.appends += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._schedule()
+        # The entry is written regardless of the caller being cancelled.
+        await asyncio.shield(waiter)
+        return sequence
+
+    def complete(self, sequence: int) -> None:
+        """Mark the entry as done."""
+        if self._outstanding.pop(sequence, None) is None:
+            return
+        self._buffer += frame(DONE, sequence)
+        self._schedule()
+
+    @contextlib.asynccontextmanager
+    async def entry(self, key: str, data: bytes, sequence: Optional[int] = None, *,
+                    unfinished: Tuple[Type[Exception], ...] = ()) -> AsyncIterator[int]:
+        """Journal the data for the duration of the context.
+
+        The entry is completed when the context exits, even by an exception,
+        but not when it is cancelled, as happens when shutting down, nor by
+        an exception of the ``unfinished`` types, as when the work was turned
+        away and must be replayed. An entry which is being replayed is
+        passed by its sequence number.
+        """
+        if sequence is None:
+            sequence = await self.append(key, data)
+        try:
+            yield sequence
+        except asyncio.CancelledError:
+            # An Exception before Python 3.8.
+            raise
+        except unfinished:
+            raise
+        except Exception:
+            self.complete(sequence)
+            raise
+        self.complete(sequence)
+
+    def _schedule(self) -> None:
+        if self._writing is None:
+            self._writing = asyncio.ensure_future(self._write_all())
+
+    async def _write_all(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while self._buffer:
+                data, self._buffer = bytes(self._buffer), bytearray()
+                waiters, self._waiters = self._waiters, []
+                try:
+                    # Only entries need to be durable before returning.
+                    await loop.run_in_executor(None, self._write, data, bool(waiters))
+                except Exception as exc:
+                    for waiter in waiters:
+                        waiter.set_exception(exc)
+                    continue
+                for waiter in waiters:
+                    waiter.set_result(None)
+                if self._size >= self.compact_size:
+                    outstanding = sorted(self._outstanding.items())
+                    await loop.run_in_executor(None, self._compact, outstanding)
+        finally:
+            self._writing = None
+
+    def _write(self, data: bytes, sync: bool) -> None:
+        assert self._file is not None
+        self._file.write(data)
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+            self.syncs += 1
+        self._size += len(data)
+        self.bytes_written += len(data)
+
+    def _compact(self, outstanding: List[Tuple[int, Tuple[str, bytes]]]) -> None:
+        """Atomically replace the journal with one of the outstanding entries."""
+        assert self.path is not None
+        file = tempfile.NamedTemporaryFile(dir=self.directory, prefix='.journal-',
+                                           delete=False)
+        try:
+            for sequence, (key, data) in outstanding:
+                file.write(entry_frame(sequence, key, data))
+            file.flush()
+            os.fsync(file.fileno())
+            size = file.tell()
+            file.close()
+            os.replace(file.name, self.path)
+        except BaseException:
+            file.close()
+            os.unlink(file.name)
+            raise
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, 'ab')
+        self._size = size
+        self.syncs += 1
+        self.bytes_written += size
+
+    async def close(self) -> None:
+        """Finish writing and release the journal."""
+        if self._writing is not None:
+            await self._writing
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
@@ -0,0 +1,193 @@
+"""Watch the event loop for stalls and profile what blocked it.
+
+A heartbeat task notes each time the loop gets around to it. A watchdog
+thread checks on the heartbeat; once it is late by more than the threshold
+the loop is stalled in synchronous code, so the watchdog writes out the
+stack of the loop's thread -- the blocking coroutine's included -- and then
+samples that stack for a while. Samples are written as folded stacks
+(one ``outermost;...;innermost count`` line per distinct stack), the input
+of flame graph tools. Nothing runs on the loop besides the heartbeat.
+"""
+import asyncio
+import collections
+import os
+import sys
+import threading
+import time
+import traceback
+from types import CodeType, FrameType
+from typing import Any, Counter, Dict, Optional, Tuple
+
+from aiohttp import web
+
+from . import abc as ni_abc
+
+
+# How late the heartbeat may be before the loop counts as stalled, and how
+# often it beats (in seconds).
+LAG_THRESHOLD = 0.1
+HEARTBEAT_INTERVAL = 0.05
+# For how long and how often the loop is sampled after a stall.
+PROFILE_SECONDS = 10.0
+SAMPLE_INTERVAL = 0.01
+
+
+def _codes(frame: Optional[FrameType]) -> Tuple[CodeType, ...]:
+    """Return the code of the frame's stack, outermost first."""
+    codes = []
+    while frame is not None:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    codes.reverse()
+    return tuple(codes)
+
+
+def _folded(codes: Tuple[CodeType, ...]) -> str:
+    return ';'.join(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})'
+                    for code in codes)
+
+
+class LoopMonitor:
+
+    """Measure the event loop's scheduling delay, profiling it when it stalls.
+
+    Only samples whose stack goes through the focus code (e.g. the request
+    handler's) are kept, if one is given. Stacks and profiles are written as
+    files in the directory.
+    """
+
+    def __init__(self, server: ni_abc.ServerHost, directory: str, *,
+                 threshold: float = LAG_THRESHOLD, interval: float = HEARTBEAT_INTERVAL,
+                 profile_seconds: float = PROFILE_SECONDS,
+                 sample_interval: float = SAMPLE_INTERVAL,
+                 focus: Optional[CodeType] = None) -> None:
+        self.server = server
+        self.directory = directory
+        self.threshold = threshold
+        self.interval = interval
+        self.profile_seconds = profile_seconds
+        self.sample_interval = sample_interval
+        self.focus = focus
+        self.max_lag = 0.0
+        self.stalls = self.profiles = self.samples = 0
+        # The CPU time taken by the watchdog, to keep an eye on its overhead.
+        self.cpu_time = 0.0
+        self._started = self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._heartbeat: Optional["asyncio.Task[None]"] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._written = 0
+
+    async def start(self, app: web.Application) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._loop_thread = threading.get_ident()
+        self._started = self._beat = time.monotonic()
+        self._stopping.clear()
+        self._heartbeat = asyncio.create_task(self._beating())
+        self._watchdog = threading.Thread(target=self._watch, name='ni-loop-monitor',
+                                          daemon=True)
+        self._watchdog.start()
+
+    async def stop(self, app: web.Application) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        if self._watchdog is not None:
+            self._stopping.set()
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._watchdog.join)
+            self._watchdog = None
+
+    async def _beating(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.max_lag = max(self.max_lag, now - self._beat - self.interval)
+            self._beat = now
+
+    def _path(self, kind: str, extension: str) -> str:
+        self._written += 1
+        stamp = time.strftime('%Y%m%dT%H%M%S')
+        return os.path.join(self.directory,
+                            f'{kind}-{os.getpid()}-{stamp}-{self._written}.{extension}')
+
+    def _loop_frame(self) -> Optional[FrameType]:
+        assert self._loop_thread is not None
+        return sys._current_frames().get(self._loop_thread)
+
+    def _watch(self) -> None:
+        """Check on the heartbeat until stopped, sampling after each stall.
+
+        While the loop keeps up, the watchdog only wakes when the next
+        heartbeat would be over the threshold late.
+        """
+        stalled = False
+        profile: Optional[Counter[Tuple[CodeType, ...]]] = None
+        profile_until = 0.0
+        started = time.thread_time()
+        timeout = self.interval + self.threshold
+        while not self._stopping.wait(timeout):
+            self.cpu_time = time.thread_time() - started
+            now = time.monotonic()
+            if profile is not None:
+                self._sample(profile)
+                if now >= profile_until:
+                    self._write_profile(profile)
+                    profile = None
+            lag = now - self._beat - self.interval
+            if lag <= self.threshold:
+                stalled = False
+            elif not stalled:
+                stalled = True
+                self.stalls += 1
+                self._write_stall(lag)
+                if profile is None:
+                    profile = collections.Counter()
+                    profile_until = now + self.profile_seconds
+            if profile is not None:
+                timeout = self.sample_interval
+            elif stalled:
+                timeout = self.interval
+            else:
+                # Until the heartbeat after the last one is late.
+                timeout = max(self._beat + self.interval + self.threshold - now,
+                              self.interval)
+        if profile is not None:
+            self._write_profile(profile)
+
+    def _sample(self, profile: Counter[Tuple[CodeType, ...]]) -> None:
+        # Stacks are only formatted when written, keeping sampling cheap.
+        codes = _codes(self._loop_frame())
+        if self.focus is not None and self.focus not in codes:
+            return
+        self.samples += 1
+        profile[codes] += 1
+
+    def _write_stall(self, lag: float) -> None:
+        frame = self._loop_frame()
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+        path = self._path('stall', 'txt')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(f'Event loop stalled for at least {lag:.3f}s\n{stack}')
+        self.server.log(f"Event loop stalled for {lag:.3f}s; stack written to {path}")
+
+    def _write_profile(self, profile: Counter[Tuple[CodeType, ...]]) -> None:
+        self.profiles += 1
+        path = self._path('profile', 'folded')
+        with open(path, 'w', encoding='utf-8') as file:
+            for codes, count in profile.most_common():
+                file.write(f'{_folded(codes)} {count}\n')
+        self.server.log(f"Wrote {sum(profile.values())} loop samples to {path}")
+
+    def overhead(self) -> float:
+        """Return the watchdog's CPU time as a fraction of the time monitored."""
+        elapsed = time.monotonic() - self._started
+        return self.cpu_time / elapsed if elapsed > 0 else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        lag = max(0.0, time.monotonic() - self._beat - self.interval)
+        return {'lag': round(lag, 4), 'max_lag': round(self.max_lag, 4),
+                'stalls': self.stalls, 'profiles': self.profiles, 'samples': self.samples,
+                'overhead': round(self.overhead(), 5)}
@@ -0,0 +1,242 @@
+"""Share processing capacity fairly between groups of requests."""
+import asyncio
+import bisect
+import collections
+import contextlib
+from typing import AsyncIterator, Deque, Dict, List, Mapping, Optional, Tuple
+
+
+# Defaults for how much work may run at once, in total and per group.
+CONCURRENCY = 64
+GROUP_CONCURRENCY = 8
+# The default for how much work may wait at once, across every tier.
+QUEUE_SIZE = 512
+# How many of the latest queue latencies of each tier are kept.
+LATENCY_SAMPLES = 256
+
+
+class Shed(Exception):
+
+    """Raised to work turned away as the queue is full of more important work."""
+
+
+class Superseded(Exception):
+
+    """Raised to waiting work replaced by newer work with the same key."""
+
+
+# A job's future, when it was queued and its key.
+Waiter = Tuple["asyncio.Future[None]", float, Optional[str]]
+
+
+class _Tier:
+
+    """The work waiting at one priority, taking turns by group."""
+
+    def __init__(self) -> None:
+        self.waiting: Dict[str, Deque[Waiter]] = {}
+        # Groups with waiting work, in the order they will be served.
+        self.rotation: Deque[str] = collections.deque()
+        self.turns_left = 0
+        self.shed = self.superseded = 0
+        # How long the latest work waited, in seconds.
+        self.latencies: Deque[float] = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def queued(self) -> int:
+        return sum(map(len, self.waiting.values()))
+
+    def forget(self, group: str) -> None:
+        del self.waiting[group]
+        if self.rotation and self.rotation[0] == group:
+            self.turns_left = 0
+        self.rotation.remove(group)
+
+    def rotate(self) -> None:
+        self.rotation.rotate(-1)
+        self.turns_left = 0
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class FairScheduler:
+
+    """Dispatch work by priority, then by weighted round-robin between groups.
+
+    At most ``concurrency`` jobs run at once and at most ``group_concurrency``
+    from any one group. Work of a lower tier only starts once no work of a
+    higher one (tier 0 being the highest) can. Within a tier, waiting groups
+    take turns, each dispatching as many jobs in a row as its weight (1 by
+    default), so a burst of work in one group (e.g. a repository) doesn't
+    hold up everyone else.
+
+    A job may have a key (e.g. the contribution it is for), in which case a
+    job waiting with the same key is superseded by it, raising Superseded:
+    only the newest is worth doing, and it waits in the more important of
+    their tiers. At most ``queue_size`` jobs wait at
+    once. Beyond that, the newest job of the busiest group in the lowest
+    waiting tier is shed, raising Shed.
+    """
+
+    def __init__(self, concurrency: int = CONCURRENCY,
+                 group_concurrency: int = GROUP_CONCURRENCY,
+                 weights: Optional[Mapping[str, int]] = None,
+                 queue_size: int = QUEUE_SIZE) -> None:
+        self.concurrency = concurrency
+        self.group_concurrency = group_concurrency
+        self.weights = dict(weights or {})
+        self.queue_size = queue_size
+        self.running = self.queued = 0
+        self._running: Dict[str, int] = collections.Counter()
+        # The tier and group of the job waiting with each key.
+        self._keys: Dict[str, Tuple[int, str, "asyncio.Future[None]"]] = {}
+        self._tiers: Dict[int, _Tier] = {}
+        # The tiers, highest first.
+        self._order: List[int] = []
+
+    @contextlib.asynccontextmanager
+    async def slot(self, group: str, tier: int = 0,
+                   key: Optional[str] = None) -> AsyncIterator[None]:
+        """Wait for the group's turn, holding a slot for the context.
+
+        Raise Shed should the job be turned away while waiting, or Superseded
+        should newer work with the same key arrive while it waits.
+        """
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        if key is not None:
+            tier = min(tier, self._supersede(key, tier))
+        queue = self._tier(tier)
+        if group not in queue.waiting:
+            queue.waiting[group] = collections.deque()
+            queue.rotation.append(group)
+        queue.waiting[group].append((waiter, loop.time(), key))
+        if key is not None:
+            self._keys[key] = tier, group, waiter
+        self.queued += 1
+        self._dispatch()
+        if self.queued > self.queue_size:
+            self._shed()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if not waiter.done() or waiter.cancelled():
+                self._abandon(tier, group, waiter)
+            elif waiter.exception() is None:
+                self._release(group)
+            raise
+        try:
+            yield
+        finally:
+            self._release(group)
+
+    def _tier(self, tier: int) -> _Tier:
+        queue = self._tiers.get(tier)
+        if queue is None:
+            queue = self._tiers[tier] = _Tier()
+            bisect.insort(self._order, tier)
+        return queue
+
+    def _abandon(self, tier: int, group: str, waiter: "asyncio.Future[None]") -> None:
+        queue = self._tiers[tier]
+        waiting = queue.waiting.get(group)
+        if waiting is None:
+            return
+        for entry in waiting:
+            if entry[0] is waiter:
+                waiting.remove(entry)
+                self._forget_key(entry[2], waiter)
+                self.queued -= 1
+                break
+        if not waiting:
+            queue.forget(group)
+
+    def _forget_key(self, key: Optional[str], waiter: "asyncio.Future[None]") -> None:
+        if key is not None and key in self._keys and self._keys[key][2] is waiter:
+            del self._keys[key]
+
+    def _supersede(self, key: str, tier: int) -> int:
+        """Turn away the job waiting with the key, if any, returning its tier."""
+        waiting = self._keys.get(key)
+        if waiting is None:
+            return tier
+        tier, group, waiter = waiting
+        self._abandon(tier, group, waiter)
+        self._tiers[tier].superseded += 1
+        waiter.set_exception(Superseded(f'newer work for {key}'))
+        return tier
+
+    def _shed(self) -> None:
+        """Turn away the least important waiting job."""
+        tier = next(tier for tier in reversed(self._order) if self._tiers[tier].waiting)
+        queue = self._tiers[tier]
+        # Of equally busy groups, the one which started waiting last.
+        group = max(reversed(queue.rotation), key=lambda group: len(queue.waiting[group]))
+        waiter, _, key = queue.waiting[group].pop()
+        self._forget_key(key, waiter)
+        if not queue.waiting[group]:
+            queue.forget(group)
+        self.queued -= 1
+        queue.shed += 1
+        waiter.set_exception(Shed(f'no room in the queue for tier {tier} work'))
+
+    def _release(self, group: str) -> None:
+        self.running -= 1
+        self._running[group] -= 1
+        if not self._running[group]:
+            del self._running[group]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Start waiting work, most important first, for as long as there is capacity."""
+        for tier in self._order:
+            if self.running >= self.concurrency:
+                return
+            self._dispatch_tier(self._tiers[tier])
+
+    def _dispatch_tier(self, queue: _Tier) -> None:
+        now = asyncio.get_running_loop().time()
+        skipped = 0
+        while self.running < self.concurrency and skipped < len(queue.rotation):
+            group = queue.rotation[0]
+            if self._running[group] >= self.group_concurrency:
+                queue.rotate()
+                skipped += 1
+                continue
+            if not queue.turns_left:
+                queue.turns_left = self.weights.get(group, 1)
+            waiter, queued_at, key = queue.waiting[group].popleft()
+            self._forget_key(key, waiter)
+            waiter.set_result(None)
+            queue.latencies.append(now - queued_at)
+            self.queued -= 1
+            self.running += 1
+            self._running[group] += 1
+            queue.turns_left -= 1
+            skipped = 0
+            if not queue.waiting[group]:
+                queue.forget(group)
+            elif not queue.turns_left:
+                queue.rotate()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Return the number of queued and running jobs for each busy group."""
+        queued: Dict[str, int] = collections.Counter()
+        for queue in self._tiers.values():
+            for group, waiting in queue.waiting.items():
+                queued[group] += len(waiting)
+        return {group: {'queued': queued.get(group, 0),
+                        'running': self._running.get(group, 0)}
+                for group in set(queued) | set(self._running)}
+
+    def tier_stats(self) -> Dict[int, Dict[str, Optional[float]]]:
+        """Return the queued, shed and superseded jobs and the recent queue
+        latency of each tier.
+        """
+        return {tier: {'queued': queue.queued(), 'shed': queue.shed,
+                       'superseded': queue.superseded,
+                       'p50': queue.percentile(0.5), 'p99': queue.percentile(0.99)}
+                for tier, queue in sorted(self._tiers.items())}
@@ -1,17 +1,28 @@
 import asyncio
+import contextlib
 from http import client
 import json
+import os
+import tempfile
 import unittest
+import urllib.parse
+from unittest import mock
 
 import aiohttp
 
 from . import util
 from .. import abc as ni_abc
 from .. import bpo
+from .. import index
 
 
 class OfflineTests(util.TestCase):
 
+    def test_stats(self):
+        stats = bpo.Host(util.FakeServerHost()).stats()
+        self.assertFalse(stats['indexed'])
+        self.assertEqual(stats['bpo']['calls'], 0)
+
     def test_failure(self):
         host = bpo.Host(util.FakeServerHost())
         failed_response = util.FakeResponse(status=404)
@@ -19,6 +30,14 @@ class OfflineTests(util.TestCase):
         with self.assertRaises(client.HTTPException):
             self.run_awaitable(host.problems(fake_session, {'brettcannon'}))
 
+    @mock.patch('ni.upstream.RETRY_BASE_DELAY', 0.001)
+    def test_transient_failure(self):
+        host = bpo.Host(util.FakeServerHost())
+        session = FlakySession([util.FakeResponse(status=503),
+                                util.FakeResponse(data=json.dumps({'brettcannon': True}))])
+        self.assertEqual(self.run_awaitable(host.problems(session, {'brettcannon'})), {})
+        self.assertEqual(host.upstream.retries, 1)
+
     def test_filter_extraneous_data(self):
         host = bpo.Host(util.FakeServerHost())
         response_data = {'web-flow': None, 'brettcannon': True}
@@ -44,6 +63,167 @@ class OfflineTests(util.TestCase):
             self.run_awaitable(host.problems(fake_session, {'brettcannon'}))
 
 
+class IndexTests(util.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.server = util.FakeServerHost()
+        self.server.cla_index = os.path.join(directory.name, 'cla.index')
+        self.index = index.StatusIndex(self.server.cla_index)
+        self.addCleanup(self.index.close)
+
+    def test_results_recorded(self):
+        host = bpo.Host(self.server)
+        response_data = {'brettcannon': True, 'the-knights-who-say-ni': False}
+        fake_response = util.FakeResponse(data=json.dumps(response_data))
+        fake_session = util.FakeSession(response=fake_response)
+        result = self.run_awaitable(host.problems(fake_session, set(response_data)))
+        self.assertEqual(result, {ni_abc.Status.not_signed: {'the-knights-who-say-ni'}})
+        self.assertEqual(self.index.lookup_many(response_data),
+                         {'brettcannon': ni_abc.Status.signed,
+                          'the-knights-who-say-ni': ni_abc.Status.not_signed})
+
+    def test_signed_skips_check(self):
+        self.index.update({'brettcannon': ni_abc.Status.signed})
+        host = bpo.Host(self.server)
+        # No response is available, so any request would fail.
+        result = self.run_awaitable(host.problems(util.FakeSession(), {'brettcannon'}))
+        self.assertEqual(result, {})
+
+    def test_warm_up(self):
+        host = bpo.Host(self.server)
+        session = CheckingSession(unsigned={'the-knights-who-say-ni'})
+        usernames = {'brettcannon', 'the-knights-who-say-ni'}
+        self.run_awaitable(host.warm_up(session, usernames))
+        self.assertEqual(len(session.urls), 1)
+        self.assertEqual(self.index.lookup_many(usernames),
+                         {'brettcannon': ni_abc.Status.signed,
+                          'the-knights-who-say-ni': ni_abc.Status.not_signed})
+
+    def test_unsigned_rechecked(self):
+        self.index.update({'brettcannon': ni_abc.Status.signed,
+                           'the-knights-who-say-ni': ni_abc.Status.not_signed})
+        host = bpo.Host(self.server)
+        response_data = {'the-knights-who-say-ni': True}
+        fake_response = util.FakeResponse(data=json.dumps(response_data))
+        fake_session = util.FakeSession(response=fake_response)
+        usernames = {'brettcannon', 'the-knights-who-say-ni'}
+        result = self.run_awaitable(host.problems(fake_session, usernames))
+        self.assertEqual(result, {})
+        self.assertTrue(fake_session.url.endswith('github_names=the-knights-who-say-ni'))
+        self.assertEqual(self.index.lookup('the-knights-who-say-ni'),
+                         ni_abc.Status.signed)
+
+
+class FlakySession:
+
+    """Answer each request with the next of the responses."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    @contextlib.asynccontextmanager
+    async def get(self, url):
+        yield self.responses.pop(0)
+
+
+class CheckingSession:
+
+    """Answer CLA checks for any usernames, recording every URL requested."""
+
+    def __init__(self, unsigned=frozenset()):
+        self.unsigned = unsigned
+        self.urls = []
+
+    @contextlib.asynccontextmanager
+    async def get(self, url):
+        self.urls.append(url)
+        names = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)['github_names']
+        results = {name: name not in self.unsigned
+                   for name in names[0].split(',')}
+        yield util.FakeResponse(data=json.dumps(results))
+
+
+class CacheTests(util.TestCase):
+
+    def test_signed_cached(self):
+        host = bpo.Host(util.FakeServerHost())
+        usernames = {'brettcannon', 'the-knights-who-say-ni'}
+        session = CheckingSession(unsigned={'the-knights-who-say-ni'})
+        for _ in range(2):
+            result = self.run_awaitable(host.problems(session, usernames))
+            self.assertEqual(result, {ni_abc.Status.not_signed: {'the-knights-who-say-ni'}})
+        # Only a signed CLA is cached; anything else is always checked again.
+        self.assertEqual(len(session.urls), 2)
+        self.assertTrue(session.urls[1].endswith('github_names=the-knights-who-say-ni'))
+        self.assertEqual(host.stats()['cache']['hits'], 1)
+
+    def test_warm_up(self):
+        # Without an index, warming up fills the cache.
+        host = bpo.Host(util.FakeServerHost())
+        session = CheckingSession()
+        self.run_awaitable(host.warm_up(session, {'brettcannon'}))
+        self.assertEqual(self.run_awaitable(host.problems(session, {'brettcannon'})), {})
+        self.assertEqual(len(session.urls), 1)
+
+    def test_shared(self):
+        # Every process sees what another cached, with one round trip for
+        # all of the usernames.
+        usernames = {f'user{n}' for n in range(bpo.CHECK_CHUNK_SIZE)}
+        server = util.FakeServerHost()
+        async def check():
+            fake = await util.FakeRedis().start()
+            server.cache = fake.url
+            hosts = [bpo.Host(server), bpo.Host(server)]
+            session = CheckingSession()
+            try:
+                results = [await host.problems(session, usernames) for host in hosts]
+                stats = hosts[1].stats()['cache']
+            finally:
+                for host in hosts:
+                    await host.close()
+                await fake.stop()
+            return results, stats, session.urls
+        results, stats, urls = self.run_awaitable(check())
+        self.assertEqual(results, [{}, {}])
+        self.assertEqual(len(urls), 1)
+        self.assertEqual((stats['hits'], stats['round_trips']), (len(usernames), 1))
+
+
+class BatchTests(util.TestCase):
+
+    def test_chunked(self):
+        host = bpo.Host(util.FakeServerHost())
+        usernames = {f'user{n}' for n in range(bpo.CHECK_CHUNK_SIZE * 2 + 1)}
+        session = CheckingSession(unsigned={'user0'})
+        result = self.run_awaitable(host.problems(session, usernames))
+        self.assertEqual(result, {ni_abc.Status.not_signed: {'user0'}})
+        self.assertEqual(len(session.urls), 3)
+
+    def test_no_usernames(self):
+        host = bpo.Host(util.FakeServerHost())
+        session = CheckingSession()
+        self.assertEqual(self.run_awaitable(host.problems(session, set())), {})
+        self.assertEqual(session.urls, [])
+
+    def test_batch_deduplicated(self):
+        host = bpo.Host(util.FakeServerHost())
+        shared = {f'user{n}' for n in range(bpo.CHECK_CHUNK_SIZE)}
+        usernames = {'a': shared | {'brettcannon'},
+                     'b': shared | {'the-knights-who-say-ni'},
+                     'c': set()}
+        session = CheckingSession(unsigned={'user1', 'the-knights-who-say-ni'})
+        result = self.run_awaitable(host.batch_problems(session, usernames))
+        # 52 distinct usernames need two requests, not one per key.
+        self.assertEqual(len(session.urls), 2)
+        self.assertEqual(result, {
+            'a': {ni_abc.Status.not_signed: {'user1'}},
+            'b': {ni_abc.Status.not_signed: {'user1', 'the-knights-who-say-ni'}},
+            'c': {},
+        })
+
+
 class SessionOnDemand:
 
     """Role session creation and HTTP requesting in a single object.
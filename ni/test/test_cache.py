@@ -0,0 +1,225 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from .. import cache
+from .. import upstream
+from . import util
+
+
+class MemoryCacheTests(util.TestCase):
+
+    def test_get_set(self):
+        memory = cache.MemoryCache()
+        self.run_awaitable(memory.set_many({'a': b'1', 'b': b'2'}, 60))
+        self.assertEqual(self.run_awaitable(memory.get_many(['a', 'b', 'c'])),
+                         {'a': b'1', 'b': b'2'})
+        self.assertEqual(self.run_awaitable(memory.get_many([])), {})
+        stats = memory.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 1, 2))
+
+    def test_expiry(self):
+        memory = cache.MemoryCache()
+        with mock.patch('time.monotonic', return_value=0.0):
+            self.run_awaitable(memory.set_many({'a': b'1'}, 60))
+        with mock.patch('time.monotonic', return_value=59.0):
+            self.assertEqual(self.run_awaitable(memory.get_many(['a'])), {'a': b'1'})
+        with mock.patch('time.monotonic', return_value=60.0):
+            self.assertEqual(self.run_awaitable(memory.get_many(['a'])), {})
+        self.assertEqual(memory.stats()['size'], 0)
+
+    def test_bounded(self):
+        memory = cache.MemoryCache(size=2)
+        self.run_awaitable(memory.set_many({'a': b'1', 'b': b'2'}, 60))
+        # Reading a value keeps it around.
+        self.run_awaitable(memory.get_many(['a']))
+        self.run_awaitable(memory.set_many({'c': b'3'}, 60))
+        self.assertEqual(self.run_awaitable(memory.get_many(['a', 'b', 'c'])),
+                         {'a': b'1', 'c': b'3'})
+
+    def test_create(self):
+        server = util.FakeServerHost()
+        self.assertIsInstance(cache.create(server), cache.MemoryCache)
+        server.cache = 'redis://localhost'
+        self.assertIsInstance(cache.create(server), cache.RedisCache)
+
+
+class ProtocolTests(util.TestCase):
+
+    def test_encode_command(self):
+        self.assertEqual(cache.encode_command(b'GET', b'key'),
+                         b'*2\r\n$3\r\nGET\r\n$3\r\nkey\r\n')
+
+    def read(self, data):
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return await cache.read_reply(reader)
+        return self.run_awaitable(read())
+
+    def test_read_reply(self):
+        self.assertEqual(self.read(b'+OK\r\n'), b'OK')
+        self.assertEqual(self.read(b':42\r\n'), 42)
+        self.assertEqual(self.read(b'$5\r\nva\r\nl\r\n'), b'va\r\nl')
+        self.assertIsNone(self.read(b'$-1\r\n'))
+        self.assertEqual(self.read(b'*3\r\n$1\r\na\r\n$-1\r\n:1\r\n'), [b'a', None, 1])
+        error = self.read(b'-ERR wrong\r\n')
+        self.assertIsInstance(error, cache.ReplyError)
+        self.assertEqual(str(error), 'ERR wrong')
+        with self.assertRaises(ConnectionError):
+            self.read(b'?\r\n')
+        with self.assertRaises(asyncio.IncompleteReadError):
+            self.read(b'$5\r\nva')
+
+    def test_url(self):
+        redis = cache.RedisCache(util.FakeServerHost(), 'rediss://:p%40ss@example.com:1234/2')
+        self.assertEqual((redis.host, redis.port, redis.ssl, redis.password, redis.database),
+                         ('example.com', 1234, True, 'p@ss', 2))
+        redis = cache.RedisCache(util.FakeServerHost(), 'redis://example.com')
+        self.assertEqual((redis.port, redis.ssl, redis.password, redis.database),
+                         (cache.DEFAULT_PORT, False, None, 0))
+        with self.assertRaises(ValueError):
+            cache.RedisCache(util.FakeServerHost(), 'http://example.com')
+
+
+class RedisCacheTests(util.TestCase):
+
+    def setUp(self):
+        self.server = util.FakeServerHost()
+
+    def run_with(self, test, fake=None, url=None):
+        """Run the test with a Redis cache and the fake server it talks to.
+
+        The URL of the cache may be derived from the fake server's.
+        """
+        fake = fake or util.FakeRedis()
+        async def run():
+            await fake.start()
+            redis = cache.RedisCache(self.server, url(fake.url) if url else fake.url)
+            try:
+                return await test(redis, fake)
+            finally:
+                await redis.close()
+                await fake.stop()
+        return self.run_awaitable(run())
+
+    def test_one_round_trip(self):
+        keys = [f'user{n}' for n in range(50)]
+        async def test(redis, fake):
+            await redis.set_many({key: b'signed' for key in keys[::2]}, 60)
+            self.assertEqual(redis.round_trips, 1)
+            found = await redis.get_many(keys)
+            self.assertEqual(redis.round_trips, 2)
+            return found
+        fake = util.FakeRedis()
+        found = self.run_with(test, fake)
+        self.assertEqual(found, {key: b'signed' for key in keys[::2]})
+        sets, (mget,) = fake.commands[:25], fake.commands[25:]
+        self.assertEqual(sets[0], ['SET', 'ni:user0', 'signed', 'PX', '60000'])
+        self.assertEqual(mget, ['MGET'] + [f'ni:{key}' for key in keys])
+        self.assertEqual(fake.connections, 1)
+
+    def test_pipelined(self):
+        # Concurrent callers share the one connection, each reply reaching
+        # the right caller.
+        async def test(redis, fake):
+            await redis.set_many({f'key{n}': str(n).encode() for n in range(20)}, 60)
+            return await asyncio.gather(*(redis.get_many([f'key{n}', 'missing'])
+                                          for n in range(20)))
+        fake = util.FakeRedis()
+        results = self.run_with(test, fake)
+        self.assertEqual(results, [{f'key{n}': str(n).encode()} for n in range(20)])
+        self.assertEqual(fake.connections, 1)
+
+    def test_expiry(self):
+        async def test(redis, fake):
+            await redis.set_many({'a': b'1'}, 0.01)
+            await asyncio.sleep(0.02)
+            return await redis.get_many(['a'])
+        self.assertEqual(self.run_with(test), {})
+
+    def test_authenticate_and_select(self):
+        async def test(redis, fake):
+            await redis.set_many({'a': b'1'}, 60)
+            return await redis.get_many(['a'])
+        fake = util.FakeRedis(password='secret')
+        found = self.run_with(test, fake,
+                              lambda url: url.replace('redis://', 'redis://:secret@') + '/3')
+        self.assertEqual(found, {'a': b'1'})
+        self.assertEqual(fake.commands[:2], [['AUTH', 'secret'], ['SELECT', '3']])
+        self.assertEqual(set(fake.values), {(3, b'ni:a')})
+
+    def test_error_reply(self):
+        async def test(redis, fake):
+            await redis.set_many({'a': b'1'}, 60)
+            return await redis.get_many(['a'])
+        # Without the password every command fails.
+        fake = util.FakeRedis(password='secret')
+        self.assertEqual(self.run_with(test, fake), {})
+        self.assertEqual(fake.values, {})
+        self.assertTrue(self.server.logged[0].startswith('Redis cache unavailable'))
+
+    def test_wrong_password(self):
+        async def test(redis, fake):
+            await redis.set_many({'a': b'1'}, 60)
+            return await redis.get_many(['a']), redis.stats()
+        fake = util.FakeRedis(password='secret')
+        found, stats = self.run_with(
+            test, fake, lambda url: url.replace('redis://', 'redis://:wrong@'))
+        self.assertEqual(found, {})
+        self.assertEqual((stats['errors'], stats['connected']), (2, False))
+        # Nothing but authenticating was attempted.
+        self.assertEqual(fake.commands, [['AUTH', 'wrong']] * 2)
+
+    def test_unavailable(self):
+        # Nothing listens on the port once the fake server has stopped.
+        async def test():
+            fake = await util.FakeRedis().start()
+            await fake.stop()
+            redis = cache.RedisCache(self.server, fake.url)
+            await redis.set_many({'a': b'1'}, 60)
+            found = await redis.get_many(['a'])
+            await redis.close()
+            return found, redis.stats()
+        found, stats = self.run_awaitable(test())
+        self.assertEqual(found, {})
+        self.assertEqual((stats['errors'], stats['misses'], stats['connected']), (2, 1, False))
+        self.assertEqual(len(self.server.logged), 2)
+
+    def test_reconnect(self):
+        async def test(redis, fake):
+            await redis.set_many({'a': b'1'}, 60)
+            fake.drop()
+            # The loss of the connection is noticed.
+            while redis.stats()['connected']:
+                await asyncio.sleep(0.001)
+            return await redis.get_many(['a'])
+        fake = util.FakeRedis()
+        self.assertEqual(self.run_with(test, fake), {'a': b'1'})
+        self.assertEqual(fake.connections, 2)
+
+    def test_own_retry_budget(self):
+        # A healthy cache doesn't pay for retrying other upstreams.
+        tokens = upstream.retry_budget.tokens
+        upstream.retry_budget.tokens = 0
+        self.addCleanup(setattr, upstream.retry_budget, 'tokens', tokens)
+        async def test(redis, fake):
+            await redis.get_many(['a'])
+        self.run_with(test)
+        self.assertEqual(upstream.retry_budget.tokens, 0)
+
+    def test_stats(self):
+        async def test(redis, fake):
+            await redis.set_many({'a': b'1'}, 60)
+            await redis.get_many(['a', 'b'])
+            return redis.stats()
+        stats = self.run_with(test)
+        self.assertEqual(stats['backend'], 'redis')
+        self.assertEqual((stats['hits'], stats['misses'], stats['errors'],
+                          stats['round_trips']), (1, 1, 0, 2))
+        self.assertEqual(stats['redis']['calls'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
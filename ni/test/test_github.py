@@ -1,11 +1,21 @@
+import asyncio
 import copy
+import datetime
+import hashlib
+import hmac
 import json
 import pathlib
 import re
+import time
+from unittest import mock
 from urllib import parse
 
+import gidgethub
+from multidict import CIMultiDict
+
 from .. import abc as ni_abc
 from .. import github
+from .. import upstream
 from . import util
 
 
@@ -58,6 +68,14 @@ class GitHubTests(util.TestCase):
         cls.labels_url = 'https://api.github.com/repos/Microsoft/Pyjion/issues/109/labels'
         cls.comments_url = 'https://api.github.com/repos/Microsoft/Pyjion/issues/109/comments'
 
+    def setUp(self):
+        github._comment_digests.clear()
+        github._comment_urls.clear()
+        github._removed_labels.clear()
+        github._synchronized.clear()
+        github._commit_cache.clear()
+        github._logins.clear()
+
     def test_ping(self):
         # GitHub can ping a webhook to verify things are set up.
         # https://developer.github.com/webhooks/#ping-event
@@ -90,6 +108,80 @@ class GitHubTests(util.TestCase):
                                                        request, util.FakeSession()))
             self.assertEqual(cm.exception.response.status, 204)
 
+    def signed_request(self, payload, secret, algorithm='sha256'):
+        request = util.FakeRequest(payload)
+        body = json.dumps(payload).encode('utf-8')
+        digest = hmac.new(secret.encode('utf-8'), body, getattr(hashlib, algorithm))
+        header = 'x-hub-signature-256' if algorithm == 'sha256' else 'x-hub-signature'
+        request.headers[header] = f'{algorithm}={digest.hexdigest()}'
+        return request
+
+    def test_signature(self):
+        server = util.FakeServerHost()
+        server.secret = 'secret'
+        for algorithm in ('sha256', 'sha1'):
+            with self.subTest(algorithm=algorithm):
+                request = self.signed_request(self.synchronize_example, 'secret',
+                                              algorithm)
+                result = self.run_awaitable(github.Host.process(
+                    server, request, util.FakeSession()))
+                self.assertEqual(result.event, github.PullRequestEvent.synchronize)
+        # Wrong secret.
+        request = self.signed_request(self.synchronize_example, 'wrong')
+        with self.assertRaises(gidgethub.ValidationFailure):
+            self.run_awaitable(github.Host.process(server, request,
+                                                   util.FakeSession()))
+        # Unknown algorithm.
+        request = util.FakeRequest(self.synchronize_example)
+        request.headers['x-hub-signature'] = 'md5=abcdef'
+        with self.assertRaises(gidgethub.ValidationFailure):
+            self.run_awaitable(github.Host.process(server, request,
+                                                   util.FakeSession()))
+
+    def test_useless_action_still_validated(self):
+        # Skipping useless actions must not skip the signature check.
+        server = util.FakeServerHost()
+        server.secret = 'secret'
+        request = util.FakeRequest({'action': 'closed'})
+        with self.assertRaises(gidgethub.ValidationFailure):
+            self.run_awaitable(github.Host.process(server, request,
+                                                   util.FakeSession()))
+        request = self.signed_request({'action': 'closed'}, 'secret')
+        with self.assertRaises(ni_abc.ResponseExit) as cm:
+            self.run_awaitable(github.Host.process(server, request,
+                                                   util.FakeSession()))
+        self.assertEqual(cm.exception.response.status, 204)
+
+    def test_payload_too_large(self):
+        payload = {'action': 'synchronize', 'padding': 'x' * github.MAX_PAYLOAD_SIZE}
+        request = util.FakeRequest(payload)
+        with self.assertRaises(ni_abc.ResponseExit) as cm:
+            self.run_awaitable(github.Host.process(util.FakeServerHost(),
+                                                   request, util.FakeSession()))
+        self.assertEqual(cm.exception.response.status, 413)
+        # Without a Content-Length the limit is enforced while streaming.
+        with mock.patch.object(util.FakeRequest, 'content_length', None):
+            with self.assertRaises(ni_abc.ResponseExit) as cm:
+                self.run_awaitable(github.Host.process(util.FakeServerHost(),
+                                                       request, util.FakeSession()))
+        self.assertEqual(cm.exception.response.status, 413)
+
+    def test_sniff_action(self):
+        self.assertEqual(github._sniff_action(b'{"action": "closed", "number": 1}'),
+                         'closed')
+        self.assertEqual(github._sniff_action(b' {\n  "action":"opened"'), 'opened')
+        # Anything but a leading action requires decoding the payload.
+        self.assertIsNone(github._sniff_action(b'{"number": 1, "action": "closed"}'))
+        self.assertIsNone(github._sniff_action(b'{"zen": "something pithy"}'))
+
+    def test_process_form_encoded(self):
+        # Encodings other than JSON are left to gidgethub.
+        request = util.FakeRequest(self.synchronize_example)
+        request.headers['content-type'] = 'text/plain'
+        with self.assertRaises(gidgethub.BadRequest):
+            self.run_awaitable(github.Host.process(util.FakeServerHost(),
+                                                   request, util.FakeSession()))
+
     def test_process_opened(self):
         request = util.FakeRequest(self.opened_example)
         result = self.run_awaitable(github.Host.process(util.FakeServerHost(),
@@ -115,16 +207,268 @@ class GitHubTests(util.TestCase):
                                                    request, util.FakeSession()))
         self.assertEqual(cm.exception.response.status, 204)
 
+    def test_unlabeled_echo(self):
+        # The bot removing a label itself doesn't trigger another check.
+        deletion_url = self.labels_url + '/' + parse.quote(github.CLA_OK)
+        responses = {('GET', self.issues_url): self.issues_example,
+                     ('GET', self.labels_url): self.labels_example,
+                     ('DELETE', deletion_url): True}
+        contrib = github.Host(util.FakeServerHost(), util.FakeSession(responses),
+                              github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        self.run_awaitable(contrib.remove_label())
+        echo = copy.deepcopy(self.unlabeled_example)
+        echo['label']['name'] = github.CLA_OK
+        with self.assertRaises(ni_abc.ResponseExit) as cm:
+            self.run_awaitable(github.Host.screen(util.FakeServerHost(),
+                                                  util.FakeRequest(echo)))
+        self.assertEqual(cm.exception.response.status, 204)
+        # Only the one echo is ignored.
+        self.noException(github.Host.screen(util.FakeServerHost(),
+                                            util.FakeRequest(echo)))
+
+    def test_synchronize_relabels(self):
+        # The echo of the label's removal being ignored, the pull request is
+        # relabeled as it is synchronized.
+        session = LabelSession(self.issues_example, self.labels_url, [github.CLA_OK])
+        server = util.FakeServerHost()
+        problems = {ni_abc.Status.not_signed: {'username'}}
+        session._responses[('POST', self.comments_url)] = util.FakeResponse(
+            status=201, data={})
+        contrib = github.Host(server, session, github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        self.noException(contrib.update(problems))
+        echo = copy.deepcopy(self.unlabeled_example)
+        echo['label']['name'] = github.CLA_OK
+        with self.assertRaises(ni_abc.ResponseExit) as cm:
+            self.run_awaitable(github.Host.screen(server, util.FakeRequest(echo)))
+        self.assertEqual(cm.exception.response.status, 204)
+        self.assertEqual(session.labels, [github.NO_CLA])
+        # Signing flips the label back.
+        contrib = github.Host(server, session, github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        self.noException(contrib.update({}))
+        self.assertEqual(session.labels, [github.CLA_OK])
+
+    def test_unlabeled_echo_expired(self):
+        echo = copy.deepcopy(self.unlabeled_example)
+        echo['label']['name'] = github.CLA_OK
+        with mock.patch('time.monotonic', return_value=0.0):
+            github._record_removal(echo['pull_request']['url'], github.CLA_OK)
+        with mock.patch('time.monotonic', return_value=github.LABEL_ECHO_WINDOW):
+            self.noException(github.Host.screen(util.FakeServerHost(),
+                                                util.FakeRequest(echo)))
+
+    def test_unlabeled_echo_bounded(self):
+        for n in range(github.LABEL_ECHO_SIZE + 1):
+            github._record_removal(f'pull/{n}', github.CLA_OK)
+        self.assertEqual(len(github._removed_labels), github.LABEL_ECHO_SIZE)
+        self.assertFalse(github._is_echo('pull/0', github.CLA_OK))
+        self.assertTrue(github._is_echo('pull/1', github.CLA_OK))
+
     def test_process_synchronize(self):
         request = util.FakeRequest(self.synchronize_example)
         result = self.run_awaitable(github.Host.process(util.FakeServerHost(),
                                                         request, util.FakeSession()))
         self.assertEqual(result.event, github.PullRequestEvent.synchronize)
 
+    def test_screen(self):
+        # The screened event is reused rather than reading the body again.
+        request = util.FakeRequest(self.synchronize_example)
+        self.run_awaitable(github.Host.screen(util.FakeServerHost(), request))
+        with mock.patch.object(util.FakeRequest, 'content',
+                               property(lambda request: self.fail('body re-read'))):
+            result = self.run_awaitable(github.Host.process(
+                util.FakeServerHost(), request, util.FakeSession()))
+        self.assertEqual(result.event, github.PullRequestEvent.synchronize)
+
+    def test_group(self):
+        request = util.FakeRequest(self.synchronize_example)
+        self.assertEqual(github.Host.group(request), '')
+        self.run_awaitable(github.Host.screen(util.FakeServerHost(), request))
+        self.assertEqual(github.Host.group(request), 'Microsoft/Pyjion')
+
+    def test_contribution_key(self):
+        request = util.FakeRequest(self.synchronize_example)
+        self.assertIsNone(github.Host.contribution_key(request))
+        self.run_awaitable(github.Host.screen(util.FakeServerHost(), request))
+        self.assertEqual(github.Host.contribution_key(request),
+                         'https://api.github.com/repos/Microsoft/Pyjion/pulls/109')
+        # Removing a label doesn't do all that a push does.
+        unlabeled = copy.deepcopy(self.unlabeled_example)
+        unlabeled['label']['name'] = github.CLA_OK
+        request = util.FakeRequest(unlabeled)
+        self.run_awaitable(github.Host.screen(util.FakeServerHost(), request))
+        self.assertIn(github._SCREENED_EVENT, request)
+        self.assertIsNone(github.Host.contribution_key(request))
+
+    def priority(self, payload, server=None):
+        request = util.FakeRequest(payload)
+        server = server or util.FakeServerHost()
+        self.run_awaitable(github.Host.screen(server, request))
+        return github.Host.priority(server, request)
+
+    def test_priority(self):
+        self.assertEqual(github.Host.priority(util.FakeServerHost(), util.FakeRequest()),
+                         ni_abc.Priority.normal)
+        self.assertEqual(self.priority(self.opened_example), ni_abc.Priority.high)
+        unlabeled = copy.deepcopy(self.unlabeled_example)
+        unlabeled['label']['name'] = github.CLA_OK
+        self.assertEqual(self.priority(unlabeled), ni_abc.Priority.normal)
+        self.assertEqual(self.priority(self.synchronize_example), ni_abc.Priority.normal)
+
+    def test_priority_synchronize_burst(self):
+        # After a few pushes in a row, further ones wait behind other work.
+        priorities = [self.priority(self.synchronize_example)
+                      for _ in range(github.SYNCHRONIZE_BURST + 2)]
+        self.assertEqual(priorities, [ni_abc.Priority.normal] * github.SYNCHRONIZE_BURST
+                                     + [ni_abc.Priority.low] * 2)
+        later = time.monotonic() + github.SYNCHRONIZE_WINDOW
+        with mock.patch('time.monotonic', return_value=later):
+            self.assertEqual(self.priority(self.synchronize_example),
+                             ni_abc.Priority.normal)
+
+    def test_priority_synchronize_bounded(self):
+        for n in range(github.SYNCHRONIZE_SIZE + 1):
+            github._is_burst(f'pull/{n}')
+        self.assertEqual(len(github._synchronized), github.SYNCHRONIZE_SIZE)
+        self.assertNotIn('pull/0', github._synchronized)
+
+    def test_priority_repositories(self):
+        server = util.FakeServerHost()
+        server.priority_repos = frozenset({'microsoft/pyjion'})
+        self.assertEqual(self.priority(self.opened_example, server), ni_abc.Priority.high)
+        self.assertEqual(self.priority(self.synchronize_example, server),
+                         ni_abc.Priority.high)
+
+    def test_screened_pull_request(self):
+        request = util.FakeRequest(self.synchronize_example)
+        self.run_awaitable(github.Host.screen(util.FakeServerHost(), request))
+        pull_request = request[github._SCREENED_EVENT]
+        # Only the fields which are used are kept.
+        self.assertIsInstance(pull_request, github.PullRequest)
+        self.assertEqual(pull_request.delivery_id, '12345')
+        self.assertEqual(pull_request.action, 'synchronize')
+        self.assertEqual(pull_request.url,
+                         'https://api.github.com/repos/Microsoft/Pyjion/pulls/109')
+        self.assertEqual(pull_request.repository, 'Microsoft/Pyjion')
+        self.assertEqual(pull_request.author,
+                         self.synchronize_example['pull_request']['user']['login'])
+
+    def test_load_event(self):
+        # Earlier versions journaled the whole event.
+        data = json.dumps({'event': 'pull_request', 'delivery_id': '12345',
+                           'data': self.synchronize_example}).encode('utf-8')
+        replayed = github.Host.load(data)
+        self.assertEqual(replayed[github._SCREENED_EVENT],
+                         github.PullRequest.from_payload(self.synchronize_example, '12345'))
+
+    def test_dump_load(self):
+        server = util.FakeServerHost()
+        request = util.FakeRequest(self.synchronize_example)
+        self.run_awaitable(github.Host.screen(server, request))
+        key, data = github.Host.dump(request)
+        self.assertEqual(key, '12345')
+        self.assertEqual(github.Host.delivery_id(request), key)
+        self.assertIsNone(github.Host.delivery_id(util.FakeRequest()))
+        replayed = github.Host.load(data)
+        self.assertIsInstance(replayed, ni_abc.ReplayedRequest)
+        self.assertEqual(replayed.headers.get('content-type'), None)
+        self.assertEqual(self.run_awaitable(replayed.read()), b'')
+        # Screening a replayed request doesn't read it again.
+        self.run_awaitable(github.Host.screen(server, replayed))
+        self.assertEqual(github.Host.group(replayed), 'Microsoft/Pyjion')
+        contrib = self.run_awaitable(github.Host.process(server, replayed,
+                                                         util.FakeSession()))
+        self.assertEqual(contrib.event, github.PullRequestEvent.synchronize)
+        self.assertEqual(contrib.pull_request,
+                         github.PullRequest.from_payload(self.synchronize_example, '12345'))
+        # Only the pull request is serialized, not the whole payload.
+        self.assertLess(len(data), len(json.dumps(self.synchronize_example)) / 4)
+
+    def test_replay_opened(self):
+        # A pull request opened just before the process died isn't commented
+        # on again when the delivery is replayed.
+        server = util.FakeServerHost()
+        request = util.FakeRequest(self.opened_example)
+        self.run_awaitable(github.Host.screen(server, request))
+        _, data = github.Host.dump(request)
+        replayed = github.Host.load(data)
+        problems = {ni_abc.Status.not_signed: {'username'}}
+        body = github.NO_CLA_TEMPLATE.format(
+            not_signed=github.NO_CLA_BODY.format('@username'), username_not_found='')
+        comments = [{'url': 'comment', 'user': {'login': 'the-bot'}, 'body': body}]
+        session = self.recording_session({('GET', self.issues_url): self.issues_example,
+                                          ('POST', self.labels_url): [github.NO_CLA],
+                                          ('GET', 'https://api.github.com/user'):
+                                          {'login': 'the-bot'},
+                                          ('GET', self.comments_url): comments})
+        contrib = github.Host(server, session, github.PullRequestEvent.opened,
+                              replayed[github._SCREENED_EVENT])
+        self.noException(contrib.update(problems))
+        self.assertIn(('GET', self.comments_url), session.requested)
+        self.assertNotIn(('POST', self.comments_url), session.requested)
+
+    def test_key(self):
+        contrib = github.Host(util.FakeServerHost(),
+                              util.FakeSession(),
+                              github.PullRequestEvent.opened,
+                              self.opened_example)
+        self.assertEqual(contrib.key(),
+                         'https://api.github.com/repos/Microsoft/Pyjion/pulls/109')
+
+    def test_configure(self):
+        server = util.FakeServerHost()
+        server.hedge_fraction = 0.05
+        try:
+            github.Host.configure(server)
+            self.assertEqual(github._api_upstream.hedge_budget, 0.05)
+        finally:
+            github._api_upstream.hedge_budget = 0.0
+
+    def test_stats(self):
+        stats = github.Host.stats()
+        self.assertEqual(set(stats['responses']),
+                         {'entries', 'bytes', 'hits', 'misses', 'evictions', 'hit_rate'})
+        self.assertIn('hits', stats['commits'])
+        self.assertIn('p99', stats['api'])
+        json.dumps(stats)
+
+    def test_warm_up(self):
+        session = self.recording_session(
+            {('GET', 'https://api.github.com/rate_limit'): {'resources': {}}})
+        usernames = self.run_awaitable(github.Host.warm_up(util.FakeServerHost(),
+                                                           session))
+        self.assertEqual(usernames, frozenset())
+        self.assertEqual(session.requested,
+                         [('GET', 'https://api.github.com/rate_limit')])
+
+    def test_warm_up_recent(self):
+        # Contributors of recently updated pull requests are found and cached.
+        server = util.FakeServerHost()
+        server.warm_up_repos = frozenset(['microsoft/pyjion'])
+        pulls_url = ('https://api.github.com/repos/microsoft/pyjion/pulls?state=open'
+                     '&sort=updated&direction=desc&per_page='
+                     f'{github.WARM_UP_PULL_REQUESTS}')
+        pull_request = dict(self.opened_example['pull_request'])
+        del pull_request['commits']
+        session = self.recording_session({
+            ('GET', 'https://api.github.com/rate_limit'): {'resources': {}},
+            ('GET', pulls_url): [pull_request],
+            ('GET', self.commits_url): [dict(self.commit('miss-islington'),
+                                             sha='a' * 40)],
+        })
+        usernames = self.run_awaitable(github.Host.warm_up(server, session))
+        self.assertEqual(usernames, {'brettcannon', 'miss-islington'})
+        self.assertEqual(session.requested[1:], [('GET', pulls_url),
+                                                 ('GET', self.commits_url)])
+        self.assertEqual(github._commit_cache.stats()['ranges'], 1)
+
     def test_usernames(self):
         # Should grab logins from the creator of the PR, and both the author
         # and committer for every commit in the PR.
-        responses = {("GET", self.commits_url): self.commits_example}
+        responses = {("GET", self.commits_url + '?per_page=100&page=1'):
+                     self.commits_example}
         session = util.FakeSession(responses=responses)
         contrib = github.Host(util.FakeServerHost(),
                               session,
@@ -135,6 +479,87 @@ class GitHubTests(util.TestCase):
                 'dstufft-author', 'dstufft-committer'}
         self.assertEqual(got, frozenset(want))
 
+    def commit(self, login):
+        return {'author': {'login': login},
+                'committer': {'login': 'web-flow'},
+                'commit': {'author': {'email': f'{login}@example.com'},
+                           'committer': {'email': github.GITHUB_EMAIL}}}
+
+    def test_usernames_pages(self):
+        # All pages are requested up front based on the commit count.
+        payload = copy.deepcopy(self.opened_example)
+        payload['pull_request']['commits'] = 250
+        page_url = self.commits_url + '?per_page=100&page={}'
+        responses = {
+            ('GET', page_url.format(1)): [self.commit('one')] * 100,
+            ('GET', page_url.format(2)): [self.commit('two')] * 100,
+            ('GET', page_url.format(3)): [self.commit('three')] * 50,
+        }
+        session = util.FakeSession(responses=responses)
+        requested = []
+        request = session.request
+        def record(method, url, headers=None, data=None):
+            requested.append(url)
+            return request(method, url, headers=headers, data=data)
+        session.request = record
+        contrib = github.Host(util.FakeServerHost(), session,
+                              github.PullRequestEvent.opened, payload)
+        got = self.run_awaitable(contrib.usernames())
+        self.assertEqual(got, {'brettcannon', 'one', 'two', 'three'})
+        self.assertEqual(requested, [page_url.format(n) for n in range(1, 4)])
+
+    def test_usernames_stale_count(self):
+        # Should the commit count be too low, keep going until a short page.
+        payload = copy.deepcopy(self.opened_example)
+        payload['pull_request']['commits'] = 100
+        page_url = self.commits_url + '?per_page=100&page={}'
+        responses = {
+            ('GET', page_url.format(1)): [self.commit('one')] * 100,
+            ('GET', page_url.format(2)): [self.commit('two')],
+        }
+        session = util.FakeSession(responses=responses)
+        contrib = github.Host(util.FakeServerHost(), session,
+                              github.PullRequestEvent.opened, payload)
+        got = self.run_awaitable(contrib.usernames())
+        self.assertEqual(got, {'brettcannon', 'one', 'two'})
+
+    def test_usernames_cached(self):
+        # A pull request whose commits haven't changed isn't listed again.
+        responses = {("GET", self.commits_url + '?per_page=100&page=1'):
+                     self.commits_example}
+        session = util.FakeSession(responses=responses)
+        contrib = github.Host(util.FakeServerHost(), session,
+                              github.PullRequestEvent.opened,
+                              self.opened_example)
+        want = self.run_awaitable(contrib.usernames())
+        server = util.FakeServerHost()
+        contrib = github.Host(server, util.FakeSession(),
+                              github.PullRequestEvent.unlabeled,
+                              self.opened_example)
+        self.assertEqual(self.run_awaitable(contrib.usernames()), want)
+        self.assertIn('Ignoring GitHub-managed username: web-flow author', server.logged)
+        # Once pushed to, the pull request is listed again.
+        payload = copy.deepcopy(self.opened_example)
+        payload['pull_request']['head']['sha'] = 'pushed'
+        commits = copy.deepcopy(self.commits_example)
+        commits.append(self.commit('new-author'))
+        responses = {("GET", self.commits_url + '?per_page=100&page=1'): commits}
+        contrib = github.Host(util.FakeServerHost(), util.FakeSession(responses),
+                              github.PullRequestEvent.synchronize, payload)
+        self.assertEqual(self.run_awaitable(contrib.usernames()),
+                         want | {'new-author'})
+        self.assertEqual(github._commit_cache.stats(),
+                         {'ranges': 2, 'hits': 1, 'misses': 2})
+
+    def test_commit_cache_bounded(self):
+        cache = github.CommitCache(size=1)
+        contributors = [(('user0', False), ('user0', False))]
+        cache.add_range(('base', 'head'), contributors)
+        self.assertEqual(cache.range(('base', 'head')), tuple(contributors))
+        cache.add_range(('base', 'other'), [])
+        self.assertIsNone(cache.range(('base', 'head')))
+        self.assertEqual(cache.range(('base', 'other')), ())
+
     def test_usernames_empty(self):
         # Handle the case where author and committer are both empty dicts.
         responses = {("GET", self.commits_url): self.empty_commits_example}
@@ -258,7 +683,8 @@ class GitHubTests(util.TestCase):
                         not_signed=github.NO_CLA_BODY.format('@username'),
                         username_not_found='',
                     )}
-        responses = {('POST', self.comments_url): expected}
+        responses = {('GET', self.comments_url): [],
+                     ('POST', self.comments_url): expected}
         session = util.FakeSession(responses)
         contrib = github.Host(util.FakeServerHost(),
                               session,
@@ -307,6 +733,253 @@ class GitHubTests(util.TestCase):
             re.compile(escaped_no_username.replace(regex_placeholder, '@unf_(a|b), @unf_(a|b)'))
         )
 
+    def test_comment_deterministic(self):
+        renderer = github.CommentRenderer()
+        problems = {ni_abc.Status.not_signed: {'ns_b', 'ns_a', 'ns_c'},
+                    ni_abc.Status.username_not_found: {'unf_b', 'unf_a'}}
+        rendered = renderer.render(problems)
+        expected = github.NO_CLA_TEMPLATE.format(
+            not_signed=github.NO_CLA_BODY.format('@ns_a, @ns_b, @ns_c'),
+            username_not_found=github.NO_USERNAME_BODY.format('@unf_a, @unf_b'))
+        self.assertEqual(rendered.body, expected)
+        self.assertEqual(rendered.digest,
+                         hashlib.sha256(expected.encode('utf-8')).hexdigest())
+        # Memoized regardless of how the problems are represented.
+        same = renderer.render({ni_abc.Status.username_not_found: frozenset(['unf_a', 'unf_b']),
+                                ni_abc.Status.not_signed: ['ns_c', 'ns_a', 'ns_b']})
+        self.assertIs(same, rendered)
+        easteregg = renderer.render(problems, easteregg=True)
+        self.assertIn('A SHRUBBERY!', easteregg.body)
+        self.assertNotEqual(easteregg.digest, rendered.digest)
+
+    def test_comment_repeated(self):
+        # An identical comment isn't posted twice to the same pull request.
+        problems = {ni_abc.Status.not_signed: {'username'}}
+        body = github.NO_CLA_TEMPLATE.format(
+            not_signed=github.NO_CLA_BODY.format('@username'),
+            username_not_found='')
+        session = util.FakeSession({('GET', self.comments_url): [],
+                                    ('POST', self.comments_url): {'body': body}})
+        contrib = github.Host(util.FakeServerHost(), session,
+                              github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        self.assertEqual(self.run_awaitable(contrib.comment(problems)), body)
+        session.method = None
+        self.assertIsNone(self.run_awaitable(contrib.comment(problems)))
+        self.assertIsNone(session.method)
+        # A different comment is posted.
+        problems[ni_abc.Status.not_signed].add('another')
+        self.assertIsNotNone(self.run_awaitable(contrib.comment(problems)))
+        self.assertEqual(session.method, 'POST')
+
+    def test_comment_repeated_not_looked_up(self):
+        # The comments aren't searched when the comment is known to be repeated.
+        problems = {ni_abc.Status.not_signed: {'username'}}
+        session = self.recording_session({})
+        contrib = github.Host(util.FakeServerHost(), session,
+                              github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        github._comment_digests[contrib.key()] = github._comment_renderer.render(
+            problems, easteregg=False).digest
+        self.assertIsNone(self.run_awaitable(contrib.comment(problems)))
+        self.assertEqual(session.requested, [])
+
+    def recording_session(self, responses):
+        session = util.FakeSession(responses)
+        session.requested = []
+        request = session.request
+        def record(method, url, headers=None, data=None):
+            session.requested.append((method, url))
+            return request(method, url, headers=headers, data=data)
+        session.request = record
+        return session
+
+    user_url = 'https://api.github.com/user'
+
+    def test_comment_update(self):
+        # The existing CLA comment is found once and then edited in place.
+        comment_url = 'https://api.github.com/repos/Microsoft/Pyjion/issues/comments/1'
+        body = github.NO_CLA_TEMPLATE.format(
+            not_signed=github.NO_CLA_BODY.format('@someone'), username_not_found='')
+        comments = [
+            {'url': comment_url, 'user': {'login': 'the-bot'}, 'body': body},
+            {'url': comment_url + '0', 'user': {'login': 'someone'}, 'body': 'Thanks!'},
+            # Quoting the bot doesn't make a comment the bot's.
+            {'url': comment_url + '1', 'user': {'login': 'someone'}, 'body': body},
+            {'url': comment_url + '2', 'user': None, 'body': body},
+        ]
+        server = util.FakeServerHost()
+        server.edit_comments = True
+        session = self.recording_session({('GET', self.user_url): {'login': 'the-bot'},
+                                          ('GET', self.comments_url): comments,
+                                          ('PATCH', comment_url): {}})
+        contrib = github.Host(server, session,
+                              github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        self.run_awaitable(contrib.comment({ni_abc.Status.not_signed: {'a'}}))
+        self.run_awaitable(contrib.comment({ni_abc.Status.not_signed: {'b'}}))
+        # Unchanged, so nothing to do.
+        self.run_awaitable(contrib.comment({ni_abc.Status.not_signed: {'b'}}))
+        self.assertEqual(session.requested, [('GET', self.comments_url),
+                                             ('GET', self.user_url),
+                                             ('PATCH', comment_url),
+                                             ('PATCH', comment_url)])
+        self.assertIn('@b', json.loads(session.data)['body'])
+
+    def test_comment_update_none_yet(self):
+        comment_url = 'https://api.github.com/repos/Microsoft/Pyjion/issues/comments/1'
+        server = util.FakeServerHost()
+        server.edit_comments = True
+        session = self.recording_session({('GET', self.user_url): {'login': 'the-bot'},
+                                          ('GET', self.comments_url): [],
+                                          ('POST', self.comments_url): {'url': comment_url},
+                                          ('PATCH', comment_url): {}})
+        contrib = github.Host(server, session,
+                              github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        self.run_awaitable(contrib.comment({ni_abc.Status.not_signed: {'a'}}))
+        self.run_awaitable(contrib.comment({ni_abc.Status.not_signed: {'b'}}))
+        # The bot's login is only needed to tell whose a CLA comment is.
+        self.assertEqual(session.requested, [('GET', self.comments_url),
+                                             ('POST', self.comments_url),
+                                             ('PATCH', comment_url)])
+
+    def test_comment_update_deleted(self):
+        # Should the comment have been deleted, post a new one.
+        comment_url = 'https://api.github.com/repos/Microsoft/Pyjion/issues/comments/1'
+        server = util.FakeServerHost()
+        server.edit_comments = True
+        github._comment_urls[self.synchronize_example['pull_request']['url']] = comment_url
+        session = self.recording_session({('POST', self.comments_url): {'url': comment_url + '0'}})
+        session._responses[('PATCH', comment_url)] = util.FakeResponse(
+            status=404, data={'message': 'Not Found'})
+        contrib = github.Host(server, session,
+                              github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        self.run_awaitable(contrib.comment({ni_abc.Status.not_signed: {'a'}}))
+        self.assertEqual(session.requested, [('PATCH', comment_url),
+                                             ('POST', self.comments_url)])
+        self.assertEqual(self.run_awaitable(contrib.comment_url()), comment_url + '0')
+
+    def test_comment_update_forbidden(self):
+        # Should the comment not be editable by the bot, post a new one.
+        comment_url = 'https://api.github.com/repos/Microsoft/Pyjion/issues/comments/1'
+        server = util.FakeServerHost()
+        server.edit_comments = True
+        github._comment_urls[self.synchronize_example['pull_request']['url']] = comment_url
+        session = self.recording_session({('POST', self.comments_url): {'url': comment_url + '0'}})
+        session._responses[('PATCH', comment_url)] = util.FakeResponse(
+            status=403, data={'message': 'Forbidden'})
+        contrib = github.Host(server, session,
+                              github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        self.run_awaitable(contrib.comment({ni_abc.Status.not_signed: {'a'}}))
+        self.assertEqual(session.requested, [('PATCH', comment_url),
+                                             ('POST', self.comments_url)])
+
+    def test_login(self):
+        session = self.recording_session({('GET', self.user_url): {'login': 'the-bot'}})
+        contrib = github.Host(util.FakeServerHost(), session,
+                              github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        self.assertEqual(self.run_awaitable(contrib.login()), 'the-bot')
+        # Looked up once.
+        self.assertEqual(self.run_awaitable(contrib.login()), 'the-bot')
+        self.assertEqual(session.requested, [('GET', self.user_url)])
+
+    def test_login_app(self):
+        # An App comments as its bot user.
+        server = util.FakeServerHost()
+        server.app_id, server.private_key = '42', 'key'
+        session = self.recording_session({('GET', 'https://api.github.com/app'):
+                                          {'slug': 'cla-bot'}})
+        contrib = github.Host(server, session,
+                              github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        with mock.patch('gidgethub.apps.get_jwt', return_value='jwt'):
+            self.assertEqual(self.run_awaitable(contrib.login()), 'cla-bot[bot]')
+
+    def test_set_status(self):
+        statuses_url = self.synchronize_example['pull_request']['statuses_url']
+        session = self.recording_session({('POST', statuses_url): {}})
+        contrib = github.Host(util.FakeServerHost(), session,
+                              github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        self.assertEqual(self.run_awaitable(contrib.set_status({})), 'success')
+        self.assertEqual(json.loads(session.data),
+                         {'state': 'success', 'context': github.STATUS_CONTEXT,
+                          'description': 'CLA signed',
+                          'target_url': github.STATUS_TARGET_URL})
+        problems = {ni_abc.Status.not_signed: {'b', 'a'},
+                    ni_abc.Status.username_not_found: {'c'}}
+        self.assertEqual(self.run_awaitable(contrib.set_status(problems)), 'failure')
+        self.assertEqual(json.loads(session.data)['description'],
+                         'CLA not signed by @a, @b, @c')
+        many = {ni_abc.Status.not_signed: {f'user{n}' for n in range(100)}}
+        self.run_awaitable(contrib.set_status(many))
+        description = json.loads(session.data)['description']
+        self.assertEqual(len(description), github.STATUS_DESCRIPTION_LENGTH)
+        self.assertTrue(description.endswith('...'))
+
+    def test_update_status(self):
+        # Repositories using a commit status never touch labels.
+        server = util.FakeServerHost()
+        server.status_repos = frozenset(['microsoft/pyjion'])
+        examples = {github.PullRequestEvent.opened: self.opened_example,
+                    github.PullRequestEvent.synchronize: self.synchronize_example,
+                    github.PullRequestEvent.unlabeled: self.unlabeled_example}
+        for event, payload in examples.items():
+            statuses_url = payload['pull_request']['statuses_url']
+            for problems in ({}, {ni_abc.Status.not_signed: {'username'}}):
+                with self.subTest(event=event, problems=problems):
+                    github._comment_digests.clear()
+                    github._comment_urls.clear()
+                    session = self.recording_session({('POST', statuses_url): {},
+                                                      ('GET', self.comments_url): [],
+                                                      ('POST', self.comments_url): {}})
+                    contrib = github.Host(server, session, event, payload)
+                    self.noException(contrib.update(problems))
+                    expected = [('POST', statuses_url)]
+                    if problems and event != github.PullRequestEvent.unlabeled:
+                        expected.extend([('GET', self.comments_url),
+                                         ('POST', self.comments_url)])
+                    self.assertEqual(session.requested, expected)
+
+    def test_update_status_commented(self):
+        # The same comment isn't posted again on each push, even by another
+        # process than the one which posted it.
+        server = util.FakeServerHost()
+        server.status_repos = frozenset(['microsoft/pyjion'])
+        problems = {ni_abc.Status.not_signed: {'username'}}
+        body = github.NO_CLA_TEMPLATE.format(
+            not_signed=github.NO_CLA_BODY.format('@username'), username_not_found='')
+        easteregg = github._comment_renderer.render(problems, easteregg=True).body
+        statuses_url = self.synchronize_example['pull_request']['statuses_url']
+        for posted in (body, easteregg):
+            with self.subTest(posted=posted):
+                github._comment_digests.clear()
+                github._comment_urls.clear()
+                github._logins.clear()
+                comments = [{'url': 'comment', 'user': {'login': 'the-bot'},
+                             'body': posted}]
+                session = self.recording_session({('POST', statuses_url): {},
+                                                  ('GET', self.user_url): {'login': 'the-bot'},
+                                                  ('GET', self.comments_url): comments})
+                contrib = github.Host(server, session, github.PullRequestEvent.synchronize,
+                                      self.synchronize_example)
+                self.noException(contrib.update(problems))
+                self.assertEqual(session.requested, [('POST', statuses_url),
+                                                     ('GET', self.comments_url),
+                                                     ('GET', self.user_url)])
+        # Someone else left unsigned, so the bot comments.
+        session = self.recording_session({('POST', statuses_url): {},
+                                          ('POST', self.comments_url): {}})
+        contrib = github.Host(server, session, github.PullRequestEvent.synchronize,
+                              self.synchronize_example)
+        self.noException(contrib.update({ni_abc.Status.not_signed: {'another'}}))
+        self.assertEqual(session.requested, [('POST', statuses_url),
+                                             ('POST', self.comments_url)])
+
     def test_update_opened(self):
         # Adding CLA status on an opened PR.
         comment = github.NO_CLA_TEMPLATE.format(
@@ -315,6 +988,7 @@ class GitHubTests(util.TestCase):
         )
         responses = {('GET', self.issues_url): self.issues_example,
                    ('POST', self.labels_url): [github.NO_CLA],
+                   ('GET', self.comments_url): [],
                    ('POST', self.comments_url): {'body': comment}}
         contrib = github.Host(util.FakeServerHost(),
                               util.FakeSession(responses),
@@ -334,7 +1008,8 @@ class GitHubTests(util.TestCase):
 
     def test_update_synchronize(self):
         # Update the PR after it's synchronized.
-        responses = {('GET', self.issues_url): self.issues_example}
+        responses = {('GET', self.issues_url): self.issues_example,
+                     ('GET', self.comments_url): []}
         # CLA signed and already labeled as such.
         responses[('GET', self.labels_url)] = self.labels_example
         session = util.FakeSession(responses)
@@ -417,3 +1092,301 @@ class GitHubTests(util.TestCase):
                               github.PullRequestEvent.synchronize,
                               self.synchronize_example)
         self.noException(contrib.update({ni_abc.Status.username_not_found: {'username'}}))
+
+
+class LabelSession(util.FakeSession):
+
+    """Keep the labels of a pull request as they are added and removed."""
+
+    def __init__(self, issue, labels_url, labels):
+        super().__init__({('GET', issue['url']): issue})
+        self.labels_url = labels_url
+        self.labels = list(labels)
+
+    def request(self, method, url, headers=None, data=None):
+        if url == self.labels_url and method == 'GET':
+            self.next_response = util.FakeResponse(
+                status=200, data=[{'name': label} for label in self.labels])
+        elif url == self.labels_url and method == 'POST':
+            self.labels.extend(json.loads(data))
+            self.next_response = util.FakeResponse(status=200, data=[])
+        elif url.startswith(self.labels_url + '/') and method == 'DELETE':
+            self.labels.remove(parse.unquote(url[len(self.labels_url) + 1:]))
+            self.next_response = util.FakeResponse(status=204, data=None)
+        else:
+            return super().request(method, url, headers=headers, data=data)
+        return self
+
+
+class InstallationTokensTests(util.TestCase):
+
+    def setUp(self):
+        self.server = util.FakeServerHost()
+        self.server.app_id = '1234'
+        self.server.private_key = 'private key'
+        self.session = util.FakeSession()
+        self.tokens = github.InstallationTokens(self.session)
+        self.fetched = []
+        self.sessions = []
+        self.expires_in = datetime.timedelta(hours=1)
+        patcher = mock.patch('gidgethub.apps.get_installation_access_token',
+                             self.get_installation_access_token)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def get_installation_access_token(self, gh, *, installation_id,
+                                            app_id, private_key):
+        self.assertEqual(app_id, '1234')
+        self.assertEqual(private_key, 'private key')
+        self.fetched.append(installation_id)
+        self.sessions.append(gh._session)
+        await asyncio.sleep(0)
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + self.expires_in
+        return {'token': f'token{len(self.fetched)}',
+                'expires_at': expires_at.strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+    def test_cached(self):
+        token = self.run_awaitable(self.tokens.token(self.server, 1))
+        self.assertEqual(token, 'token1')
+        token = self.run_awaitable(self.tokens.token(self.server, 1))
+        self.assertEqual(token, 'token1')
+        self.assertEqual(self.fetched, ['1'])
+        # Installations have their own tokens.
+        token = self.run_awaitable(self.tokens.token(self.server, 2))
+        self.assertEqual(token, 'token2')
+
+    def test_single_flight(self):
+
+        async def concurrently():
+            return await asyncio.gather(
+                *[self.tokens.token(self.server, 1) for _ in range(5)])
+
+        self.assertEqual(self.run_awaitable(concurrently()), ['token1'] * 5)
+        self.assertEqual(self.fetched, ['1'])
+
+    def test_refreshed_before_expiry(self):
+        self.expires_in = github.TOKEN_REFRESH_MARGIN - datetime.timedelta(minutes=1)
+
+        async def refresh():
+            first = await self.tokens.token(self.server, 1)
+            # Still usable, so returned while a renewal starts in the background.
+            second = await self.tokens.token(self.server, 1)
+            await asyncio.sleep(0.01)
+            return first, second
+
+        self.assertEqual(self.run_awaitable(refresh()), ('token1', 'token1'))
+        self.assertEqual(self.fetched, ['1', '1'])
+        # Renewed with the cache's own session, which outlives any delivery's.
+        self.assertEqual(self.sessions, [self.session, self.session])
+
+    def test_close(self):
+        closed = []
+
+        async def close():
+            closed.append(True)
+
+        self.session.close = close
+        self.run_awaitable(self.tokens.close())
+        self.assertEqual(closed, [])
+        self.run_awaitable(self.tokens.token(self.server, 1))
+        self.run_awaitable(self.tokens.close())
+        self.assertEqual(closed, [True])
+
+    def test_expired(self):
+        self.expires_in = datetime.timedelta(seconds=30)
+        self.run_awaitable(self.tokens.token(self.server, 1))
+        token = self.run_awaitable(self.tokens.token(self.server, 1))
+        self.assertEqual(token, 'token2')
+
+    def test_process(self):
+        payload = copy.deepcopy(example('synchronize.json'))
+        payload['installation'] = {'id': 42}
+        request = util.FakeRequest(payload)
+        with mock.patch.object(github, '_installation_tokens', self.tokens):
+            contrib = self.run_awaitable(github.Host.process(
+                self.server, request, util.FakeSession()))
+        self.assertEqual(self.fetched, ['42'])
+        self.assertEqual(contrib._gh.oauth_token, 'token1')
+
+    def test_process_no_installation(self):
+        request = util.FakeRequest(example('synchronize.json'))
+        with self.assertRaises(ni_abc.ResponseExit) as cm:
+            self.run_awaitable(github.Host.process(self.server, request,
+                                                   util.FakeSession()))
+        self.assertEqual(cm.exception.response.status, 400)
+        self.assertEqual(self.fetched, [])
+
+
+class ConditionalSession(util.FakeSession):
+
+    """Serve JSON with an ETag, answering 304 when the request matches it."""
+
+    def __init__(self, data, etag='"abc"'):
+        super().__init__()
+        self.data = data
+        self.etag = etag
+        self.sent_headers = []
+
+    def request(self, method, url, headers=None, data=None):
+        self.sent_headers.append(headers)
+        if headers.get('if-none-match') == self.etag:
+            response = util.FakeResponse(status=304)
+        else:
+            response = util.FakeResponse(status=200, data=self.data)
+        response.headers = CIMultiDict(util.FakeResponse.headers, etag=self.etag)
+        self.next_response = response
+        return self
+
+
+class FlakySession(util.FakeSession):
+
+    """Answer each request with the next of the statuses."""
+
+    def __init__(self, *statuses, data=None):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.data = data
+        self.methods = []
+
+    def request(self, method, url, headers=None, data=None):
+        self.methods.append(method)
+        self.next_response = util.FakeResponse(status=self.statuses.pop(0),
+                                               data=self.data)
+        return self
+
+
+class SlowSession(FlakySession):
+
+    """Answer every request successfully, after a delay."""
+
+    def __init__(self, delay, data=None):
+        super().__init__(data=data)
+        self.delay = delay
+
+    def request(self, method, url, headers=None, data=None):
+        self.statuses.append(200)
+        return super().request(method, url, headers=headers, data=data)
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.delay)
+        return await super().__aenter__()
+
+
+@mock.patch('ni.upstream.RETRY_BASE_DELAY', 0.001)
+class RetryTests(util.TestCase):
+
+    url = 'https://api.github.com/repos/Microsoft/Pyjion/issues/109'
+
+    def api(self, session):
+        service = upstream.Upstream('api.github.com', budget=upstream.RetryBudget())
+        return github.CachingGitHubAPI(session, 'testing', responses=github.ResponseCache(),
+                                       upstream=service)
+
+    def test_retried(self):
+        session = FlakySession(502, 200, data={'number': 109})
+        self.assertEqual(self.run_awaitable(self.api(session).getitem(self.url)),
+                         {'number': 109})
+        self.assertEqual(session.methods, ['GET', 'GET'])
+
+    def test_exhausted(self):
+        # gidgethub raises as usual once every attempt has failed.
+        session = FlakySession(*[503] * upstream.RETRY_ATTEMPTS, data={})
+        with self.assertRaises(gidgethub.GitHubBroken):
+            self.run_awaitable(self.api(session).getitem(self.url))
+        self.assertEqual(len(session.methods), upstream.RETRY_ATTEMPTS)
+
+    def test_not_idempotent(self):
+        session = FlakySession(502, 201, data={})
+        with self.assertRaises(gidgethub.GitHubBroken):
+            self.run_awaitable(self.api(session).post(self.url, data={}))
+        self.assertEqual(session.methods, ['POST'])
+
+    def test_not_idempotent_not_timed_out(self):
+        # A slow comment may well be posted, so it is waited for.
+        session = SlowSession(0.05, data={})
+        api = self.api(session)
+        with mock.patch.object(api._upstream, 'timeout', return_value=0.01):
+            self.run_awaitable(api.post(self.url, data={}))
+            with self.assertRaises(asyncio.TimeoutError):
+                self.run_awaitable(api.getitem(self.url))
+        self.assertEqual(session.methods[:2], ['POST', 'GET'])
+        self.assertEqual(api._upstream.timeouts, len(session.methods) - 1)
+
+    def test_label_removed_by_retry(self):
+        # The first attempt removed the label despite failing, so the retry
+        # finds it missing.
+        github._removed_labels.clear()
+        session = FlakySession(502, 404, data={'message': 'Not Found'})
+        contrib = github.Host(util.FakeServerHost(), session,
+                              github.PullRequestEvent.synchronize,
+                              example('synchronize.json'))
+        contrib._gh = self.api(session)
+
+        async def current_label():
+            return github.CLA_OK
+
+        async def labels_url(label=None):
+            return self.url + '/labels/' + parse.quote(label)
+
+        contrib.current_label = current_label
+        contrib.labels_url = labels_url
+        self.assertEqual(self.run_awaitable(contrib.remove_label()), github.CLA_OK)
+        self.assertEqual(session.methods, ['DELETE', 'DELETE'])
+        self.assertIn((contrib.key(), github.CLA_OK), github._removed_labels)
+
+
+class ResponseCacheTests(util.TestCase):
+
+    url = 'https://api.github.com/repos/Microsoft/Pyjion/issues/109'
+
+    def test_conditional_request(self):
+        cache = github.ResponseCache()
+        session = ConditionalSession({'number': 109})
+        gh = github.CachingGitHubAPI(session, 'testing', responses=cache)
+        first = self.run_awaitable(gh.getitem(self.url))
+        second = self.run_awaitable(gh.getitem(self.url))
+        self.assertEqual(first, {'number': 109})
+        self.assertEqual(second, first)
+        self.assertNotIn('if-none-match', session.sent_headers[0])
+        self.assertEqual(session.sent_headers[1]['if-none-match'], '"abc"')
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['hit_rate'], 0.5)
+
+    def test_changed(self):
+        cache = github.ResponseCache()
+        session = ConditionalSession({'number': 109})
+        gh = github.CachingGitHubAPI(session, 'testing', responses=cache)
+        self.run_awaitable(gh.getitem(self.url))
+        session.data, session.etag = {'number': 110}, '"def"'
+        self.assertEqual(self.run_awaitable(gh.getitem(self.url)), {'number': 110})
+        self.assertEqual(cache.get(self.url)[0], '"def"')
+
+    def test_uncacheable(self):
+        # Responses without an ETag aren't cached.
+        cache = github.ResponseCache()
+        session = util.FakeSession({('GET', self.url): {'number': 109}})
+        gh = github.CachingGitHubAPI(session, 'testing', responses=cache)
+        self.run_awaitable(gh.getitem(self.url))
+        self.assertEqual(len(cache), 0)
+
+    def test_eviction(self):
+        headers = {'etag': '"abc"'}
+        entry_size = len('url0') + 100 + len('etag') + len('"abc"')
+        cache = github.ResponseCache(max_size=entry_size * 2)
+        for n in range(3):
+            cache.put(f'url{n}', '"abc"', headers, b'x' * 100)
+        self.assertIsNone(cache.get('url0'))
+        self.assertIsNotNone(cache.get('url1'))
+        self.assertIsNotNone(cache.get('url2'))
+        self.assertEqual(cache.size, entry_size * 2)
+        self.assertEqual(cache.evictions, 1)
+        # Recently used entries are kept over older ones.
+        cache.get('url1')
+        cache.put('url3', '"abc"', headers, b'x' * 100)
+        self.assertIsNone(cache.get('url2'))
+        self.assertIsNotNone(cache.get('url1'))
+        # Entries which could never fit are not cached.
+        cache.put('huge', '"abc"', headers, b'x' * entry_size * 2)
+        self.assertIsNone(cache.get('huge'))
+        self.assertEqual(len(cache), 2)
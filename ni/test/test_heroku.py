@@ -32,6 +32,16 @@ class HerokuTests(unittest.TestCase):
         os.environ['GH_AUTH_TOKEN'] = auth_token
         self.assertEqual(self.server.contrib_auth_token(), auth_token)
 
+    @mock.patch.dict(os.environ, {'GH_APP_ID': '1234', 'GH_PRIVATE_KEY': 'key'})
+    def test_contrib_app(self):
+        self.assertEqual(self.server.contrib_app_id(), '1234')
+        self.assertEqual(self.server.contrib_private_key(), 'key')
+
+    @mock.patch.dict(os.environ, clear=True)
+    def test_no_contrib_app(self):
+        self.assertIsNone(self.server.contrib_app_id())
+        self.assertIsNone(self.server.contrib_private_key())
+
     def test_contrib_secret(self):
         secret = "secret"
         os.environ["GH_SECRET"] = secret
@@ -75,3 +85,91 @@ class HerokuTests(unittest.TestCase):
     @mock.patch.dict(os.environ, {'CLA_TRUSTED_USERS': ""})
     def test_no_trusted_users(self):
         self.assertEqual(self.server.trusted_users(), frozenset({''}))
+
+    @mock.patch.dict(os.environ, {'CLA_STATUS_REPOS': 'python/cpython, Python/PEPs,'})
+    def test_status_repositories(self):
+        self.assertEqual(self.server.status_repositories(),
+                         frozenset(['python/cpython', 'python/peps']))
+
+    @mock.patch.dict(os.environ, clear=True)
+    def test_no_status_repositories(self):
+        self.assertEqual(self.server.status_repositories(), frozenset())
+
+    @mock.patch.dict(os.environ, {'CLA_PRIORITY_REPOS': 'python/cpython, Python/PEPs,'})
+    def test_priority_repositories(self):
+        self.assertEqual(self.server.priority_repositories(),
+                         frozenset(['python/cpython', 'python/peps']))
+
+    @mock.patch.dict(os.environ, clear=True)
+    def test_no_priority_repositories(self):
+        self.assertEqual(self.server.priority_repositories(), frozenset())
+
+    @mock.patch.dict(os.environ, {'CLA_WARM_UP_REPOS': 'python/cpython, Python/PEPs,'})
+    def test_warm_up_repositories(self):
+        self.assertEqual(self.server.warm_up_repositories(),
+                         frozenset(['python/cpython', 'python/peps']))
+
+    @mock.patch.dict(os.environ, clear=True)
+    def test_warm_up_defaults(self):
+        self.assertEqual(self.server.warm_up_repositories(), frozenset())
+        self.assertEqual(self.server.warm_up_deadline(), 30.0)
+
+    @mock.patch.dict(os.environ, {'CLA_WARM_UP_DEADLINE': '2.5'})
+    def test_warm_up_deadline(self):
+        self.assertEqual(self.server.warm_up_deadline(), 2.5)
+
+    def test_update_comments(self):
+        for value, expected in [('true', True), ('1', True), ('', False), ('no', False)]:
+            with mock.patch.dict(os.environ, {'CLA_UPDATE_COMMENTS': value}):
+                self.assertEqual(self.server.update_comments(), expected)
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertFalse(self.server.update_comments())
+
+    @mock.patch.dict(os.environ, {'CLA_HEDGE_PERCENT': '5'})
+    def test_hedge_budget(self):
+        self.assertEqual(self.server.hedge_budget(), 0.05)
+
+    @mock.patch.dict(os.environ, clear=True)
+    def test_no_hedge_budget(self):
+        self.assertEqual(self.server.hedge_budget(), 0.0)
+
+    @mock.patch.dict(os.environ, {'CLA_JOURNAL_DIR': '/tmp/journal'})
+    def test_journal_directory(self):
+        self.assertEqual(self.server.journal_directory(), '/tmp/journal')
+
+    @mock.patch.dict(os.environ, clear=True)
+    def test_no_journal_directory(self):
+        self.assertIsNone(self.server.journal_directory())
+
+    @mock.patch.dict(os.environ, {'CLA_LOOP_MONITOR_DIR': '/tmp/loop'})
+    def test_loop_monitor_directory(self):
+        self.assertEqual(self.server.loop_monitor_directory(), '/tmp/loop')
+
+    @mock.patch.dict(os.environ, clear=True)
+    def test_no_loop_monitor_directory(self):
+        self.assertIsNone(self.server.loop_monitor_directory())
+
+    @mock.patch.dict(os.environ, {'CLA_ADMIN_TOKEN': 'secret'})
+    def test_admin_token(self):
+        self.assertEqual(self.server.admin_token(), 'secret')
+
+    @mock.patch.dict(os.environ, {'CLA_ADMIN_TOKEN': ''})
+    def test_no_admin_token(self):
+        # An empty token mustn't open the admin route to everyone.
+        self.assertIsNone(self.server.admin_token())
+
+    @mock.patch.dict(os.environ, {'CLA_CACHE_URL': 'redis://localhost:6379/1'})
+    def test_cache_url(self):
+        self.assertEqual(self.server.cache_url(), 'redis://localhost:6379/1')
+
+    @mock.patch.dict(os.environ, clear=True)
+    def test_no_cache_url(self):
+        self.assertIsNone(self.server.cache_url())
+
+    @mock.patch.dict(os.environ, {'CLA_INDEX_PATH': '/tmp/cla.index'})
+    def test_cla_index_path(self):
+        self.assertEqual(self.server.cla_index_path(), '/tmp/cla.index')
+
+    @mock.patch.dict(os.environ, clear=True)
+    def test_no_cla_index_path(self):
+        self.assertIsNone(self.server.cla_index_path())
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+
+from .. import abc as ni_abc
+from .. import index
+
+
+class StatusIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cla.index')
+        self.index = index.StatusIndex(self.path)
+        self.addCleanup(self.index.close)
+
+    def test_missing_file(self):
+        self.assertIsNone(self.index.lookup('brettcannon'))
+        self.assertEqual(self.index.lookup_many(['brettcannon']), {})
+
+    def test_round_trip(self):
+        statuses = {'brettcannon': ni_abc.Status.signed,
+                    'the-knights-who-say-ni': ni_abc.Status.not_signed,
+                    'nobody': ni_abc.Status.username_not_found}
+        changed = self.index.update(statuses)
+        self.assertEqual(changed, frozenset(statuses))
+        self.assertEqual(os.path.getsize(self.path),
+                         len(statuses) * index.RECORD_SIZE)
+        self.assertEqual(self.index.lookup_many(statuses), statuses)
+        self.assertIsNone(self.index.lookup('somebody-else'))
+        # Usernames are case-insensitive on GitHub.
+        self.assertEqual(self.index.lookup('BrettCannon'), ni_abc.Status.signed)
+
+    def test_update_changes(self):
+        self.index.update({'brettcannon': ni_abc.Status.not_signed})
+        self.assertEqual(self.index.update({'brettcannon': ni_abc.Status.not_signed}),
+                         frozenset())
+        changed = self.index.update({'brettcannon': ni_abc.Status.signed,
+                                     'dstufft': ni_abc.Status.signed})
+        self.assertEqual(changed, {'brettcannon', 'dstufft'})
+        self.assertEqual(self.index.lookup('brettcannon'), ni_abc.Status.signed)
+
+    def test_other_readers_see_updates(self):
+        reader = index.StatusIndex(self.path)
+        self.addCleanup(reader.close)
+        self.index.update({'brettcannon': ni_abc.Status.not_signed})
+        self.assertEqual(reader.lookup('brettcannon'), ni_abc.Status.not_signed)
+        self.index.update({'brettcannon': ni_abc.Status.signed})
+        self.assertEqual(reader.lookup('brettcannon'), ni_abc.Status.signed)
+
+    def test_update_leaves_mapping(self):
+        # Updating, e.g. in another thread, doesn't touch the mapping lookups use.
+        self.index.update({'brettcannon': ni_abc.Status.signed})
+        self.index.lookup('brettcannon')
+        mapped = self.index._map
+        self.index.update({'dstufft': ni_abc.Status.signed})
+        self.assertIs(self.index._map, mapped)
+        self.assertFalse(mapped.closed)
+        self.assertEqual(self.index.lookup('dstufft'), ni_abc.Status.signed)
+
+    def test_remap_while_iterating(self):
+        # A replaced mapping is left open for whatever is still reading it.
+        self.index.update({f'user{n}': ni_abc.Status.signed for n in range(3)})
+        records = iter(self.index)
+        next(records)
+        self.index.update({'brettcannon': ni_abc.Status.signed})
+        self.assertEqual(self.index.lookup('brettcannon'), ni_abc.Status.signed)
+        self.assertEqual(len(list(records)), 2)
+
+    def test_unindexable_usernames(self):
+        too_long = 'x' * (index.KEY_SIZE + 1)
+        changed = self.index.update({too_long: ni_abc.Status.signed,
+                                     'ünicode': ni_abc.Status.signed})
+        self.assertEqual(changed, frozenset())
+        self.assertEqual(self.index.lookup_many([too_long, 'ünicode', '']), {})
+
+    def test_many_records(self):
+        statuses = {f'user{n}': ni_abc.Status((n % 3) + 1) for n in range(1000)}
+        self.index.update(statuses)
+        self.assertEqual(self.index.lookup_many(statuses), statuses)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import tempfile
+
+from .. import journal
+from . import util
+
+
+class JournalTests(util.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def reopen(self, **kwargs):
+        """Open the journal afresh, as after a restart."""
+        reopened = journal.Journal(self.directory, **kwargs)
+        self.addCleanup(lambda: self.run_awaitable(reopened.close()))
+        return reopened, reopened.open()
+
+    def test_unfinished(self):
+        deliveries, entries = self.reopen()
+        self.assertEqual(entries, [])
+        async def record():
+            first = await deliveries.append('one', b'1')
+            await deliveries.append('two', b'2')
+            deliveries.complete(first)
+            await deliveries.close()
+        self.run_awaitable(record())
+        deliveries, entries = self.reopen()
+        self.assertEqual(entries, [(1, 'two', b'2')])
+
+    def test_sequence_continues(self):
+        deliveries, _ = self.reopen()
+        self.run_awaitable(deliveries.append('one', b'1'))
+        self.run_awaitable(deliveries.close())
+        deliveries, _ = self.reopen()
+        self.assertEqual(self.run_awaitable(deliveries.append('two', b'2')), 1)
+        self.run_awaitable(deliveries.close())
+
+    def test_group_commit(self):
+        deliveries, _ = self.reopen()
+        async def record():
+            await asyncio.gather(*(deliveries.append(str(n), b'x' * 100)
+                                   for n in range(50)))
+            await deliveries.close()
+        self.run_awaitable(record())
+        self.assertEqual(deliveries.appends, 50)
+        # Once when starting afresh and once for every entry together.
+        self.assertEqual(deliveries.syncs, 2)
+
+    def test_torn_frame(self):
+        deliveries, _ = self.reopen()
+        self.run_awaitable(deliveries.append('one', b'1'))
+        self.run_awaitable(deliveries.close())
+        frame = journal.entry_frame(1, 'two', b'2')
+        with open(deliveries.path, 'ab') as file:
+            file.write(frame[:-1])
+        deliveries, entries = self.reopen()
+        self.assertEqual(entries, [(0, 'one', b'1')])
+        # The torn frame is gone, so later entries can be read.
+        self.run_awaitable(deliveries.append('three', b'3'))
+        self.run_awaitable(deliveries.close())
+        _, entries = self.reopen()
+        self.assertEqual([key for _, key, _ in entries], ['one', 'three'])
+
+    def test_compaction(self):
+        deliveries, _ = self.reopen(compact_size=1024)
+        async def record():
+            for n in range(20):
+                async with deliveries.entry(str(n), b'x' * 100):
+                    pass
+            await deliveries.append('left', b'!')
+            await deliveries.close()
+        self.run_awaitable(record())
+        self.assertLess(os.path.getsize(deliveries.path), 1024)
+        _, entries = self.reopen()
+        self.assertEqual([key for _, key, _ in entries], ['left'])
+
+    def test_entry(self):
+        deliveries, _ = self.reopen()
+        async def record():
+            with self.assertRaises(ValueError):
+                async with deliveries.entry('failed', b''):
+                    raise ValueError
+            # Dying mid-delivery (e.g. shutting down) leaves it unfinished.
+            with self.assertRaises(asyncio.CancelledError):
+                async with deliveries.entry('cancelled', b''):
+                    raise asyncio.CancelledError
+            # As does work which was turned away.
+            with self.assertRaises(KeyError):
+                async with deliveries.entry('turned away', b'', unfinished=(KeyError,)):
+                    raise KeyError
+            await deliveries.close()
+        self.run_awaitable(record())
+        _, entries = self.reopen()
+        self.assertEqual([key for _, key, _ in entries], ['cancelled', 'turned away'])
+
+    def test_not_open(self):
+        deliveries = journal.Journal(self.directory)
+        with self.assertRaises(RuntimeError):
+            self.run_awaitable(deliveries.append('one', b'1'))
+
+    def test_claims(self):
+        # Every process claims a journal of its own.
+        first, _ = self.reopen()
+        second, _ = self.reopen()
+        self.assertNotEqual(first.path, second.path)
+        self.run_awaitable(first.close())
+        third, _ = self.reopen()
+        self.assertEqual(third.path, first.path)
+        self.run_awaitable(second.close())
+        self.run_awaitable(third.close())
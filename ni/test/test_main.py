@@ -1,10 +1,18 @@
+import asyncio
 import http
+import json
+import subprocess
+import sys
+import tempfile
 import unittest.mock as mock
 from typing import AbstractSet, FrozenSet, Mapping
 
+from aiohttp import test_utils, web
+
 from .. import __main__
 from .. import abc as ni_abc
 from .. import github
+from .. import journal
 from . import util
 
 
@@ -39,6 +47,9 @@ class FakeContribHost(ni_abc.ContribHost):
             raise self._raise
         return self
 
+    def key(self):
+        return 'fake'
+
     async def usernames(self):
         """Return an iterable of all the contributors' usernames."""
         return frozenset(self._usernames)
@@ -117,6 +128,29 @@ class HandlerTest(util.TestCase):
         # Fails due to secret being provided but response not signed.
         self.assertEqual(response.status, 500)
 
+    def test_screened_out(self):
+        # Uninteresting events never create a client session.
+        server = util.FakeServerHost()
+        cla = FakeCLAHost()
+        request = util.FakeRequest({'action': 'closed'})
+        def create_client():
+            raise AssertionError('client session created')
+        with mock.patch('ni.__main__.ContribHost', github.Host):
+            responder = __main__.handler(create_client, server, cla)
+            response = self.run_awaitable(responder(request))
+        self.assertEqual(response.status, http.HTTPStatus.NO_CONTENT)
+
+    def test_screened_out_unsigned(self):
+        # Unsigned requests are rejected even for uninteresting events.
+        server = util.FakeServerHost()
+        server.secret = "secret"
+        cla = FakeCLAHost()
+        request = util.FakeRequest({'action': 'closed'})
+        with mock.patch('ni.__main__.ContribHost', github.Host):
+            responder = __main__.handler(util.FakeSession, server, cla)
+            response = self.run_awaitable(responder(request))
+        self.assertEqual(response.status, http.HTTPStatus.INTERNAL_SERVER_ERROR)
+
     def test_no_trusted_users(self):
         usernames = ['miss-islington', 'bedevere-bot']
         problems: Mapping[ni_abc.Status, AbstractSet[str]] = {}
@@ -219,3 +253,651 @@ class HandlerTest(util.TestCase):
         self.assertEqual(response.status, 200)
         self.assertEqual(cla.usernames, frozenset([]))
         self.assertEqual(contrib.problems, problems)
+
+
+class BatchProblemsTest(util.TestCase):
+
+    def test_union_checked_once(self):
+        problems = {ni_abc.Status.not_signed: {'miss-islington'},
+                    ni_abc.Status.username_not_found: {'web-flow'}}
+        cla = FakeCLAHost(problems)
+        usernames = {1: {'brettcannon', 'miss-islington'},
+                     2: {'miss-islington', 'web-flow'},
+                     3: {'brettcannon'}}
+        result = self.run_awaitable(cla.batch_problems(util.FakeSession(), usernames))
+        self.assertEqual(cla.usernames,
+                         {'brettcannon', 'miss-islington', 'web-flow'})
+        self.assertEqual(result, {
+            1: {ni_abc.Status.not_signed: {'miss-islington'}},
+            2: problems,
+            3: {},
+        })
+
+    def test_nothing_to_check(self):
+        cla = FakeCLAHost()
+        result = self.run_awaitable(cla.batch_problems(util.FakeSession(), {1: set()}))
+        self.assertEqual(result, {1: {}})
+        self.assertFalse(hasattr(cla, 'usernames'))
+
+
+class ProblemsTest(util.TestCase):
+
+    def test_mapping(self):
+        problems = ni_abc.Problems({ni_abc.Status.username_not_found: {'web-flow'},
+                                    ni_abc.Status.not_signed: ['miss-islington'],
+                                    ni_abc.Status.signed: set()})
+        # Statuses without usernames are dropped.
+        self.assertEqual(list(problems), [ni_abc.Status.not_signed,
+                                          ni_abc.Status.username_not_found])
+        self.assertEqual(problems[ni_abc.Status.not_signed], {'miss-islington'})
+        self.assertIsInstance(problems[ni_abc.Status.not_signed], frozenset)
+        with self.assertRaises(KeyError):
+            problems[ni_abc.Status.signed]
+        self.assertEqual(problems, {ni_abc.Status.not_signed: {'miss-islington'},
+                                    ni_abc.Status.username_not_found: {'web-flow'}})
+        self.assertIn('miss-islington', repr(problems))
+
+    def test_compact(self):
+        self.assertIs(ni_abc.Problems(), ni_abc.Problems({ni_abc.Status.not_signed: set()}))
+        self.assertFalse(ni_abc.Problems())
+        problems = ni_abc.Problems({ni_abc.Status.not_signed: {'miss-islington'}})
+        self.assertIs(ni_abc.Problems(problems), problems)
+        self.assertFalse(hasattr(problems, '__dict__'))
+        with self.assertRaises(AttributeError):
+            problems.extra = None
+
+    def test_hashable(self):
+        first = ni_abc.Problems({ni_abc.Status.not_signed: {'a', 'b'}})
+        second = ni_abc.Problems({ni_abc.Status.not_signed: {'b', 'a'}})
+        self.assertEqual(hash(first), hash(second))
+        self.assertEqual(len({first, second}), 1)
+
+    def test_select(self):
+        problems = ni_abc.Problems({ni_abc.Status.not_signed: {'a', 'b'}})
+        self.assertEqual(ni_abc.select_problems(problems, {'b', 'c'}),
+                         {ni_abc.Status.not_signed: {'b'}})
+        self.assertIs(ni_abc.select_problems(problems, {'c'}), ni_abc.Problems())
+
+
+class ReadinessTest(util.TestCase):
+
+    def test_ready_after_warm_up(self):
+        warming = None
+        async def warm_up():
+            await warming.wait()
+        readiness = __main__.Readiness(util.FakeServerHost(), warm_up)
+        async def check():
+            nonlocal warming
+            warming = asyncio.Event()
+            await readiness.start(None)
+            await asyncio.sleep(0)
+            before = await readiness.respond(util.FakeRequest())
+            warming.set()
+            await readiness.ready.wait()
+            after = await readiness.respond(util.FakeRequest())
+            await readiness.stop(None)
+            return before.status, after.status
+        self.assertEqual(self.run_awaitable(check()),
+                         (http.HTTPStatus.SERVICE_UNAVAILABLE, http.HTTPStatus.OK))
+
+    def test_failed_warm_up(self):
+        async def warm_up():
+            raise ConnectionError
+        server = util.FakeServerHost()
+        readiness = __main__.Readiness(server, warm_up)
+        async def check():
+            await readiness.start(None)
+            await readiness.ready.wait()
+            await readiness.stop(None)
+        self.run_awaitable(check())
+        self.assertIsInstance(server.logged_exc, ConnectionError)
+
+    def test_deadline(self):
+        async def warm_up():
+            await asyncio.sleep(60)
+        server = util.FakeServerHost()
+        readiness = __main__.Readiness(server, warm_up, deadline=0.01)
+        async def check():
+            await readiness.start(None)
+            await readiness.ready.wait()
+            await readiness.stop(None)
+        self.run_awaitable(check())
+        self.assertTrue(any('cut short' in message for message in server.logged))
+
+    def test_stop_while_warming(self):
+        async def warm_up():
+            await asyncio.sleep(60)
+        readiness = __main__.Readiness(util.FakeServerHost(), warm_up)
+        async def check():
+            await readiness.start(None)
+            await asyncio.sleep(0)
+            await readiness.stop(None)
+        self.run_awaitable(check())
+        self.assertFalse(readiness.ready.is_set())
+
+    def test_shared_pool(self):
+        pool = __main__.ClientPool()
+        async def check():
+            await pool.open(None)
+            async with pool() as first, pool() as second:
+                shared = first.connector is second.connector
+            # Closing a session leaves the shared pool open.
+            still_open = not pool._connector.closed
+            await pool.close(None)
+            return shared, still_open
+        self.assertEqual(self.run_awaitable(check()), (True, True))
+
+
+# Generous, as the import of aiohttp dominates and machines vary; a regression
+# like importing sentry_sdk again would still be caught below.
+IMPORT_TIME_BUDGET = 1.0  # Seconds.
+
+
+class ImportTimeTest(util.TestCase):
+
+    def import_times(self, module):
+        """Return the cumulative import time in seconds of every module."""
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                                  f'import {module}'],
+                                 capture_output=True, text=True, check=True)
+        times = {}
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            times[name.strip()] = int(cumulative) / 1_000_000
+        return times
+
+    def test_budget(self):
+        times = self.import_times('ni.__main__')
+        self.assertLess(times['ni.__main__'], IMPORT_TIME_BUDGET)
+        # Only needed once serving, or only by some deployments.
+        for lazy in ('sentry_sdk', 'gidgethub.apps', 'jwt'):
+            self.assertNotIn(lazy, times)
+
+    def test_hosts_lazy(self):
+        times = self.import_times('ni.scheduler')
+        self.assertNotIn('aiohttp', times)
+        self.assertNotIn('gidgethub', times)
+
+
+class JournalingContribHost(FakeContribHost):
+
+    """Journal requests by their delivery ID."""
+
+    def delivery_id(self, request):
+        return request.headers['x-github-delivery']
+
+    def dump(self, request):
+        delivery_id = self.delivery_id(request)
+        return delivery_id, delivery_id.encode('ascii')
+
+    def load(self, data):
+        if data == b'corrupt':
+            raise ValueError(data)
+        return {'id': data.decode('ascii')}
+
+    async def process(self, server, request, session):
+        self.processed = getattr(self, 'processed', [])
+        self.processed.append(request.get('id'))
+        return await super().process(server, request, session)
+
+
+class DumpingContribHost(FakeContribHost):
+
+    """Journal requests without being able to load them."""
+
+    def dump(self, request):
+        return '12345', b''
+
+
+class JournalTest(util.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def reopen(self):
+        reopened = journal.Journal(self.directory)
+        self.addCleanup(lambda: self.run_awaitable(reopened.close()))
+        return reopened.open()
+
+    def test_unfinished_replayed(self):
+        server = util.FakeServerHost()
+        # The process dies while updating the contribution.
+        crashed = JournalingContribHost(raise_=None)
+        async def crash(problems):
+            raise asyncio.CancelledError
+        crashed.update = crash
+        deliveries = journal.Journal(self.directory)
+        deliveries.open()
+        request = util.FakeRequest()
+        with mock.patch('ni.__main__.ContribHost', crashed):
+            responder = __main__.handler(util.FakeSession, server, FakeCLAHost({}),
+                                         deliveries=deliveries)
+            with self.assertRaises(asyncio.CancelledError):
+                self.run_awaitable(responder(request))
+        self.run_awaitable(deliveries.close())
+
+        restarted = JournalingContribHost()
+        deliveries = journal.Journal(self.directory)
+        entries = deliveries.open()
+        self.assertEqual([key for _, key, _ in entries], ['12345'])
+        with mock.patch('ni.__main__.ContribHost', restarted):
+            responder = __main__.handler(util.FakeSession, server, FakeCLAHost({}),
+                                         deliveries=deliveries)
+            async def replay():
+                await __main__.replay(server, deliveries, entries, responder)
+                await deliveries.close()
+            self.run_awaitable(replay())
+        self.assertEqual(restarted.processed, ['12345'])
+        self.assertEqual(restarted.problems, {})
+        self.assertEqual(self.reopen(), [])
+
+    def test_not_journaled(self):
+        # Requests are handled without a journal, or without a record to journal.
+        server = util.FakeServerHost()
+        deliveries = journal.Journal(self.directory)
+        deliveries.open()
+        self.addCleanup(lambda: self.run_awaitable(deliveries.close()))
+        for contrib, journaled in [(JournalingContribHost(), None),
+                                   (FakeContribHost(), deliveries)]:
+            with self.subTest(journaled=journaled), \
+                    mock.patch('ni.__main__.ContribHost', contrib):
+                responder = __main__.handler(util.FakeSession, server, FakeCLAHost({}),
+                                             deliveries=journaled)
+                response = self.run_awaitable(responder(util.FakeRequest()))
+                self.assertEqual(response.status, http.HTTPStatus.OK)
+                self.assertEqual(contrib.problems, {})
+        self.assertFalse(hasattr(server, 'logged_exc'))
+
+    def test_replay_deduplicated(self):
+        server = util.FakeServerHost()
+        contrib = JournalingContribHost()
+        deliveries = journal.Journal(self.directory)
+        deliveries.open()
+        async def replay():
+            entries = [(await deliveries.append(key, key.encode('ascii')), key,
+                        key.encode('ascii'))
+                       for key in ['one', 'two', 'one', 'corrupt']]
+            with mock.patch('ni.__main__.ContribHost', contrib):
+                responder = __main__.handler(util.FakeSession, server,
+                                             FakeCLAHost({}), deliveries=deliveries)
+                await __main__.replay(server, deliveries, entries, responder)
+            await deliveries.close()
+        self.run_awaitable(replay())
+        self.assertEqual(sorted(contrib.processed), ['one', 'two'])
+        self.assertIsInstance(server.logged_exc, ValueError)
+        self.assertEqual(self.reopen(), [])
+
+    def test_replay_not_loadable(self):
+        # A host which can't load what it dumped skips replaying it.
+        server = util.FakeServerHost()
+        contrib = DumpingContribHost()
+        deliveries = journal.Journal(self.directory)
+        deliveries.open()
+        async def replay():
+            entries = [(await deliveries.append('one', b'one'), 'one', b'one')]
+            with mock.patch('ni.__main__.ContribHost', contrib):
+                responder = __main__.handler(util.FakeSession, server,
+                                             FakeCLAHost({}), deliveries=deliveries)
+                await __main__.replay(server, deliveries, entries, responder)
+            await deliveries.close()
+        self.run_awaitable(replay())
+        self.assertFalse(hasattr(contrib, 'problems'))
+        self.assertFalse(hasattr(server, 'logged_exc'))
+        self.assertTrue(any('Skipped replaying delivery one' in message
+                            for message in server.logged))
+        self.assertEqual(self.reopen(), [])
+
+
+class FailingUpdateContribHost(JournalingContribHost):
+
+    """Fail to update the contribution the first time."""
+
+    async def usernames(self):
+        self.listed = getattr(self, 'listed', 0) + 1
+        return await super().usernames()
+
+    async def update(self, problems):
+        if not hasattr(self, 'failed'):
+            self.failed = True
+            raise ConnectionResetError
+        await super().update(problems)
+
+
+class CompletedStepsTest(util.TestCase):
+
+    def test_reused_on_redelivery(self):
+        server = util.FakeServerHost()
+        problems = {ni_abc.Status.not_signed: frozenset({'brettcannon'})}
+        cla = FakeCLAHost(problems)
+        contrib = FailingUpdateContribHost(['brettcannon'])
+        completed = __main__.CompletedSteps()
+        with mock.patch('ni.__main__.ContribHost', contrib):
+            responder = __main__.handler(util.FakeSession, server, cla,
+                                         completed=completed)
+            failed = self.run_awaitable(responder(util.FakeRequest()))
+            del cla.usernames
+            redelivered = self.run_awaitable(responder(util.FakeRequest()))
+        self.assertEqual(failed.status, http.HTTPStatus.INTERNAL_SERVER_ERROR)
+        self.assertEqual(redelivered.status, http.HTTPStatus.OK)
+        self.assertEqual(contrib.listed, 1)
+        self.assertFalse(hasattr(cla, 'usernames'))
+        self.assertEqual(contrib.problems, problems)
+        self.assertEqual(completed.reused, 1)
+        # Once handled, the steps are forgotten.
+        self.assertFalse(completed)
+
+    def test_expiry(self):
+        completed = __main__.CompletedSteps(ttl=0)
+        completed.keep('12345', __main__.Steps(usernames=frozenset()))
+        self.assertFalse(completed)
+        self.assertEqual(completed.pop('12345'), __main__.Steps())
+
+    def test_size(self):
+        completed = __main__.CompletedSteps(size=1)
+        completed.keep('1', __main__.Steps(usernames=frozenset({'a'})))
+        completed.keep('2', __main__.Steps(usernames=frozenset({'b'})))
+        self.assertEqual(completed.pop('1'), __main__.Steps())
+        self.assertEqual(completed.pop('2').usernames, {'b'})
+        # Nothing is kept for a delivery which failed before any step.
+        completed.keep('3', __main__.Steps())
+        self.assertFalse(completed)
+
+
+class BlockingContribHost(FakeContribHost):
+
+    """Wait to be let through while listing usernames."""
+
+    def __init__(self, usernames=[]):
+        super().__init__(usernames)
+        self._listing = self._proceed = None
+
+    # The events are created under the running loop, as before Python 3.10
+    # an Event is bound to the loop current when it is created.
+
+    @property
+    def listing(self):
+        if self._listing is None:
+            self._listing = asyncio.Event()
+        return self._listing
+
+    @property
+    def proceed(self):
+        if self._proceed is None:
+            self._proceed = asyncio.Event()
+        return self._proceed
+
+    async def usernames(self):
+        self.listing.set()
+        await self.proceed.wait()
+        return await super().usernames()
+
+
+class PriorityContribHost(BlockingContribHost):
+
+    """Give requests the priorities listed, in the order they arrive."""
+
+    def __init__(self, usernames, priorities):
+        super().__init__(usernames)
+        self.priorities = iter(priorities)
+
+    def priority(self, server, request):
+        request['priority'] = next(self.priorities)
+        return request['priority']
+
+    def dump(self, request):
+        return request['priority'].name, b''
+
+
+class CoalescingContribHost(BlockingContribHost):
+
+    """Have every request be for the same contribution."""
+
+    def contribution_key(self, request):
+        return 'pull/1'
+
+
+class SheddingTest(util.TestCase):
+
+    def test_shed(self):
+        server = util.FakeServerHost()
+        contrib = PriorityContribHost(['brettcannon'], [ni_abc.Priority.normal,
+                                                        ni_abc.Priority.low,
+                                                        ni_abc.Priority.high])
+        fair_scheduler = __main__.scheduler.FairScheduler(concurrency=1, queue_size=1)
+        async def handle():
+            responder = __main__.handler(util.FakeSession, server, FakeCLAHost({}),
+                                         fair_scheduler=fair_scheduler)
+            first = asyncio.ensure_future(responder(util.FakeRequest()))
+            await contrib.listing.wait()
+            low = asyncio.ensure_future(responder(util.FakeRequest()))
+            await asyncio.sleep(0)
+            # Too much is waiting; the least important request makes room.
+            high = asyncio.ensure_future(responder(util.FakeRequest()))
+            shed = await low
+            contrib.proceed.set()
+            return shed, await first, await high
+        with mock.patch('ni.__main__.ContribHost', contrib):
+            shed, first, high = self.run_awaitable(handle())
+        self.assertEqual(shed.status, http.HTTPStatus.SERVICE_UNAVAILABLE)
+        self.assertEqual(shed.headers['Retry-After'], str(__main__.SHED_RETRY_AFTER))
+        self.assertEqual((first.status, high.status), (http.HTTPStatus.OK,) * 2)
+        self.assertFalse(hasattr(server, 'logged_exc'))
+        self.assertTrue(any('Turned away' in message for message in server.logged))
+        tiers = fair_scheduler.tier_stats()
+        self.assertEqual(tiers[ni_abc.Priority.low]['shed'], 1)
+        self.assertEqual(tiers[ni_abc.Priority.high]['shed'], 0)
+        self.assertIsNotNone(tiers[ni_abc.Priority.high]['p99'])
+
+    def test_shed_kept(self):
+        # The contribution host doesn't deliver a shed request again, so it's
+        # kept to be handled again, and left in the journal to be replayed.
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        server = util.FakeServerHost()
+        contrib = PriorityContribHost(['brettcannon'], [ni_abc.Priority.normal,
+                                                        ni_abc.Priority.low,
+                                                        ni_abc.Priority.high])
+        fair_scheduler = __main__.scheduler.FairScheduler(concurrency=1, queue_size=1)
+        deliveries = journal.Journal(directory.name)
+        deliveries.open()
+        kept = __main__.ShedDeliveries()
+        async def handle():
+            responder = __main__.handler(util.FakeSession, server, FakeCLAHost({}),
+                                         fair_scheduler=fair_scheduler,
+                                         deliveries=deliveries, shed=kept)
+            first = asyncio.ensure_future(responder(util.FakeRequest()))
+            await contrib.listing.wait()
+            low = asyncio.ensure_future(responder(util.FakeRequest()))
+            # Journaling the request takes a write.
+            while not fair_scheduler.queued:
+                await asyncio.sleep(0.001)
+            high = asyncio.ensure_future(responder(util.FakeRequest()))
+            shed = await low
+            contrib.proceed.set()
+            await asyncio.gather(first, high)
+            await deliveries.close()
+            return shed
+        with mock.patch('ni.__main__.ContribHost', contrib):
+            shed = self.run_awaitable(handle())
+        self.assertEqual(shed.status, http.HTTPStatus.ACCEPTED)
+        reopened = journal.Journal(directory.name)
+        entries = reopened.open()
+        self.run_awaitable(reopened.close())
+        self.assertEqual([key for _, key, _ in entries], ['low'])
+        # Handling it again reuses its journal entry.
+        self.assertEqual(kept.take(), [(entries[0][0], 'low', b'')])
+
+    def test_shed_bounded(self):
+        kept = __main__.ShedDeliveries(size=2)
+        for n in range(3):
+            kept.keep(None, str(n), b'')
+        self.assertEqual(kept.stats(), {'kept': 2, 'retried': 0, 'dropped': 1})
+        self.assertEqual([key for _, key, _ in kept.take()], ['1', '2'])
+        self.assertEqual(kept.stats(), {'kept': 0, 'retried': 2, 'dropped': 1})
+
+    def test_shed_retried(self):
+        # Shed requests are handled again once nothing is waiting.
+        server = util.FakeServerHost()
+        contrib = JournalingContribHost()
+        fair_scheduler = __main__.scheduler.FairScheduler()
+        kept = __main__.ShedDeliveries()
+        kept.keep(None, 'one', b'one')
+        async def retry():
+            responder = __main__.handler(util.FakeSession, server, FakeCLAHost({}),
+                                         fair_scheduler=fair_scheduler)
+            fair_scheduler.queued = 1
+            retrying = asyncio.ensure_future(
+                kept.retry(server, fair_scheduler, responder, interval=0.001))
+            await asyncio.sleep(0.01)
+            waited = not hasattr(contrib, 'processed')
+            fair_scheduler.queued = 0
+            while not hasattr(contrib, 'processed'):
+                await asyncio.sleep(0.001)
+            retrying.cancel()
+            await asyncio.gather(retrying, return_exceptions=True)
+            return waited
+        with mock.patch('ni.__main__.ContribHost', contrib):
+            self.assertTrue(self.run_awaitable(retry()))
+        self.assertEqual(contrib.processed, ['one'])
+        self.assertEqual(contrib.problems, {})
+        self.assertEqual(kept.stats()['retried'], 1)
+
+    def test_superseded(self):
+        server = util.FakeServerHost()
+        contrib = CoalescingContribHost(['brettcannon'])
+        fair_scheduler = __main__.scheduler.FairScheduler(concurrency=1)
+        async def handle():
+            responder = __main__.handler(util.FakeSession, server, FakeCLAHost({}),
+                                         fair_scheduler=fair_scheduler)
+            first = asyncio.ensure_future(responder(util.FakeRequest()))
+            await contrib.listing.wait()
+            older = asyncio.ensure_future(responder(util.FakeRequest()))
+            await asyncio.sleep(0)
+            # Only the newest request for the contribution is worth processing.
+            newer = asyncio.ensure_future(responder(util.FakeRequest()))
+            dropped = await older
+            contrib.proceed.set()
+            return dropped, await first, await newer
+        with mock.patch('ni.__main__.ContribHost', contrib):
+            dropped, first, newer = self.run_awaitable(handle())
+        self.assertEqual(dropped.status, http.HTTPStatus.ACCEPTED)
+        self.assertEqual((first.status, newer.status), (http.HTTPStatus.OK,) * 2)
+        self.assertFalse(hasattr(server, 'logged_exc'))
+        self.assertTrue(any('Dropped' in message for message in server.logged))
+        self.assertEqual(fair_scheduler.tier_stats()[ni_abc.Priority.normal]['superseded'], 1)
+
+
+class AdminTest(util.TestCase):
+
+    def setUp(self):
+        self.server = util.FakeServerHost()
+        self.server.admin = 'secret'
+
+    def test_in_flight(self):
+        in_flight = __main__.InFlight()
+        with in_flight.track() as enter:
+            enter('queued', 'python/cpython')
+            with in_flight.track():
+                stats = in_flight.stats()
+        self.assertEqual(stats['in_flight'], 2)
+        self.assertEqual(stats['stages'], {'queued': 1, 'screening': 1})
+        self.assertEqual([delivery['group'] for delivery in stats['oldest']],
+                         ['python/cpython', ''])
+        self.assertGreaterEqual(stats['oldest'][0]['elapsed'],
+                                stats['oldest'][0]['in_stage'])
+        stats = in_flight.stats()
+        self.assertEqual((stats['handled'], stats['in_flight'], stats['stages']),
+                         (2, 0, {}))
+
+    def test_stage_while_handling(self):
+        in_flight = __main__.InFlight()
+        contrib = BlockingContribHost(['brettcannon'])
+        async def handle():
+            responder = __main__.handler(util.FakeSession, self.server, FakeCLAHost({}),
+                                         in_flight=in_flight)
+            responding = asyncio.ensure_future(responder(util.FakeRequest()))
+            await contrib.listing.wait()
+            stages = dict(in_flight.stats()['stages'])
+            contrib.proceed.set()
+            await responding
+            return stages
+        with mock.patch('ni.__main__.ContribHost', contrib):
+            stages = self.run_awaitable(handle())
+        self.assertEqual(stages, {'usernames': 1})
+        self.assertEqual(in_flight.stats()['handled'], 1)
+
+    def request(self, headers, pool=None, fair_scheduler=None, shed=None):
+        respond = __main__.admin(self.server, FakeCLAHost({}), pool or __main__.ClientPool(),
+                                 fair_scheduler or __main__.scheduler.FairScheduler(),
+                                 __main__.InFlight(), shed=shed)
+        app = web.Application()
+        app.router.add_route(*__main__.ADMIN_ROUTE, respond)
+        async def fetch():
+            async with test_utils.TestClient(test_utils.TestServer(app)) as client:
+                response = await client.get(__main__.ADMIN_ROUTE[1], headers=headers)
+                return response.status, await response.read()
+        return self.run_awaitable(fetch())
+
+    def test_unauthorized(self):
+        for headers in ({}, {'Authorization': 'Bearer wrong'}):
+            status, _ = self.request(headers)
+            self.assertEqual(status, http.HTTPStatus.UNAUTHORIZED)
+
+    def test_report(self):
+        status, body = self.request({'Authorization': 'Bearer secret'},
+                                    shed=__main__.ShedDeliveries())
+        self.assertEqual(status, http.HTTPStatus.OK)
+        report = json.loads(body)
+        self.assertEqual(report['deliveries']['in_flight'], 0)
+        self.assertEqual(report['scheduler'], {'running': 0, 'queued': 0, 'groups': {},
+                                               'tiers': {}})
+        self.assertEqual(report['pool']['requests'], 0)
+        self.assertIn('tokens', report['retries'])
+        self.assertNotIn('journal', report)
+        self.assertEqual(report['shed'], {'kept': 0, 'retried': 0, 'dropped': 0})
+
+    def test_tiers(self):
+        fair_scheduler = __main__.scheduler.FairScheduler()
+        async def work():
+            async with fair_scheduler.slot('python/cpython', ni_abc.Priority.high):
+                pass
+        self.run_awaitable(work())
+        _, body = self.request({'Authorization': 'Bearer secret'},
+                               fair_scheduler=fair_scheduler)
+        tiers = json.loads(body)['scheduler']['tiers']
+        self.assertEqual(list(tiers), ['high'])
+        self.assertEqual((tiers['high']['queued'], tiers['high']['shed']), (0, 0))
+        self.assertIn('p99', tiers['high'])
+
+    def test_no_token(self):
+        # Without a token the route isn't served at all.
+        app = __main__.create_app(util.FakeServerHost())
+        self.assertNotIn(__main__.ADMIN_ROUTE[1],
+                         {resource.canonical for resource in app.router.resources()})
+        app = __main__.create_app(self.server)
+        self.assertIn(__main__.ADMIN_ROUTE[1],
+                      {resource.canonical for resource in app.router.resources()})
+
+    def test_pool_counters(self):
+        async def hello(request):
+            return web.Response(text='Hello')
+        app = web.Application()
+        app.router.add_get('/hello', hello)
+        pool = __main__.ClientPool()
+        async def fetch():
+            await pool.open(None)
+            async with test_utils.TestServer(app) as test_server:
+                for _ in range(2):
+                    async with pool() as client:
+                        async with client.get(test_server.make_url('/hello')) as response:
+                            await response.read()
+            await pool.close(None)
+        self.run_awaitable(fetch())
+        stats = pool.stats()
+        self.assertEqual((stats['requests'], stats['waiting']), (0, 0))
+        # The second request reuses the connection of the first.
+        self.assertEqual((stats['created'], stats['reused']), (1, 1))
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import tempfile
+import time
+
+from .. import monitor
+from . import util
+
+
+def blocking(seconds):
+    """Hold up the event loop."""
+    time.sleep(seconds)
+
+
+async def respond(blocks, seconds):
+    for _ in range(blocks):
+        blocking(seconds)
+        await asyncio.sleep(0)
+
+
+class LoopMonitorTests(util.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.server = util.FakeServerHost()
+
+    def monitored(self, awaitable, **kwargs):
+        kwargs = dict(dict(threshold=0.05, interval=0.01, profile_seconds=0.2,
+                           sample_interval=0.002), **kwargs)
+        loop_monitor = monitor.LoopMonitor(self.server, self.directory, **kwargs)
+        async def run():
+            await loop_monitor.start(None)
+            try:
+                await awaitable
+            finally:
+                await loop_monitor.stop(None)
+        self.run_awaitable(run())
+        return loop_monitor
+
+    def files(self, kind):
+        paths = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(kind))
+        contents = []
+        for path in paths:
+            with open(os.path.join(self.directory, path), encoding='utf-8') as file:
+                contents.append(file.read())
+        return contents
+
+    def test_no_stall(self):
+        loop_monitor = self.monitored(asyncio.sleep(0.2))
+        self.assertEqual(loop_monitor.stalls, 0)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertLess(loop_monitor.stats()['max_lag'], 0.05)
+
+    def test_stall(self):
+        async def stall():
+            await respond(1, 0.3)
+            # Let the heartbeat catch up.
+            await asyncio.sleep(0.05)
+        loop_monitor = self.monitored(stall())
+        self.assertEqual(loop_monitor.stalls, 1)
+        self.assertGreaterEqual(loop_monitor.max_lag, 0.25)
+        stall, = self.files('stall')
+        # The stack goes from the blocking coroutine to the blocking call.
+        self.assertIn('in respond', stall)
+        self.assertIn('blocking(seconds)', stall)
+        self.assertIn('time.sleep(seconds)', stall)
+        self.assertTrue(any('stalled' in message for message in self.server.logged))
+
+    def test_profile(self):
+        loop_monitor = self.monitored(respond(10, 0.06), focus=respond.__code__)
+        self.assertGreaterEqual(loop_monitor.stalls, 1)
+        # Stalls keep coming after the first profile, so there may be more.
+        profiles = self.files('profile')
+        self.assertGreaterEqual(len(profiles), 1)
+        self.assertEqual(loop_monitor.profiles, len(profiles))
+        self.assertGreater(loop_monitor.samples, 0)
+        stacks = [line.rpartition(' ')[0] for line in ''.join(profiles).splitlines()]
+        self.assertTrue(all('respond (' in stack for stack in stacks))
+        self.assertTrue(any(stack.split(';')[-1].startswith('blocking (')
+                            for stack in stacks))
+
+    def test_profile_focus(self):
+        async def elsewhere():
+            blocking(0.1)
+            await asyncio.sleep(0.1)
+        # Samples outside of the focus are discarded.
+        loop_monitor = self.monitored(elsewhere(), focus=respond.__code__)
+        self.assertEqual(loop_monitor.stalls, 1)
+        self.assertEqual(loop_monitor.samples, 0)
+        self.assertEqual(self.files('profile'), [''])
+
+    def test_overhead(self):
+        async def busy():
+            deadline = time.monotonic() + 0.5
+            while time.monotonic() < deadline:
+                blocking(0.001)
+                await asyncio.sleep(0)
+        loop_monitor = self.monitored(busy(), interval=monitor.HEARTBEAT_INTERVAL,
+                                      threshold=monitor.LAG_THRESHOLD)
+        self.assertEqual(loop_monitor.stalls, 0)
+        self.assertLess(loop_monitor.overhead(), 0.01)
+        self.assertIn('overhead', loop_monitor.stats())
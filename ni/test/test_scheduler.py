@@ -0,0 +1,179 @@
+import asyncio
+import unittest
+
+from .. import scheduler
+from . import util
+
+
+class FairSchedulerTests(util.TestCase):
+
+    def run_jobs(self, fair, jobs):
+        """Run the (group, name[, tier[, key]]) jobs, returning the order they
+        started in.
+        """
+        started = []
+        release = None
+
+        async def job(group, name, tier=0, key=None):
+            try:
+                async with fair.slot(group, tier, key):
+                    started.append(name)
+                    await release.wait()
+            except scheduler.Shed:
+                started.append(f'shed {name}')
+            except scheduler.Superseded:
+                started.append(f'superseded {name}')
+
+        async def main():
+            nonlocal release
+            release = asyncio.Event()
+            tasks = []
+            for job_args in jobs:
+                tasks.append(asyncio.ensure_future(job(*job_args)))
+                # Let the job queue up before the next one arrives.
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            release.set()
+            await asyncio.gather(*tasks)
+
+        self.run_awaitable(main())
+        return started
+
+    def test_round_robin(self):
+        # A burst from one repository doesn't delay a quiet one.
+        fair = scheduler.FairScheduler(concurrency=1)
+        jobs = [('busy', f'busy{n}') for n in range(4)] + [('quiet', 'quiet')]
+        started = self.run_jobs(fair, jobs)
+        self.assertEqual(started, ['busy0', 'busy1', 'quiet', 'busy2', 'busy3'])
+        self.assertEqual(fair.stats(), {})
+        self.assertEqual(fair.running, 0)
+
+    def test_weights(self):
+        fair = scheduler.FairScheduler(concurrency=1, weights={'heavy': 2})
+        jobs = ([('heavy', f'heavy{n}') for n in range(4)]
+                + [('light', f'light{n}') for n in range(2)])
+        started = self.run_jobs(fair, jobs)
+        self.assertEqual(started,
+                         ['heavy0', 'heavy1', 'heavy2', 'light0', 'heavy3', 'light1'])
+
+    def test_group_concurrency(self):
+        fair = scheduler.FairScheduler(concurrency=10, group_concurrency=2)
+
+        async def main():
+            release = asyncio.Event()
+
+            async def job(group):
+                async with fair.slot(group):
+                    await release.wait()
+
+            tasks = [asyncio.ensure_future(job('busy')) for _ in range(5)]
+            tasks.append(asyncio.ensure_future(job('quiet')))
+            await asyncio.sleep(0)
+            stats = fair.stats()
+            release.set()
+            await asyncio.gather(*tasks)
+            return stats
+
+        stats = self.run_awaitable(main())
+        self.assertEqual(stats, {'busy': {'queued': 3, 'running': 2},
+                                 'quiet': {'queued': 0, 'running': 1}})
+
+    def test_cancelled_while_waiting(self):
+        fair = scheduler.FairScheduler(concurrency=1)
+
+        async def main():
+            release = asyncio.Event()
+
+            async def job():
+                async with fair.slot('group'):
+                    await release.wait()
+
+            first = asyncio.ensure_future(job())
+            second = asyncio.ensure_future(job())
+            await asyncio.sleep(0)
+            second.cancel()
+            await asyncio.sleep(0)
+            release.set()
+            await first
+            self.assertTrue(second.cancelled())
+
+        self.run_awaitable(main())
+        self.assertEqual(fair.stats(), {})
+        self.assertEqual(fair.running, 0)
+
+    def test_tiers(self):
+        # More important work starts first, whatever the group.
+        fair = scheduler.FairScheduler(concurrency=1)
+        jobs = [('busy', 'first', 1), ('busy', 'low', 2), ('quiet', 'normal', 1),
+                ('busy', 'high', 0)]
+        started = self.run_jobs(fair, jobs)
+        self.assertEqual(started, ['first', 'high', 'normal', 'low'])
+        stats = fair.tier_stats()
+        self.assertEqual(sorted(stats), [0, 1, 2])
+        self.assertEqual([stats[tier]['queued'] for tier in stats], [0, 0, 0])
+        self.assertIsNotNone(stats[2]['p99'])
+
+    def test_group_concurrency_across_tiers(self):
+        # A group at its limit lets lower tiers of other groups start.
+        fair = scheduler.FairScheduler(concurrency=2, group_concurrency=1)
+        jobs = [('busy', 'busy0', 0), ('busy', 'busy1', 0), ('quiet', 'quiet', 1)]
+        started = self.run_jobs(fair, jobs)
+        self.assertEqual(started, ['busy0', 'quiet', 'busy1'])
+
+    def test_shed_lowest_tier(self):
+        fair = scheduler.FairScheduler(concurrency=1, queue_size=2)
+        jobs = [('a', 'running', 0), ('a', 'low', 2), ('a', 'normal', 1),
+                # The queue is full of work at least as important.
+                ('b', 'late', 2),
+                # Less important work makes room.
+                ('b', 'high', 0)]
+        started = self.run_jobs(fair, jobs)
+        self.assertEqual(started, ['running', 'shed late', 'shed low', 'high', 'normal'])
+        stats = fair.tier_stats()
+        self.assertEqual(stats[2]['shed'], 2)
+        self.assertEqual(stats[0]['shed'], 0)
+        self.assertEqual(fair.queued, 0)
+        self.assertEqual(fair.running, 0)
+
+    def test_shed_busiest_group(self):
+        # Within a tier, the busiest group loses its newest work.
+        fair = scheduler.FairScheduler(concurrency=1, queue_size=4)
+        jobs = ([('busy', 'running')] + [('busy', f'busy{n}') for n in range(3)]
+                + [('quiet', 'quiet0'), ('quiet', 'quiet1')])
+        started = self.run_jobs(fair, jobs)
+        self.assertEqual(started, ['running', 'shed busy2', 'busy0', 'quiet0', 'busy1',
+                                   'quiet1'])
+
+    def test_superseded(self):
+        # Only the newest of the jobs waiting with a key is done, in the more
+        # important of their tiers.
+        fair = scheduler.FairScheduler(concurrency=1)
+        jobs = [('a', 'running', 0, 'pull/1'), ('a', 'older', 1, 'pull/1'),
+                ('a', 'other', 1, 'pull/2'), ('b', 'normal', 1),
+                ('a', 'newer', 2, 'pull/1')]
+        started = self.run_jobs(fair, jobs)
+        self.assertEqual(started, ['running', 'superseded older', 'other', 'normal',
+                                   'newer'])
+        stats = fair.tier_stats()
+        self.assertEqual(stats[1]['superseded'], 1)
+        self.assertNotIn(2, stats)
+        self.assertEqual(fair.queued, 0)
+        self.assertEqual(fair._keys, {})
+
+    def test_superseded_not_shed(self):
+        # Work which was superseded frees its place in the queue.
+        fair = scheduler.FairScheduler(concurrency=1, queue_size=1)
+        jobs = [('a', 'running'), ('a', 'older', 0, 'pull/1'), ('a', 'newer', 0, 'pull/1')]
+        started = self.run_jobs(fair, jobs)
+        self.assertEqual(started, ['running', 'superseded older', 'newer'])
+        self.assertEqual(fair.tier_stats()[0]['shed'], 0)
+
+    def test_unbounded_without_waiting(self):
+        # Work which starts straight away never counts against the queue.
+        fair = scheduler.FairScheduler(concurrency=2, queue_size=0)
+        started = self.run_jobs(fair, [('a', 'first'), ('b', 'second'), ('c', 'third')])
+        self.assertEqual(started, ['first', 'second', 'shed third'])
+
+
+if __name__ == '__main__':
+    unittest.main()
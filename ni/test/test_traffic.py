@@ -0,0 +1,158 @@
+import json
+import tempfile
+import time
+from unittest import mock
+
+from aiohttp import test_utils, web
+
+from .. import __main__
+from .. import bpo
+from . import test_main
+from . import traffic
+from . import util
+
+
+CHECK_URL = ('https://bugs.python.org/user?@template=clacheck'
+             '&github_names=brettcannon')
+USERNAMES_URL = 'https://example.com/usernames'
+
+
+class UpstreamContribHost(test_main.FakeContribHost):
+
+    """Find the usernames upstream, replaying deliveries by their key."""
+
+    def dump(self, request):
+        if 'key' not in request:
+            return None
+        return request['key'], request['key'].encode('ascii')
+
+    def load(self, data):
+        return {'key': data.decode('ascii')}
+
+    async def process(self, server, request, session):
+        self.session = session
+        return self
+
+    async def usernames(self):
+        async with self.session.get(USERNAMES_URL) as response:
+            return frozenset(await response.json())
+
+
+def exchange(method, url, data, latency=0.0, status=200):
+    return traffic.Exchange(method, url, status, [('Content-Type', 'application/json')],
+                            json.dumps(data).encode('utf-8'), latency)
+
+
+class RecordingTests(util.TestCase):
+
+    def test_recording_session(self):
+        async def hello(request):
+            return web.Response(text='Hello')
+        app = web.Application()
+        app.router.add_get('/hello', hello)
+        recorder = traffic.Recorder()
+        # Sessions are traced by the connection pool as well.
+        pool = __main__.ClientPool(recorder.session)
+        async def record():
+            async with test_utils.TestServer(app) as server, pool() as session:
+                url = server.make_url('/hello')
+                async with session.get(url) as response:
+                    body = await response.text()
+            return str(url), body
+        url, body = self.run_awaitable(record())
+        # The caller can still read the response.
+        self.assertEqual(body, 'Hello')
+        recorded, = recorder.exchanges
+        self.assertEqual((recorded.method, recorded.url, recorded.status, recorded.body),
+                         ('GET', url, 200, b'Hello'))
+        self.assertGreater(recorded.latency, 0)
+        self.assertIn(('Content-Type', 'text/plain; charset=utf-8'), recorded.headers)
+        self.assertEqual(pool.stats()['created'], 1)
+
+    def test_middleware(self):
+        async def handle(request):
+            if request.query.get('screened'):
+                request['key'] = 'delivery'
+            return web.Response()
+        recorder = traffic.Recorder()
+        app = web.Application(middlewares=[recorder.middleware])
+        app.router.add_post('/', handle)
+        async def deliver():
+            async with test_utils.TestClient(test_utils.TestServer(app)) as client:
+                await client.post('/')
+                await client.post('/?screened=1')
+        with mock.patch('ni.test.traffic.ContribHost', UpstreamContribHost()):
+            self.run_awaitable(deliver())
+        delivery, = recorder.deliveries
+        self.assertEqual((delivery.key, delivery.data), ('delivery', b'delivery'))
+        self.assertGreater(delivery.offset, 0)
+
+    def test_save_load(self):
+        deliveries = [traffic.Delivery(1.5, '12345', b'\x00{}')]
+        exchanges = [exchange('GET', USERNAMES_URL, ['brettcannon'], 0.25)]
+        with tempfile.TemporaryDirectory() as directory:
+            traffic.save(directory, deliveries, exchanges)
+            self.assertEqual(traffic.load(directory), (deliveries, exchanges))
+
+
+class ReplayTests(util.TestCase):
+
+    def test_replay_session(self):
+        session = traffic.ReplaySession([
+            exchange('GET', USERNAMES_URL, ['first']),
+            exchange('GET', USERNAMES_URL, ['second']),
+        ], scale=0)
+        async def fetch(method='GET', url=USERNAMES_URL):
+            async with session.request(method, url) as response:
+                return response.status, await response.json()
+        results = [self.run_awaitable(fetch()) for _ in range(3)]
+        # The last exchange is repeated once they run out.
+        self.assertEqual(results, [(200, ['first']), (200, ['second']),
+                                   (200, ['second'])])
+        self.assertEqual(self.run_awaitable(fetch('POST')), (404, {}))
+        self.assertEqual(session.unmatched, [('POST', USERNAMES_URL)])
+        self.assertEqual(session.call_counts(), {'GET example.com': 3,
+                                                 'POST example.com': 1})
+
+    def test_latency_scaled(self):
+        session = traffic.ReplaySession(
+            [exchange('GET', USERNAMES_URL, [], latency=1.0)], scale=0.05)
+        async def fetch():
+            async with session.get(USERNAMES_URL) as response:
+                return await response.read()
+        started = time.monotonic()
+        self.run_awaitable(fetch())
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(session.calls, [('GET', USERNAMES_URL, 0.05)])
+
+    def test_replay_deliveries(self):
+        server = util.FakeServerHost()
+        session = traffic.ReplaySession([
+            exchange('GET', USERNAMES_URL, ['brettcannon'], latency=0.5),
+            exchange('GET', CHECK_URL, {'brettcannon': True}, latency=1.0),
+        ], scale=0.01)
+        deliveries = [traffic.Delivery(offset, str(offset), str(offset).encode('ascii'))
+                      for offset in (0.0, 1.0, 1.0, 3.0)]
+        contrib = UpstreamContribHost()
+        # Every delivery checks with b.p.o rather than the cache.
+        with mock.patch('ni.__main__.ContribHost', contrib), \
+                mock.patch('ni.test.traffic.ContribHost', contrib), \
+                mock.patch('ni.bpo.SIGNED_TTL', 0.0):
+            respond = __main__.handler(session, server, bpo.Host(server))
+            started = time.monotonic()
+            report = self.run_awaitable(traffic.replay(deliveries, respond, scale=0.01))
+        # The last delivery arrives 3 seconds in, taking 1.5 seconds; all
+        # accelerated a hundredfold.
+        self.assertGreaterEqual(time.monotonic() - started, 0.045)
+        self.assertEqual(report.statuses, {200: 4})
+        self.assertEqual(report.summary()['deliveries'], 4)
+        self.assertGreaterEqual(min(report.latencies), 0.015)
+        self.assertEqual(session.call_counts(), {'GET example.com': 4,
+                                                 'GET bugs.python.org': 4})
+        self.assertEqual(contrib.problems, {})
+
+    def test_percentile(self):
+        values = [float(n) for n in range(1, 101)]
+        self.assertEqual(traffic.percentile(values, 0.5), 51.0)
+        self.assertEqual(traffic.percentile(values, 0.99), 100.0)
+        self.assertNotEqual(traffic.percentile([], 0.5), traffic.percentile([], 0.5))
@@ -0,0 +1,215 @@
+import asyncio
+import datetime
+import time
+from unittest import mock
+
+from .. import upstream
+from . import util
+
+
+def warmed(latency, count=upstream.MIN_SAMPLES, **kwargs):
+    """Create an upstream which has seen the latency count times."""
+    service = upstream.Upstream('example.com', **kwargs)
+    for _ in range(count):
+        service.calls += 1
+        service.record(latency)
+    return service
+
+
+class Slow:
+
+    """A request which takes the given times for each successive attempt."""
+
+    def __init__(self, *delays, result='done'):
+        self.delays = list(delays)
+        self.result = result
+        self.attempts = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        delay = self.delays[self.attempts]
+        self.attempts += 1
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(self.result, Exception):
+            raise self.result
+        return f'{self.result} {self.attempts}'
+
+
+class UpstreamTests(util.TestCase):
+
+    def test_default_timeout(self):
+        service = warmed(0.5, count=upstream.MIN_SAMPLES - 1)
+        self.assertEqual(service.timeout(), upstream.DEFAULT_TIMEOUT)
+        self.assertIsNone(service.percentile(0.5))
+
+    def test_adaptive_timeout(self):
+        self.assertEqual(warmed(0.5).timeout(), 0.5 * upstream.TIMEOUT_FACTOR)
+        self.assertEqual(warmed(0.001).timeout(), upstream.MIN_TIMEOUT)
+        self.assertEqual(warmed(60).timeout(), upstream.MAX_TIMEOUT)
+
+    def test_percentile(self):
+        service = upstream.Upstream('example.com')
+        for latency in range(100):
+            service.record(latency)
+        self.assertEqual(service.percentile(0.5), 50)
+        self.assertEqual(service.percentile(0.99), 99)
+        # Refreshed once enough new samples come in.
+        for _ in range(upstream.REFRESH_INTERVAL):
+            service.record(1000)
+        self.assertEqual(service.percentile(0.99), 1000)
+
+    def test_call(self):
+        service = upstream.Upstream('example.com')
+        result = self.run_awaitable(service.call(Slow(0)))
+        self.assertEqual(result, 'done 1')
+        self.assertEqual(service.stats()['calls'], 1)
+
+    def test_timeout(self):
+        service = warmed(0.001)
+        service.timeout = lambda: 0.01
+        request = Slow(1)
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_awaitable(service.call(request))
+        self.assertEqual(request.cancelled, 1)
+        self.assertEqual(service.timeouts, 1)
+
+    def test_failure(self):
+        service = upstream.Upstream('example.com')
+        with self.assertRaises(ValueError):
+            self.run_awaitable(service.call(Slow(0, result=ValueError())))
+
+    def test_hedged(self):
+        service = warmed(0.01, count=100, hedge_budget=0.05)
+        request = Slow(1, 0)
+        result = self.run_awaitable(service.call(request, hedge=True))
+        # The hedge wins and the slow first attempt is abandoned.
+        self.assertEqual(result, 'done 2')
+        self.assertEqual(request.cancelled, 1)
+        self.assertEqual(service.hedges, 1)
+
+    def test_hedge_budget(self):
+        service = warmed(0.01, count=100, hedge_budget=0.01)
+        service.hedges = 1
+        request = Slow(0.05, 0)
+        self.assertEqual(self.run_awaitable(service.call(request, hedge=True)), 'done 1')
+        self.assertEqual(request.attempts, 1)
+
+    def test_not_hedged(self):
+        service = warmed(0.01, count=100, hedge_budget=1)
+        request = Slow(0.05, 0)
+        self.assertEqual(self.run_awaitable(service.call(request)), 'done 1')
+        self.assertEqual(request.attempts, 1)
+
+    def test_hedge_after_failure(self):
+        # A failed attempt doesn't fail the call while the other may succeed.
+        service = warmed(0.01, count=100, hedge_budget=0.05)
+        attempts = []
+        async def request():
+            attempts.append(None)
+            if len(attempts) == 1:
+                await asyncio.sleep(0.05)
+                raise ConnectionError
+            await asyncio.sleep(0.1)
+            return 'hedge'
+        self.assertEqual(self.run_awaitable(service.call(request, hedge=True)), 'hedge')
+
+
+class Flaky:
+
+    """A request which fails with each of the exceptions before succeeding."""
+
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.attempts = 0
+
+    async def __call__(self):
+        self.attempts += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return 'done'
+
+
+@mock.patch('ni.upstream.RETRY_BASE_DELAY', 0.001)
+class RetryTests(util.TestCase):
+
+    def test_retry_after_seconds(self):
+        self.assertEqual(upstream.retry_after({'retry-after': '120'}), 120.0)
+
+    def test_retry_after_date(self):
+        headers = {'retry-after': 'Wed, 21 Oct 2015 07:28:30 GMT'}
+        now = datetime.datetime(2015, 10, 21, 7, 28, tzinfo=datetime.timezone.utc)
+        self.assertEqual(upstream.retry_after(headers, now.timestamp()), 30.0)
+        self.assertIsNone(upstream.retry_after({'retry-after': 'soon'}))
+
+    def test_retry_after_rate_limit(self):
+        headers = {'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '1010'}
+        self.assertEqual(upstream.retry_after(headers, 1000.0), 10.0)
+        headers['x-ratelimit-remaining'] = '5'
+        self.assertIsNone(upstream.retry_after(headers, 1000.0))
+
+    def test_backoff(self):
+        delays = [upstream.backoff(10) for _ in range(100)]
+        self.assertLessEqual(max(delays), upstream.RETRY_MAX_DELAY)
+        self.assertGreaterEqual(min(delays), 0)
+        self.assertLessEqual(upstream.backoff(0), upstream.RETRY_BASE_DELAY)
+
+    def test_budget(self):
+        budget = upstream.RetryBudget(ratio=0.5, reserve=1)
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+        self.assertEqual((budget.retries, budget.exhausted), (2, 2))
+
+    def test_retried(self):
+        service = upstream.Upstream('example.com', budget=upstream.RetryBudget())
+        request = Flaky(upstream.Transient('502'), ConnectionResetError())
+        self.assertEqual(self.run_awaitable(service.call(request, retry=True)), 'done')
+        self.assertEqual(request.attempts, 3)
+        self.assertEqual(service.retries, 2)
+
+    def test_attempts_exhausted(self):
+        service = upstream.Upstream('example.com', budget=upstream.RetryBudget())
+        request = Flaky(*(upstream.Transient(str(n))
+                          for n in range(upstream.RETRY_ATTEMPTS)))
+        with self.assertRaises(upstream.Transient):
+            self.run_awaitable(service.call(request, retry=True))
+        self.assertEqual(request.attempts, upstream.RETRY_ATTEMPTS)
+
+    def test_not_retried(self):
+        service = upstream.Upstream('example.com', budget=upstream.RetryBudget())
+        request = Flaky(upstream.Transient('502'))
+        with self.assertRaises(upstream.Transient):
+            self.run_awaitable(service.call(request))
+        # Permanent failures aren't retried either.
+        request = Flaky(ValueError())
+        with self.assertRaises(ValueError):
+            self.run_awaitable(service.call(request, retry=True))
+        self.assertEqual(request.attempts, 1)
+
+    def test_retry_after_honored(self):
+        service = upstream.Upstream('example.com', budget=upstream.RetryBudget())
+        request = Flaky(upstream.Transient('429', retry_after=0.05))
+        started = time.monotonic()
+        self.run_awaitable(service.call(request, retry=True))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        # Waiting longer than RETRY_MAX_DELAY is left to a later delivery.
+        request = Flaky(upstream.Transient('429', retry_after=upstream.RETRY_MAX_DELAY + 1))
+        with self.assertRaises(upstream.Transient):
+            self.run_awaitable(service.call(request, retry=True))
+        self.assertEqual(request.attempts, 1)
+
+    def test_budget_exhausted(self):
+        budget = upstream.RetryBudget(reserve=1)
+        service = upstream.Upstream('example.com', budget=budget)
+        request = Flaky(upstream.Transient('502'), upstream.Transient('502'))
+        with self.assertRaises(upstream.Transient):
+            self.run_awaitable(service.call(request, retry=True))
+        self.assertEqual(request.attempts, 2)
+        self.assertEqual(budget.exhausted, 1)
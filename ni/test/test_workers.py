@@ -0,0 +1,113 @@
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import urllib.request
+
+from .. import workers
+from . import util
+
+
+async def gather(*coroutines):
+    return await asyncio.gather(*coroutines)
+
+
+class ContributionLocksTests(util.TestCase):
+
+    async def record(self, locks, key, log, delay=0.01):
+        async with locks.hold(key):
+            log.append(('start', key))
+            await asyncio.sleep(delay)
+            log.append(('end', key))
+
+    def test_same_key_serialized(self):
+        locks = workers.ContributionLocks()
+        log = []
+        self.run_awaitable(gather(self.record(locks, 'a', log),
+                                          self.record(locks, 'a', log)))
+        self.assertEqual(log, [('start', 'a'), ('end', 'a')] * 2)
+        # Locks are discarded once nothing holds them.
+        self.assertEqual(locks._locks, {})
+
+    def test_different_keys_concurrent(self):
+        locks = workers.ContributionLocks()
+        log = []
+        self.run_awaitable(gather(self.record(locks, 'a', log),
+                                          self.record(locks, 'b', log)))
+        self.assertEqual(log[:2], [('start', 'a'), ('start', 'b')])
+
+    def test_cross_process(self):
+        # Separate ContributionLocks objects stand in for separate processes.
+        with tempfile.TemporaryDirectory() as directory:
+            first = workers.ContributionLocks(directory)
+            second = workers.ContributionLocks(directory)
+            log = []
+            self.run_awaitable(gather(self.record(first, 'a', log, 0.1),
+                                              self.record(second, 'a', log)))
+        self.assertEqual(log, [('start', 'a'), ('end', 'a')] * 2)
+
+
+SERVE_SCRIPT = """
+import sys
+from aiohttp import web
+from ni import workers
+from ni.test import util
+
+async def pid(request):
+    import os
+    return web.Response(text=str(os.getpid()))
+
+def create_app():
+    app = web.Application()
+    app.router.add_get('/', pid)
+    return app
+
+server = util.FakeServerHost()
+server._port = int(sys.argv[1])
+workers.serve(server, create_app, 2)
+"""
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires os.fork()')
+class ServeTests(unittest.TestCase):
+
+    def free_port(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def get(self, port):
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/') as response:
+                    return int(response.read())
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def test_serve(self):
+        port = self.free_port()
+        process = subprocess.Popen([sys.executable, '-c', SERVE_SCRIPT, str(port)])
+        self.addCleanup(process.kill)
+        worker = self.get(port)
+        self.assertNotEqual(worker, process.pid)
+        # A worker which dies is replaced.
+        os.kill(worker, signal.SIGKILL)
+        deadline = time.monotonic() + 10
+        while self.get(port) == worker and time.monotonic() < deadline:
+            pass
+        self.assertNotEqual(self.get(port), worker)
+        # Shutting down is graceful.
+        process.terminate()
+        self.assertEqual(process.wait(timeout=10), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,316 @@
+"""Record real traffic and replay it, for comparing performance between commits.
+
+Unlike FakeSession, which answers instantly, a ReplaySession serves the
+recorded upstream responses with their recorded latency, optionally scaled
+to replay a long recording in accelerated time. Recorded deliveries are
+screened requests serialized by ContribHost.dump(), so replaying them
+exercises everything after screening.
+
+To record, run the bot with ``python3 -m ni.test.traffic DIRECTORY``; the
+fixtures are written to the directory on shutdown. Then replay them with
+``python3 -m benchmarks.traffic DIRECTORY`` on each commit to compare.
+"""
+import asyncio
+import base64
+import collections
+import json
+import math
+import os
+import time
+import types
+from typing import (Any, Awaitable, Callable, Counter, Deque, Dict, Iterable, List,
+                    Mapping, NamedTuple, Sequence, Tuple)
+
+import aiohttp
+from aiohttp import web
+from multidict import CIMultiDict
+from yarl import URL
+
+from .. import abc as ni_abc
+from .. import ContribHost
+
+
+DELIVERIES_FILE = 'deliveries.jsonl'
+EXCHANGES_FILE = 'exchanges.jsonl'
+
+
+class Exchange(NamedTuple):
+
+    """A request made upstream and its response."""
+
+    method: str
+    url: str
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+    latency: float
+
+
+class Delivery(NamedTuple):
+
+    """A screened request, serialized by ContribHost.dump()."""
+
+    offset: float
+    key: str
+    data: bytes
+
+
+def _encode(record: NamedTuple) -> str:
+    fields = record._asdict()
+    for name, value in fields.items():
+        if isinstance(value, bytes):
+            fields[name] = base64.b64encode(value).decode('ascii')
+    return json.dumps(fields)
+
+
+def _decode(record_class: Any, line: str) -> Any:
+    fields = json.loads(line)
+    for name in ('body', 'data'):
+        if name in fields:
+            fields[name] = base64.b64decode(fields[name])
+    if 'headers' in fields:
+        fields['headers'] = [tuple(header) for header in fields['headers']]
+    return record_class(**fields)
+
+
+def save(directory: str, deliveries: Iterable[Delivery],
+         exchanges: Iterable[Exchange]) -> None:
+    """Write recorded traffic as fixture files in the directory."""
+    os.makedirs(directory, exist_ok=True)
+    for file_name, records in ((DELIVERIES_FILE, deliveries),
+                               (EXCHANGES_FILE, exchanges)):
+        with open(os.path.join(directory, file_name), 'w', encoding='utf-8') as file:
+            for record in records:
+                file.write(_encode(record) + '\n')
+
+
+def load(directory: str) -> Tuple[List[Delivery], List[Exchange]]:
+    """Read the fixture files of recorded traffic in the directory."""
+    loaded = []
+    for file_name, record_class in ((DELIVERIES_FILE, Delivery),
+                                    (EXCHANGES_FILE, Exchange)):
+        with open(os.path.join(directory, file_name), encoding='utf-8') as file:
+            loaded.append([_decode(record_class, line) for line in file if line.strip()])
+    return loaded[0], loaded[1]
+
+
+class Recorder:
+
+    """Record deliveries and the upstream exchanges made while handling them.
+
+    Exchanges are recorded by tracing the requests of client sessions.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.deliveries: List[Delivery] = []
+        self.exchanges: List[Exchange] = []
+        self._trace = aiohttp.TraceConfig()
+        self._trace.on_request_start.append(self._request_started)
+        self._trace.on_request_end.append(self._request_ended)
+
+    def session(self, *args: Any, **kwargs: Any) -> aiohttp.ClientSession:
+        """Create a client session which records into this recorder."""
+        trace_configs = list(kwargs.pop('trace_configs', None) or [])
+        return aiohttp.ClientSession(*args, trace_configs=trace_configs + [self._trace],
+                                     **kwargs)
+
+    async def _request_started(self, session: aiohttp.ClientSession,
+                               context: types.SimpleNamespace,
+                               params: aiohttp.TraceRequestStartParams) -> None:
+        context.started = time.perf_counter()
+
+    async def _request_ended(self, session: aiohttp.ClientSession,
+                             context: types.SimpleNamespace,
+                             params: aiohttp.TraceRequestEndParams) -> None:
+        response = params.response
+        # Reading now leaves the body cached for the caller.
+        body = await response.read()
+        self.exchanges.append(Exchange(
+            params.method, str(params.url), response.status,
+            list(response.headers.items()), body,
+            time.perf_counter() - context.started))
+
+    @web.middleware
+    async def middleware(self, request: web.Request,
+                         handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+                         ) -> web.StreamResponse:
+        offset = time.monotonic() - self.started
+        response = await handler(request)
+        # Only screened requests can be dumped.
+        dumped = ContribHost.dump(request)
+        if dumped is not None:
+            self.deliveries.append(Delivery(offset, *dumped))
+        return response
+
+
+class ReplayedResponse:
+
+    """A recorded response, as much of one as the hosts use."""
+
+    def __init__(self, exchange: Exchange) -> None:
+        self.status = exchange.status
+        self.headers = CIMultiDict(exchange.headers)
+        self.url = URL(exchange.url)
+        self._body = exchange.body
+
+    async def __aenter__(self) -> "ReplayedResponse":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self) -> str:
+        return self._body.decode('utf-8')
+
+    async def json(self) -> Any:
+        return json.loads(self._body)
+
+
+class _Replaying:
+
+    """Await a replayed response, or use it as an async context manager."""
+
+    def __init__(self, response: Awaitable[ReplayedResponse]) -> None:
+        self._response = response
+
+    def __await__(self) -> Any:
+        return self._response.__await__()
+
+    async def __aenter__(self) -> ReplayedResponse:
+        return await self._response
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+
+class ReplaySession:
+
+    """Serve recorded exchanges with their recorded latency times the scale.
+
+    Exchanges for the same method and URL are served in the order they were
+    recorded, with the last one repeated once they run out. A request which
+    was never recorded is answered with a 404 and noted in ``unmatched``.
+    """
+
+    def __init__(self, exchanges: Iterable[Exchange], scale: float = 1.0) -> None:
+        self.scale = scale
+        self.calls: List[Tuple[str, str, float]] = []
+        self.unmatched: List[Tuple[str, str]] = []
+        self._exchanges: Dict[Tuple[str, str], Deque[Exchange]] = {}
+        for exchange in exchanges:
+            key = exchange.method, exchange.url
+            self._exchanges.setdefault(key, collections.deque()).append(exchange)
+
+    def __call__(self) -> "ReplaySession":
+        return self
+
+    async def __aenter__(self) -> "ReplaySession":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+    async def _respond(self, method: str, url: str) -> ReplayedResponse:
+        recorded = self._exchanges.get((method, url))
+        if not recorded:
+            self.unmatched.append((method, url))
+            exchange = Exchange(method, url, 404, [], b'{}', 0.0)
+        elif len(recorded) > 1:
+            exchange = recorded.popleft()
+        else:
+            exchange = recorded[0]
+        latency = exchange.latency * self.scale
+        if latency:
+            await asyncio.sleep(latency)
+        self.calls.append((method, url, latency))
+        return ReplayedResponse(exchange)
+
+    def request(self, method: str, url: Any, **kwargs: Any) -> _Replaying:
+        return _Replaying(self._respond(method.upper(), str(url)))
+
+    def get(self, url: Any, **kwargs: Any) -> _Replaying:
+        return self.request('GET', url)
+
+    def head(self, url: Any, **kwargs: Any) -> _Replaying:
+        return self.request('HEAD', url)
+
+    def post(self, url: Any, **kwargs: Any) -> _Replaying:
+        return self.request('POST', url)
+
+    def call_counts(self) -> Counter[str]:
+        """Count the calls made upstream by method and host."""
+        return collections.Counter(f'{method} {URL(url).host}'
+                                   for method, url, _ in self.calls)
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """Return the value at the fraction (e.g. 0.99) of the sorted values."""
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Report(NamedTuple):
+
+    """The outcome of replaying deliveries."""
+
+    statuses: Counter[int]
+    latencies: List[float]
+
+    def summary(self) -> Mapping[str, float]:
+        return {'deliveries': len(self.latencies),
+                **{f'p{round(fraction * 100)}': percentile(self.latencies, fraction)
+                   for fraction in (0.5, 0.9, 0.99)}}
+
+
+async def replay(deliveries: Iterable[Delivery],
+                 respond: Callable[[web.Request], Awaitable[web.Response]],
+                 scale: float = 1.0) -> Report:
+    """Handle the deliveries at their recorded offsets times the scale."""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    statuses: Counter[int] = collections.Counter()
+    latencies: List[float] = []
+
+    async def deliver(delivery: Delivery) -> None:
+        delay = started + delivery.offset * scale - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        request = ContribHost.load(delivery.data)
+        handling = loop.time()
+        response = await respond(request)
+        latencies.append(loop.time() - handling)
+        statuses[response.status] += 1
+
+    await asyncio.gather(*map(deliver, deliveries))
+    return Report(statuses, latencies)
+
+
+def record(server: ni_abc.ServerHost, directory: str) -> None:
+    """Serve the bot, recording its traffic into the directory."""
+    from .. import __main__
+
+    recorder = Recorder()
+    app = __main__.create_app(server, pool=__main__.ClientPool(recorder.session))
+    app.middlewares.append(recorder.middleware)
+
+    async def write(app: web.Application) -> None:
+        save(directory, recorder.deliveries, recorder.exchanges)
+        server.log(f"Recorded {len(recorder.deliveries)} deliveries and "
+                   f"{len(recorder.exchanges)} exchanges in {directory}")
+
+    app.on_cleanup.append(write)
+    web.run_app(app, port=server.port())
+
+
+if __name__ == '__main__':
+    import sys
+
+    from .. import ServerHost
+
+    record(ServerHost(), sys.argv[1])
@@ -1,5 +1,6 @@
 import asyncio
 import json
+import time
 import unittest
 from typing import Dict, Optional, Tuple
 
@@ -10,6 +11,19 @@ from multidict import CIMultiDict
 from .. import abc as ni_abc
 
 
+class FakeStreamReader:
+
+    """Provide the body of a request in chunks, like aiohttp.StreamReader."""
+
+    def __init__(self, data, chunk_size=2**16):
+        self._data = data
+        self._chunk_size = chunk_size
+
+    async def iter_any(self):
+        for start in range(0, len(self._data), self._chunk_size):
+            yield self._data[start:start + self._chunk_size]
+
+
 class FakeRequest(web.Request):
 
     """Provide a base class for faking requests.
@@ -30,10 +44,19 @@ class FakeRequest(web.Request):
     def __init__(self, payload={}, content_type='application/json'):
         self._content_type = content_type
         self._payload = payload
+        self._state = {}
         self._headers = {"x-github-event": "pull_request",
                          "x-github-delivery": "12345",
                          "content-type": "application/json"}
 
+    @property
+    def content(self):
+        return FakeStreamReader(json.dumps(self._payload).encode("utf-8"))
+
+    @property
+    def content_length(self):
+        return len(json.dumps(self._payload).encode("utf-8"))
+
     async def read(self):
         return json.dumps(self._payload).encode("utf-8")
 
@@ -105,13 +128,123 @@ class FakeSession(aiohttp.ClientSession):
         return self.request("DELETE", url, headers=headers)
 
 
+class FakeRedis:
+
+    """A Redis server on localhost knowing only the commands ni.cache sends.
+
+    Every command received is recorded, decoded.
+    """
+
+    def __init__(self, password=None):
+        self.password = password
+        self.values = {}
+        self.commands = []
+        self.connections = 0
+        self._writers = []
+        self._serving = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f'redis://127.0.0.1:{port}'
+        return self
+
+    async def stop(self):
+        self._server.close()
+        # Each client's handler finishes once its connection is closed.
+        self.drop()
+        await asyncio.gather(*self._serving, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def drop(self):
+        """Close every client's connection."""
+        for writer in self._writers:
+            writer.close()
+        self._writers.clear()
+
+    @staticmethod
+    async def _read_command(reader):
+        count = int((await reader.readuntil(b'\r\n'))[1:-2])
+        command = []
+        for _ in range(count):
+            length = int((await reader.readuntil(b'\r\n'))[1:-2])
+            command.append((await reader.readexactly(length + 2))[:-2])
+        return command
+
+    @staticmethod
+    def _bulk(value):
+        if value is None:
+            return b'$-1\r\n'
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def _get(self, database, key):
+        expires, value = self.values.get((database, key), (None, None))
+        if expires is not None and expires <= time.monotonic():
+            del self.values[database, key]
+            return None
+        return value
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        self._writers.append(writer)
+        task = asyncio.current_task()
+        self._serving.add(task)
+        database = 0
+        authenticated = self.password is None
+        try:
+            while True:
+                command = await self._read_command(reader)
+                self.commands.append([part.decode() for part in command])
+                name, *arguments = command
+                name = name.upper()
+                if name == b'AUTH':
+                    authenticated = arguments[0].decode() == self.password
+                    reply = b'+OK\r\n' if authenticated else b'-WRONGPASS invalid password\r\n'
+                elif not authenticated:
+                    reply = b'-NOAUTH Authentication required.\r\n'
+                elif name == b'SELECT':
+                    database = int(arguments[0])
+                    reply = b'+OK\r\n'
+                elif name == b'MGET':
+                    reply = b'*%d\r\n' % len(arguments) + b''.join(
+                        self._bulk(self._get(database, key)) for key in arguments)
+                elif name == b'SET':
+                    key, value, *options = arguments
+                    expires = None
+                    if options and options[0].upper() == b'PX':
+                        expires = time.monotonic() + int(options[1]) / 1000
+                    self.values[database, key] = expires, value
+                    reply = b'+OK\r\n'
+                else:
+                    reply = b"-ERR unknown command '%s'\r\n" % name
+                writer.write(reply)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._serving.discard(task)
+            writer.close()
+
+
 class FakeServerHost(ni_abc.ServerHost):
 
     _port = 1234
     auth_token = 'some_auth_token'
+    app_id: Optional[str] = None
+    private_key: Optional[str] = None
     secret: Optional[str] = None
     user_agent_name = 'Testing-Agent'
     trusted_usernames = ''
+    cla_index: Optional[str] = None
+    edit_comments = False
+    status_repos = frozenset()
+    warm_up_repos = frozenset()
+    priority_repos = frozenset()
+    journal_dir: Optional[str] = None
+    hedge_fraction = 0.0
+    admin: Optional[str] = None
+    loop_monitor_dir: Optional[str] = None
+    cache: Optional[str] = None
+    warm_up_seconds = 30.0
 
     def port(self):
         """Specify the port to bind the listening socket to."""
@@ -120,6 +253,12 @@ class FakeServerHost(ni_abc.ServerHost):
     def contrib_auth_token(self):
         return self.auth_token
 
+    def contrib_app_id(self):
+        return self.app_id
+
+    def contrib_private_key(self):
+        return self.private_key
+
     def contrib_secret(self):
         return self.secret
 
@@ -140,6 +279,39 @@ class FakeServerHost(ni_abc.ServerHost):
         return frozenset(frozenset([trusted.strip().lower()
                 for trusted in self.trusted_usernames.split(",")]))
 
+    def status_repositories(self):
+        return self.status_repos
+
+    def priority_repositories(self):
+        return self.priority_repos
+
+    def warm_up_repositories(self):
+        return self.warm_up_repos
+
+    def warm_up_deadline(self):
+        return self.warm_up_seconds
+
+    def update_comments(self):
+        return self.edit_comments
+
+    def hedge_budget(self):
+        return self.hedge_fraction
+
+    def journal_directory(self):
+        return self.journal_dir
+
+    def loop_monitor_directory(self):
+        return self.loop_monitor_dir
+
+    def admin_token(self):
+        return self.admin
+
+    def cache_url(self):
+        return self.cache
+
+    def cla_index_path(self):
+        return self.cla_index
+
 
 class TestCase(unittest.TestCase):
 
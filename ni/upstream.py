@@ -0,0 +1,230 @@
+"""Time out, hedge and retry calls to an upstream service."""
+import asyncio
+import collections
+import email.utils
+import random
+import time
+from typing import Awaitable, Callable, Deque, Dict, List, Mapping, Optional, Set, TypeVar
+
+import aiohttp
+
+
+# Latencies are tracked over this many of the most recent calls; until there
+# are MIN_SAMPLES of them DEFAULT_TIMEOUT is used and nothing is hedged.
+WINDOW = 1000
+MIN_SAMPLES = 20
+DEFAULT_TIMEOUT = 10.0
+MIN_TIMEOUT = 1.0
+MAX_TIMEOUT = 30.0
+TIMEOUT_FACTOR = 3.0
+TIMEOUT_PERCENTILE = 0.99
+HEDGE_PERCENTILE = 0.95
+# Percentiles are recomputed after this many new samples.
+REFRESH_INTERVAL = 16
+# Idempotent calls are made up to RETRY_ATTEMPTS times, backing off
+# exponentially from RETRY_BASE_DELAY with full jitter. An upstream asking
+# for a longer wait than RETRY_MAX_DELAY is not retried.
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.25
+RETRY_MAX_DELAY = 10.0
+# Every call earns RETRY_RATIO of a retry, up to RETRY_RESERVE retries, so
+# that retries stay a small fraction of calls when an upstream is down.
+RETRY_RATIO = 0.1
+RETRY_RESERVE = 10.0
+TRANSIENT_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+T = TypeVar('T')
+
+
+class Transient(Exception):
+
+    """An upstream failure which may not happen again.
+
+    The upstream may say how many seconds to wait before trying again.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+TRANSIENT_ERRORS = (Transient, asyncio.TimeoutError, aiohttp.ClientConnectionError,
+                    ConnectionError)
+
+
+def retry_after(headers: Mapping[str, str],
+                now: Optional[float] = None) -> Optional[float]:
+    """Return how many seconds the response headers ask to wait, if any.
+
+    Both a Retry-After header (in seconds or as a date) and an exhausted
+    rate limit with the time it resets (as GitHub sends) are understood.
+    """
+    now = time.time() if now is None else now
+    value = headers.get('retry-after')
+    if value is not None:
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - now)
+        except (TypeError, ValueError):
+            return None
+    if headers.get('x-ratelimit-remaining') == '0':
+        reset = headers.get('x-ratelimit-reset', '')
+        if reset.isdigit():
+            return max(0.0, int(reset) - now)
+    return None
+
+
+def backoff(attempt: int) -> float:
+    """Return a jittered delay before retrying after the attempt (from 0)."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class RetryBudget:
+
+    """Limit retries to a fraction of calls, shared by every upstream."""
+
+    def __init__(self, ratio: float = RETRY_RATIO,
+                 reserve: float = RETRY_RESERVE) -> None:
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = reserve
+        self.retries = self.exhausted = 0
+
+    def deposit(self) -> None:
+        self.tokens = min(self.reserve, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Spend a retry, returning False if there is none to spend."""
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        self.retries += 1
+        return True
+
+
+retry_budget = RetryBudget()
+
+
+class Upstream:
+
+    """Track the latency of calls to an upstream to time them out adaptively.
+
+    A call times out after the recent p99 latency times TIMEOUT_FACTOR,
+    within MIN_TIMEOUT and MAX_TIMEOUT. A call which may be hedged is made
+    a second time should it take longer than the p95 latency, with whichever
+    finishes first winning; hedges are kept to the hedge budget, a fraction
+    of all calls. A call which may be retried is made again after a
+    transient failure, as long as the retry budget allows.
+    """
+
+    def __init__(self, name: str, hedge_budget: float = 0.0,
+                 budget: Optional[RetryBudget] = None) -> None:
+        self.name = name
+        self.hedge_budget = hedge_budget
+        self.budget = budget if budget is not None else retry_budget
+        self.calls = self.hedges = self.timeouts = self.retries = 0
+        self._latencies: Deque[float] = collections.deque(maxlen=WINDOW)
+        self._percentiles: Dict[float, float] = {}
+        self._unrefreshed = 0
+
+    def record(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self._unrefreshed += 1
+        if self._unrefreshed >= REFRESH_INTERVAL:
+            self._percentiles.clear()
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Return the recent latency percentile, or None without enough samples."""
+        if len(self._latencies) < MIN_SAMPLES:
+            return None
+        if fraction not in self._percentiles:
+            ordered = sorted(self._latencies)
+            self._percentiles[fraction] = ordered[
+                min(len(ordered) - 1, int(fraction * len(ordered)))]
+            self._unrefreshed = 0
+        return self._percentiles[fraction]
+
+    def timeout(self) -> float:
+        latency = self.percentile(TIMEOUT_PERCENTILE)
+        if latency is None:
+            return DEFAULT_TIMEOUT
+        return min(MAX_TIMEOUT, max(MIN_TIMEOUT, latency * TIMEOUT_FACTOR))
+
+    def hedge_delay(self) -> Optional[float]:
+        """Return how long to wait before hedging, or None to not hedge."""
+        if self.hedges + 1 > self.hedge_budget * self.calls:
+            return None
+        return self.percentile(HEDGE_PERCENTILE)
+
+    async def call(self, request: Callable[[], Awaitable[T]], *,
+                   hedge: bool = False, retry: bool = False) -> T:
+        """Make the request, raising asyncio.TimeoutError if it takes too long.
+
+        Only idempotent requests may be hedged or retried. The request
+        raises Transient for a failure worth retrying.
+        """
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(request, hedge)
+            except TRANSIENT_ERRORS as exc:
+                if not retry or attempt + 1 >= RETRY_ATTEMPTS:
+                    raise
+                delay = backoff(attempt)
+                wait = getattr(exc, 'retry_after', None)
+                if wait is not None:
+                    if wait > RETRY_MAX_DELAY:
+                        raise
+                    delay = max(delay, wait)
+                if not self.budget.withdraw():
+                    raise
+            self.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _attempt(self, request: Callable[[], Awaitable[T]], hedge: bool) -> T:
+        self.calls += 1
+        timeout = self.timeout()
+        started = time.monotonic()
+        attempts: Set["asyncio.Future[T]"] = {asyncio.ensure_future(request())}
+        failures: List[BaseException] = []
+        try:
+            delay = self.hedge_delay() if hedge else None
+            if delay is not None and delay < timeout:
+                finished, _ = await asyncio.wait(attempts, timeout=delay)
+                if not finished:
+                    self.hedges += 1
+                    attempts.add(asyncio.ensure_future(request()))
+            while attempts:
+                remaining = timeout - (time.monotonic() - started)
+                finished, attempts = await asyncio.wait(
+                    attempts, timeout=max(0.0, remaining),
+                    return_when=asyncio.FIRST_COMPLETED)
+                if not finished:
+                    break
+                for attempt in finished:
+                    failure = attempt.exception()
+                    if failure is None:
+                        self.record(time.monotonic() - started)
+                        return attempt.result()
+                    failures.append(failure)
+            if failures:
+                raise failures[0]
+            self.timeouts += 1
+            # Count the timeout so that a slowing upstream raises the timeout.
+            self.record(timeout)
+            raise asyncio.TimeoutError(f'{self.name} took longer than {timeout:.2f}s')
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            if attempts:
+                await asyncio.gather(*attempts, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        return {'calls': self.calls, 'hedges': self.hedges, 'timeouts': self.timeouts,
+                'retries': self.retries,
+                'timeout': self.timeout(), 'p50': self.percentile(0.5),
+                'p99': self.percentile(TIMEOUT_PERCENTILE)}
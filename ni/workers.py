@@ -0,0 +1,155 @@
+"""Run several worker processes which share a single listening socket."""
+import asyncio
+import contextlib
+import os
+import signal
+import socket
+import time
+import zlib
+from typing import IO, AsyncIterator, Callable, ContextManager, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+from aiohttp import web
+
+from . import abc as ni_abc
+
+
+# How long to wait between attempts to take a cross-process lock.
+LOCK_POLL_INTERVAL = 0.05
+# Workers which exit sooner than this after starting are restarted with a delay.
+RESTART_BACKOFF = 1.0
+
+
+class ContributionLocks:
+
+    """Serialize work on the same contribution.
+
+    Within a process an asyncio lock per key is used. When a directory is
+    given, keys are also hashed onto a fixed number of lock files so that
+    separate worker processes exclude each other as well.
+    """
+
+    def __init__(self, directory: Optional[str] = None, stripes: int = 64) -> None:
+        self.directory = directory
+        self.stripes = stripes
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._waiters: Dict[str, int] = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key: str) -> AsyncIterator[None]:
+        """Hold the lock for the key for the duration of the context."""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                if self.directory is None or fcntl is None:
+                    yield
+                else:
+                    with await self._file_lock(key):
+                        yield
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def _file_lock(self, key: str) -> ContextManager[IO[bytes]]:
+        assert self.directory is not None
+        stripe = zlib.crc32(key.encode('utf-8')) % self.stripes
+        path = os.path.join(self.directory, f'{stripe}.lock')
+        file = open(path, 'wb')
+        try:
+            while True:
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    await asyncio.sleep(LOCK_POLL_INTERVAL)
+                else:
+                    # Closing the file releases the lock.
+                    return contextlib.closing(file)
+        except BaseException:
+            file.close()
+            raise
+
+
+def listen(port: int, backlog: int = 128) -> socket.socket:
+    """Create a listening socket which child processes can inherit."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('0.0.0.0', port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+
+    """Pre-fork worker processes, restarting any which die unexpectedly.
+
+    SIGTERM or SIGINT is forwarded to every worker so that they shut down
+    gracefully, after which the supervisor returns.
+    """
+
+    def __init__(self, server: ni_abc.ServerHost,
+                 target: Callable[[], None], workers: int) -> None:
+        self.server = server
+        self.target = target
+        self.workers = workers
+        self.children: Dict[int, float] = {}
+        self.stopping = False
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            status = 0
+            try:
+                self.target()
+            except BaseException as exc:
+                self.server.log_exception(exc)
+                status = 1
+            finally:
+                os._exit(status)
+        self.children[pid] = time.monotonic()
+        self.server.log(f"Started worker {pid}")
+
+    def stop(self, signum: int, frame: object = None) -> None:
+        self.stopping = True
+        for pid in self.children:
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        while self.children:
+            pid, status = os.wait()
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            self.server.log(f"Worker {pid} exited with status {status}; restarting")
+            if time.monotonic() - started < RESTART_BACKOFF:
+                time.sleep(RESTART_BACKOFF)
+            if not self.stopping:
+                self.spawn()
+
+
+def serve(server: ni_abc.ServerHost, create_app: Callable[[], web.Application],
+          workers: int) -> None:
+    """Serve the app from several processes sharing the server's port."""
+    sock = listen(server.port())
+
+    def target() -> None:
+        web.run_app(create_app(), sock=sock, print=None)
+
+    try:
+        Supervisor(server, target, workers).run()
+    finally:
+        sock.close()